@@ -0,0 +1,336 @@
+"""Retention: move old processed events out of `webhook_events` into an archive.
+
+`webhook_events` and its unique `webhook_id` index otherwise grow forever, and
+every idempotency claim pays for that. The `Archiver` moves `processed` events
+received before a horizon into append-only gzip JSONL segments, one per day of
+`received_at` (`webhook_events-YYYY-MM-DD.jsonl.gz`, one gzip member per batch).
+
+Deleting a row would forget its webhook_id, so each archived event leaves an
+8-byte fingerprint in `archived_webhooks` until the dedup window has passed;
+the receiver treats a claim whose fingerprint is there as a duplicate. It also
+moves the payment's `archived_through` mark, which tells `app.projection` that
+the payment's log is no longer complete in the table.
+
+Work is done in batches of `batch_size` rows, each in its own short
+transaction, with a pause between batches so webhook writers are never locked
+out for long. A segment is written and fsynced before its rows are deleted; a
+crash in between re-archives those rows on the next run, so readers
+(`read_archive`) de-duplicate by event id.
+
+    python -m app.archive --archive-dir /var/lib/fulfillhub/archive --horizon-days 7
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models import ArchivedThrough, ArchivedWebhook, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PROBE_RECHECK = 1.0  # seconds a receiver trusts "nothing is archived"
+# Keep IN lists well under SQLite's bound-parameter limit.
+_CHUNK_SIZE = 500
+# Indexes made redundant by a unique constraint on the same column.
+REDUNDANT_INDEXES = ("ix_webhook_events_webhook_id",)
+
+
+@dataclass(frozen=True)
+class RetentionConfig:
+    archive_dir: str
+    horizon: timedelta = timedelta(days=7)
+    # How long an archived webhook_id is still recognised as a duplicate.
+    dedup_window: timedelta = timedelta(days=30)
+    batch_size: int = ARCHIVE_BATCH_SIZE
+    pause: float = 0.05  # seconds between batches
+    interval: float = 300.0  # seconds between background runs
+
+
+def fingerprint(webhook_id: str) -> int:
+    """Signed 64-bit BLAKE2b digest of a webhook_id (fits a BIGINT)."""
+    digest = hashlib.blake2b(webhook_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def is_archived(db: Session, webhook_id: str) -> bool:
+    return db.get(ArchivedWebhook, fingerprint(webhook_id)) is not None
+
+
+class ArchiveProbe:
+    """Tells the webhook path whether a claim needs the `is_archived` lookup.
+
+    It does when this process archives. Otherwise archiving can only have been
+    done by another process (`python -m app.archive`), so the lookup is made
+    while `archived_webhooks` has rows, re-checked every `recheck` seconds.
+    That spares a receiver without retention a SELECT per webhook, at a price:
+    for up to `recheck` seconds after another process first archives, a
+    redelivery of a just-archived webhook_id is accepted as a new event.
+    """
+
+    def __init__(self, archiving: bool, recheck: float = ARCHIVE_PROBE_RECHECK) -> None:
+        self._archiving = archiving
+        self._recheck = recheck
+        self._has_rows = False
+        self._next_check = 0.0
+
+    def needed(self, db: Session) -> bool:
+        if self._archiving:
+            return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._has_rows = db.scalar(select(ArchivedWebhook.fingerprint).limit(1)) is not None
+            self._next_check = now + self._recheck
+        return self._has_rows
+
+
+def archived_webhook_ids(db: Session, webhook_ids: Iterable[str]) -> set[str]:
+    """The subset of `webhook_ids` whose events have been archived."""
+    by_fingerprint = {fingerprint(w): w for w in webhook_ids}
+    found: set[str] = set()
+    keys = list(by_fingerprint)
+    for start in range(0, len(keys), _CHUNK_SIZE):
+        found.update(
+            by_fingerprint[fp] for fp in db.scalars(
+                select(ArchivedWebhook.fingerprint)
+                .where(ArchivedWebhook.fingerprint.in_(keys[start:start + _CHUNK_SIZE]))
+            )
+        )
+    return found
+
+
+def drop_redundant_indexes(engine: Engine) -> None:
+    """Drop indexes that duplicate a unique constraint (databases created before they went)."""
+    with engine.begin() as conn:
+        for name in REDUNDANT_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _record(event: WebhookEvent) -> dict:
+    return {
+        "id": event.id,
+        "webhook_id": event.webhook_id,
+        "payment_id": event.payment_id,
+        "event_type": event.event_type,
+        "payload": event.payload,
+        "processing_status": event.processing_status,
+        "received_at": _as_utc(event.received_at).isoformat(),
+        "processed_at": _as_utc(event.processed_at).isoformat() if event.processed_at else None,
+    }
+
+
+def _mark_archived(db: Session, events: list[WebhookEvent]) -> None:
+    """Move each payment's `archived_through` mark up to its last archived event."""
+    through: dict[str, int] = {}
+    for event in events:  # in id order
+        through[event.payment_id] = event.id
+    payment_ids = list(through)
+    existing: set[str] = set()
+    for start in range(0, len(payment_ids), _CHUNK_SIZE):
+        existing.update(db.scalars(
+            select(ArchivedThrough.payment_id)
+            .where(ArchivedThrough.payment_id.in_(payment_ids[start:start + _CHUNK_SIZE]))
+        ))
+    rows = [{"payment_id": p, "last_event_id": through[p]} for p in payment_ids]
+    if existing:
+        db.execute(update(ArchivedThrough), [r for r in rows if r["payment_id"] in existing])
+    if len(existing) < len(rows):
+        db.execute(insert(ArchivedThrough), [r for r in rows if r["payment_id"] not in existing])
+
+
+def segment_path(archive_dir: str | Path, day: str) -> Path:
+    return Path(archive_dir) / f"webhook_events-{day}.jsonl.gz"
+
+
+def _append_segments(archive_dir: str, records: list[dict]) -> None:
+    """Append records to their day's segment as one gzip member, then fsync."""
+    by_day: dict[str, list[dict]] = defaultdict(list)
+    for record in records:
+        by_day[record["received_at"][:10]].append(record)
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, day_records in by_day.items():
+        lines = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in day_records)
+        with open(segment_path(archive_dir, day), "ab") as raw:
+            raw.write(gzip.compress(lines.encode("utf-8")))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def read_archive(archive_dir: str | Path) -> Iterator[dict]:
+    """Yield archived events, oldest segment first, each event id once."""
+    seen: set[int] = set()
+    for path in sorted(Path(archive_dir).glob("webhook_events-*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as segment:
+            for line in segment:
+                record = json.loads(line)
+                if record["id"] not in seen:
+                    seen.add(record["id"])
+                    yield record
+
+
+class Archiver:
+    """Moves old processed events to the archive, batch by batch.
+
+    Args:
+        config: Horizon, dedup window, batch size and pacing.
+        session_scope: Zero-arg callable returning a session context manager.
+        run_db: Callable(fn, *args) that runs blocking DB work in the app's DB
+            lane; defaults to calling `fn` directly.
+    """
+
+    def __init__(
+        self, config: RetentionConfig, session_scope: Callable, run_db: Callable | None = None,
+    ) -> None:
+        self.config = config
+        self._session_scope = session_scope
+        self._run_db = run_db or (lambda fn, *args: fn(*args))
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.batches = 0
+        self.archived = 0
+        self.expired_fingerprints = 0
+        self.last_run_seconds = 0.0
+        self.max_batch_seconds = 0.0
+
+    def _archive_batch(self, cutoff: datetime) -> int:
+        """Archive up to batch_size events received before `cutoff`; returns the count."""
+        started = time.perf_counter()
+        with self._session_scope() as db:
+            events = db.scalars(
+                select(WebhookEvent)
+                .where(
+                    WebhookEvent.processing_status == "processed",
+                    WebhookEvent.received_at < cutoff,
+                )
+                .order_by(WebhookEvent.id)
+                .limit(self.config.batch_size)
+            ).all()
+            if not events:
+                return 0
+            _append_segments(self.config.archive_dir, [_record(e) for e in events])
+            db.execute(insert(ArchivedWebhook), [
+                {"fingerprint": fingerprint(e.webhook_id), "received_at": e.received_at}
+                for e in events
+            ])
+            _mark_archived(db, events)
+            db.execute(delete(WebhookEvent).where(WebhookEvent.id.in_([e.id for e in events])))
+            try:
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.batches += 1
+            self.archived += len(events)
+            self.max_batch_seconds = max(self.max_batch_seconds, elapsed)
+        return len(events)
+
+    def _expire_fingerprints(self, before: datetime) -> int:
+        with self._session_scope() as db:
+            expired = db.execute(
+                delete(ArchivedWebhook).where(ArchivedWebhook.received_at < before)
+            ).rowcount
+            db.commit()
+        with self._lock:
+            self.expired_fingerprints += expired
+        return expired
+
+    def run_once(self, now: datetime | None = None) -> int:
+        """Archive everything past the horizon and expire old fingerprints.
+
+        Returns the number of events archived. Stops early (between batches)
+        when the background thread is asked to stop.
+        """
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        total = 0
+        while not self._stop.is_set():
+            moved = self._run_db(self._archive_batch, now - self.config.horizon)
+            total += moved
+            if moved < self.config.batch_size:
+                break
+            self._stop.wait(self.config.pause)
+        self._run_db(self._expire_fingerprints, now - self.config.dedup_window)
+        with self._lock:
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - started
+        return total
+
+    # ── Background thread ────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.config.interval):
+            try:
+                self.run_once()
+            except Exception:  # noqa: BLE001
+                logger.exception("Archive run failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "batches": self.batches,
+                "archived": self.archived,
+                "expired_fingerprints": self.expired_fingerprints,
+                "last_run_seconds": round(self.last_run_seconds, 4),
+                "max_batch_seconds": round(self.max_batch_seconds, 4),
+            }
+
+
+def main(argv: list[str] | None = None) -> None:
+    from app.database import SessionLocal, engine, init_db
+
+    parser = argparse.ArgumentParser(description="Archive old processed webhook events.")
+    parser.add_argument("--archive-dir", required=True)
+    parser.add_argument("--horizon-days", type=float, default=7)
+    parser.add_argument("--dedup-window-days", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()  # creates archived_webhooks on databases that predate it
+    drop_redundant_indexes(engine)
+    archiver = Archiver(
+        RetentionConfig(
+            archive_dir=args.archive_dir,
+            horizon=timedelta(days=args.horizon_days),
+            dedup_window=timedelta(days=args.dedup_window_days),
+            batch_size=args.batch_size,
+        ),
+        session_scope=SessionLocal,
+    )
+    print(f"archived {archiver.run_once()} events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Bulk webhook processing: one idempotency claim, one payment load, one commit.
+
+`process_events` is the batch counterpart of `_process_event` in `app.main`. It
+produces the same per-event outcomes (accepted / deferred / idempotent / 404 /
+422) but does the database work for the whole batch in a handful of statements.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, NamedTuple, Sequence
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.archive import archived_webhook_ids
+from app.models import Payment, WebhookEvent
+from app.payloads import payload_columns
+from app.state_machine import TransitionResult, fold, rejection_reason
+
+if TYPE_CHECKING:
+    from app.scheduler import DeferredIndex
+
+MAX_BATCH_EVENTS = 1000
+# Keep IN lists and multi-row VALUES well under SQLite's bound-parameter limit.
+CHUNK_SIZE = 500
+
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class BatchEvent(NamedTuple):
+    webhook_id: str
+    event_type: str
+    payment_id: str
+    payload: str
+
+
+def _chunks(items: Sequence, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _claim(
+    db: Session, events: Sequence[BatchEvent], now: datetime, payload_storage: str,
+) -> dict[str, int]:
+    """Insert events, skipping webhook_ids that already exist.
+
+    Returns {webhook_id: event row id} for the rows that were newly inserted.
+    Dialects without INSERT ... ON CONFLICT get one savepointed insert per event.
+    """
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        return _claim_each(db, events, now, payload_storage)
+    claimed: dict[str, int] = {}
+    for chunk in _chunks(events):
+        stmt = (
+            insert(WebhookEvent)
+            .values([_event_row(e, now, payload_storage) for e in chunk])
+            .on_conflict_do_nothing(index_elements=["webhook_id"])
+            .returning(WebhookEvent.webhook_id, WebhookEvent.id)
+        )
+        claimed.update(db.execute(stmt).tuples().all())
+    return claimed
+
+
+def _claim_each(
+    db: Session, events: Sequence[BatchEvent], now: datetime, payload_storage: str,
+) -> dict[str, int]:
+    claimed: dict[str, int] = {}
+    for e in events:
+        event = WebhookEvent(**_event_row(e, now, payload_storage))
+        try:
+            with db.begin_nested():
+                db.add(event)
+        except IntegrityError:
+            continue
+        claimed[e.webhook_id] = event.id
+    return claimed
+
+
+def _event_row(e: BatchEvent, now: datetime, payload_storage: str) -> dict:
+    return {
+        "webhook_id": e.webhook_id,
+        "payment_id": e.payment_id,
+        "event_type": e.event_type,
+        **payload_columns(e.payload, payload_storage),
+        "processing_status": "processing",
+        "received_at": now,
+    }
+
+
+def process_events(
+    db: Session,
+    events: Sequence[BatchEvent],
+    payload_storage: str = "text",
+    deferred_index: "DeferredIndex | None" = None,
+) -> list[dict]:
+    """
+    Process many webhook events in one transaction.
+
+    Steps: load every referenced Payment with IN queries; claim idempotency for
+    events of known payments with a multi-row INSERT ... ON CONFLICT DO NOTHING
+    RETURNING; fold each payment's already-deferred plus new events through the
+    compiled state machine in memory; write statuses back and commit once.
+
+    Returns one result dict per input event, in input order. Database errors
+    propagate to the caller for retry (nothing is committed in that case).
+    After the commit, `deferred_index` (if given) gains the newly deferred
+    events and loses the ones this batch applied.
+    """
+    now = datetime.now(timezone.utc)
+    results: list[dict | None] = [None] * len(events)
+
+    # 1. Load all affected payments
+    payment_ids = list(dict.fromkeys(e.payment_id for e in events))
+    payments: dict[str, Payment] = {}
+    for chunk in _chunks(payment_ids):
+        for payment in db.scalars(select(Payment).where(Payment.id.in_(chunk))):
+            payments[payment.id] = payment
+
+    # 2. Unknown payments -> 404 without claiming; repeats within the batch -> idempotent
+    to_claim: list[BatchEvent] = []
+    positions: dict[str, int] = {}
+    for index, e in enumerate(events):
+        if e.payment_id not in payments:
+            results[index] = {
+                "webhook_id": e.webhook_id, "status_code": 404,
+                "error": f"Payment '{e.payment_id}' not found",
+            }
+        elif e.webhook_id in positions:
+            results[index] = idempotent_result(e.webhook_id)
+        else:
+            positions[e.webhook_id] = index
+            to_claim.append(e)
+
+    # 3. Bulk idempotency claim
+    claimed = _claim(db, to_claim, now, payload_storage) if to_claim else {}
+    # Claims of archived webhook_ids are duplicates too; their rows are dropped in step 6
+    rejected: list[int] = []
+    for webhook_id in archived_webhook_ids(db, claimed):
+        rejected.append(claimed.pop(webhook_id))
+    new_by_payment: dict[str, list[BatchEvent]] = defaultdict(list)
+    for e in to_claim:
+        if e.webhook_id in claimed:
+            new_by_payment[e.payment_id].append(e)
+        else:
+            results[positions[e.webhook_id]] = idempotent_result(e.webhook_id)
+
+    # 4. Deferred events already waiting on the affected payments
+    waiting: dict[str, list[WebhookEvent]] = defaultdict(list)
+    affected = list(new_by_payment)
+    for chunk in _chunks(affected):
+        for event in db.scalars(
+            select(WebhookEvent)
+            .where(
+                WebhookEvent.payment_id.in_(chunk),
+                WebhookEvent.processing_status == "deferred",
+            )
+            .order_by(WebhookEvent.id)
+        ):
+            waiting[event.payment_id].append(event)
+
+    # 5. Fold each payment's event sequence in memory
+    processed: list[dict] = []
+    deferred: list[dict] = []
+    newly_deferred: list[tuple[int, BatchEvent]] = []
+    unblocked: list[int] = []
+    for payment_id, new_events in new_by_payment.items():
+        payment = payments[payment_id]
+        old = waiting.get(payment_id, [])
+        folded = fold(payment.status, [e.event_type for e in (*old, *new_events)])
+
+        for event, result in zip(old, folded.results):
+            if result is TransitionResult.APPLIED:
+                event.processing_status = "processed"
+                event.processed_at = now
+                unblocked.append(event.id)
+
+        for e, result in zip(new_events, folded.results[len(old):]):
+            index = positions[e.webhook_id]
+            row_id = claimed[e.webhook_id]
+            if result is TransitionResult.INVALID:
+                rejected.append(row_id)
+                results[index] = {
+                    "webhook_id": e.webhook_id, "status_code": 422,
+                    # A known event is only INVALID once the payment is terminal,
+                    # and terminal states are final, so folded.status is that state.
+                    "error": rejection_reason(folded.status, e.event_type),
+                }
+            elif result is TransitionResult.DEFERRED:
+                deferred.append({"id": row_id, "processing_status": "deferred"})
+                newly_deferred.append((row_id, e))
+                results[index] = {
+                    "webhook_id": e.webhook_id, "status_code": 202, "status": "deferred",
+                }
+            else:
+                processed.append(
+                    {"id": row_id, "processing_status": "processed", "processed_at": now}
+                )
+                results[index] = {
+                    "webhook_id": e.webhook_id, "status_code": 200, "status": "accepted",
+                }
+
+        if folded.status != payment.status:
+            payment.status = folded.status
+            payment.updated_at = now
+
+    # 6. Write back and commit once
+    for updates in (processed, deferred):
+        if updates:
+            db.execute(update(WebhookEvent), updates)
+    for chunk in _chunks(rejected):
+        db.execute(delete(WebhookEvent).where(WebhookEvent.id.in_(chunk)))
+    db.commit()
+    if deferred_index is not None:
+        deferred_index.remove(unblocked)
+        for row_id, e in newly_deferred:
+            deferred_index.add(row_id, e.payment_id, e.event_type, now)
+    return results
+
+
+def idempotent_result(webhook_id: str) -> dict:
+    """Per-event result for a webhook_id that was already claimed."""
+    return {
+        "webhook_id": webhook_id, "status_code": 200,
+        "status": "accepted", "idempotent": True,
+    }
@@ -0,0 +1,337 @@
+"""Multi-process deployment: receiver workers behind a payment-affinity router.
+
+`Cluster` starts N uvicorn worker processes, each serving `create_app` on its
+own local port against the same database, plus a router in the launcher
+process. The router reads just enough of each webhook to find its payment_id
+and forwards the untouched body and signature headers to worker
+`partition_for(payment_id) % N`. Every event for a payment is therefore
+handled by one process, where the per-payment lock, deferred replay and the
+idempotency front cache stay local and exact. A batch goes to the worker that
+owns all of its payments; a batch whose payments belong to different workers
+is refused with 422, since the router cannot split a signed body.
+
+State that must agree across workers lives in the shared database: the
+unique `webhook_id` index behind idempotency and, with
+`replay_protection="database"`, the `seen_signatures` table. For SQLite,
+point every worker at one WAL-mode file:
+
+    python -m app.cluster --workers 4 --port 8000 --database-url sqlite:///./fulfillhub.db
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Sequence
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+from app.ingest import partition_for
+from app.main import MAX_BODY_SIZE
+from app.metrics import Metrics
+from app.streaming import BodyTooLarge, read_bounded
+
+logger = logging.getLogger(__name__)
+
+WORKER_STARTUP_TIMEOUT = 30.0
+# Headers that describe one hop and must not be forwarded
+_HOP_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding"}
+
+
+def worker_for(payment_id: str, workers: int) -> int:
+    """Worker index that owns `payment_id`; stable across processes and restarts."""
+    return partition_for(payment_id) % workers
+
+
+def routing_keys(body: bytes) -> list[str]:
+    """Distinct payment_ids of a single webhook or of the events of a batch.
+
+    Events without a recognisable payment_id are left out; the worker they are
+    sent to rejects them with the usual 400/422.
+    """
+    try:
+        document = json.loads(body)
+    except (ValueError, RecursionError):  # the worker answers it with 400
+        return []
+    events = [document]
+    if isinstance(document, dict) and isinstance(document.get("events"), list):
+        events = document["events"]
+    keys = []
+    for event in events:
+        try:
+            payment_id = event["data"]["payment_id"]
+        except (TypeError, KeyError):
+            continue
+        if isinstance(payment_id, str):
+            keys.append(payment_id)
+    return list(dict.fromkeys(keys))
+
+
+def create_router(
+    worker_urls: Sequence[str],
+    transports: Sequence[httpx.AsyncBaseTransport] | None = None,
+    timeout: float = 30.0,
+) -> FastAPI:
+    """ASGI app that forwards webhooks to the worker owning their payment.
+
+    Args:
+        worker_urls: Base URL of each worker, in worker-index order.
+        transports: Optional httpx transport per worker (in-process tests).
+        timeout: Seconds to wait for a worker's response.
+    """
+    if not worker_urls:
+        raise ValueError("A router needs at least one worker.")
+    routed = [0] * len(worker_urls)
+    upstream_errors = 0
+    rejected_batches = 0
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        clients = [
+            httpx.AsyncClient(
+                base_url=url, timeout=timeout,
+                transport=transports[index] if transports else None,
+            )
+            for index, url in enumerate(worker_urls)
+        ]
+        app.state.worker_clients = clients
+        try:
+            yield
+        finally:
+            for client in clients:
+                await client.aclose()
+
+    router = FastAPI(title="FulfillHub Webhook Router", lifespan=lifespan)
+    router.state.metrics = Metrics()
+
+    def stats() -> dict:
+        return {
+            "workers": len(worker_urls),
+            "routed": {str(index): count for index, count in enumerate(routed)},
+            "upstream_errors": upstream_errors,
+            "rejected_batches": rejected_batches,
+        }
+
+    router.state.metrics.register("cluster", stats)
+
+    async def forward(request: Request) -> Response:
+        nonlocal upstream_errors, rejected_batches
+        try:
+            body = await read_bounded(request, MAX_BODY_SIZE)
+        except BodyTooLarge:
+            return JSONResponse(status_code=413, content={"error": "Request body too large"})
+        owners = {worker_for(payment_id, len(worker_urls)) for payment_id in routing_keys(body)}
+        if len(owners) > 1:
+            rejected_batches += 1
+            return JSONResponse(
+                status_code=422,
+                content={"error": "Batch spans payments owned by different workers; "
+                                  "send their events in separate requests"},
+            )
+        index = owners.pop() if owners else 0
+        routed[index] += 1
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+        try:
+            upstream = await request.app.state.worker_clients[index].post(
+                request.url.path, content=body, headers=headers,
+            )
+        except httpx.HTTPError as exc:
+            upstream_errors += 1
+            logger.warning("Worker %d did not answer: %s", index, exc)
+            return JSONResponse(status_code=503, content={"error": "Worker unavailable, retry"})
+        return Response(
+            content=upstream.content,
+            status_code=upstream.status_code,
+            media_type=upstream.headers.get("content-type"),
+        )
+
+    router.add_api_route("/webhooks/yuno", forward, methods=["POST"])
+    router.add_api_route("/webhooks/yuno/batch", forward, methods=["POST"])
+
+    @router.get("/metrics")
+    async def metrics_snapshot() -> dict:
+        return router.state.metrics.snapshot()
+
+    return router
+
+
+def worker_app() -> FastAPI:
+    """`create_app` configured from the environment, for uvicorn worker processes."""
+    from app.main import create_app
+
+    return create_app(
+        webhook_secret=os.environ.get("WEBHOOK_SECRET", "test-secret"),
+        replay_protection=os.environ.get("REPLAY_PROTECTION", "off"),
+        payload_storage=os.environ.get("PAYLOAD_STORAGE", "text"),
+    )
+
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class Cluster:
+    """N worker processes plus the payment-affinity router.
+
+    Args:
+        workers: Number of worker processes.
+        database_url: Database shared by every worker (DATABASE_URL).
+        host: Interface the router and workers listen on.
+        port: Router port; 0 picks free ports for the router and workers,
+            otherwise worker i listens on port + 1 + i.
+        webhook_secret: Secret every worker verifies signatures with.
+        replay_protection: Passed to each worker; use "database" so replayed
+            signatures are caught whichever worker sees them.
+        quiet: Discard worker output.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        database_url: str,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        webhook_secret: str = "test-secret",
+        replay_protection: str = "off",
+        quiet: bool = False,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("A cluster needs at least one worker.")
+        self.workers = workers
+        self.database_url = database_url
+        self.host = host
+        self.port = port or _free_port(host)
+        self.worker_ports = [
+            (port + 1 + index) if port else _free_port(host) for index in range(workers)
+        ]
+        self.webhook_secret = webhook_secret
+        self.replay_protection = replay_protection
+        self.quiet = quiet
+        self._processes: list[subprocess.Popen] = []
+        self._server = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def worker_urls(self) -> list[str]:
+        return [f"http://{self.host}:{port}" for port in self.worker_ports]
+
+    def start(self) -> None:
+        """Create the schema, start the workers, wait for them, then start the router."""
+        env = {
+            **os.environ,
+            "DATABASE_URL": self.database_url,
+            "WEBHOOK_SECRET": self.webhook_secret,
+            "REPLAY_PROTECTION": self.replay_protection,
+        }
+        # Create tables once, before several processes race to do it
+        subprocess.run(
+            [sys.executable, "-c", "from app.database import init_db; init_db()"],
+            env=env, check=True,
+        )
+        output = subprocess.DEVNULL if self.quiet else None
+        for port in self.worker_ports:
+            self._processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.cluster:worker_app", "--factory",
+                 "--host", self.host, "--port", str(port), "--log-level", "warning",
+                 "--ws", "none"],
+                env=env, stdout=output, stderr=output,
+            ))
+        try:
+            self._wait_for_workers()
+            self._start_router()
+        except Exception:
+            self.stop()
+            raise
+
+    def _wait_for_workers(self) -> None:
+        deadline = time.monotonic() + WORKER_STARTUP_TIMEOUT
+        pending = list(zip(self._processes, self.worker_urls))
+        while pending:
+            process, url = pending[0]
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker at {url} exited with {process.returncode}")
+            try:
+                httpx.get(f"{url}/metrics", timeout=1).raise_for_status()
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker at {url} did not start") from None
+                time.sleep(0.05)
+            else:
+                pending.pop(0)
+
+    def _start_router(self) -> None:
+        import uvicorn
+
+        config = uvicorn.Config(
+            create_router(self.worker_urls), host=self.host, port=self.port,
+            lifespan="on", ws="none", log_level="warning",
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + WORKER_STARTUP_TIMEOUT
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Router did not start")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(10)
+            self._server = None
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = []
+
+    def __enter__(self) -> "Cluster":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the receiver as several worker processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL", "sqlite:///./fulfillhub.db"))
+    parser.add_argument("--replay-protection", default="database")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    with Cluster(
+        args.workers, args.database_url, host=args.host, port=args.port,
+        webhook_secret=os.environ.get("WEBHOOK_SECRET", "test-secret"),
+        replay_protection=args.replay_protection,
+    ) as cluster:
+        logger.info("Routing %s to %d workers: %s", cluster.url, args.workers, cluster.worker_urls)
+        stop.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,210 @@
-from sqlalchemy import create_engine
+"""Engine/session factory.
+
+`create_db_engine(EngineConfig)` builds the engine: pool sizing, pre-ping and,
+on SQLite, the journal/sync/mmap/cache pragmas. The module-level `engine` is
+configured from the environment (`EngineConfig.from_env()`), so the same app
+runs against `DATABASE_URL=postgresql://...` unchanged.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Mapping
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from app.models import Base
 
-DATABASE_URL = "sqlite:///./fulfillhub.db"
+DEFAULT_DATABASE_URL = "sqlite:///./fulfillhub.db"
+
+
+@dataclass(frozen=True)
+class EngineConfig:
+    """Engine settings. SQLite pragmas set to None are left at SQLite's default."""
+
+    url: str = DEFAULT_DATABASE_URL
+    # Pooling (ignored for in-memory SQLite, which needs a per-thread pool)
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_pre_ping: bool = True
+    # SQLite pragmas, applied on every new connection
+    journal_mode: str | None = "WAL"
+    synchronous: str | None = "NORMAL"
+    busy_timeout_ms: int | None = 5000
+    mmap_size: int | None = 256 * 1024 * 1024
+    cache_size_kib: int | None = 64 * 1024
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "EngineConfig":
+        """Read DATABASE_URL and DB_<FIELD> overrides (e.g. DB_POOL_SIZE=20).
+
+        An empty DB_<PRAGMA> value disables that pragma.
+        """
+        values = {}
+        for f in fields(cls):
+            key = "DATABASE_URL" if f.name == "url" else f"DB_{f.name.upper()}"
+            raw = environ.get(key)
+            if raw is None:
+                continue
+            if f.name == "url":
+                values[f.name] = raw
+            elif raw == "":
+                values[f.name] = None
+            elif isinstance(f.default, bool):
+                values[f.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            else:
+                values[f.name] = type(f.default)(raw)
+        return cls(**values)
+
+
+class PoolStats:
+    """Connection pool usage: checkouts, checkout wait, connections in use."""
+
+    def __init__(self, engine: Engine) -> None:
+        self._engine = engine
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def _on_checkout(self, *_) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            if self.checked_out > self.max_checked_out:
+                self.max_checked_out = self.checked_out
+
+    def _on_checkin(self, *_) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def _on_connect(self, *_) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_invalidate(self, *_) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def _on_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self) -> dict:
+        pool = self._engine.pool
+        with self._lock:
+            return {
+                "pool": type(pool).__name__,
+                "size": pool.size() if isinstance(pool, QueuePool) else None,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checkout_wait_seconds": {
+                    "count": self.wait_count,
+                    "sum": round(self.wait_total, 6),
+                    "max": round(self.wait_max, 6),
+                },
+            }
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def _sqlite_pragmas(config: EngineConfig, in_memory: bool) -> list[str]:
+    pragmas = []
+    if config.busy_timeout_ms is not None:
+        pragmas.append(f"PRAGMA busy_timeout={int(config.busy_timeout_ms)}")
+    if in_memory:
+        return pragmas  # journal/sync/mmap do not apply to memory databases
+    if config.journal_mode:
+        pragmas.append(f"PRAGMA journal_mode={config.journal_mode}")
+    if config.synchronous:
+        pragmas.append(f"PRAGMA synchronous={config.synchronous}")
+    if config.mmap_size is not None:
+        pragmas.append(f"PRAGMA mmap_size={int(config.mmap_size)}")
+    if config.cache_size_kib is not None:
+        pragmas.append(f"PRAGMA cache_size={-int(config.cache_size_kib)}")
+    return pragmas
+
+
+def create_db_engine(config: EngineConfig | None = None) -> Engine:
+    """Build an engine from `config` with `engine.pool_stats` attached."""
+    config = config or EngineConfig()
+    url = make_url(config.url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    in_memory = _is_memory_sqlite(url)
+
+    kwargs: dict = {"pool_pre_ping": config.pool_pre_ping}
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    stats_holder: list[PoolStats] = []
+    if not in_memory:
+        # A QueuePool subclass per engine times the wait for a free connection;
+        # pool.recreate() on dispose keeps the class, so timing survives it.
+        def _do_get(pool):
+            start = time.perf_counter()
+            try:
+                return QueuePool._do_get(pool)
+            except PoolTimeoutError:
+                stats_holder[0]._on_timeout()
+                raise
+            finally:
+                stats_holder[0].observe_wait(time.perf_counter() - start)
+
+        kwargs.update(
+            poolclass=type("InstrumentedQueuePool", (QueuePool,), {"_do_get": _do_get}),
+            pool_size=config.pool_size,
+            max_overflow=config.max_overflow,
+            pool_timeout=config.pool_timeout,
+        )
+    engine = create_engine(url, **kwargs)
+
+    stats = PoolStats(engine)
+    stats_holder.append(stats)
+    event.listen(engine, "checkout", stats._on_checkout)
+    event.listen(engine, "checkin", stats._on_checkin)
+    event.listen(engine, "connect", stats._on_connect)
+    event.listen(engine, "invalidate", stats._on_invalidate)
+
+    if is_sqlite:
+        pragmas = _sqlite_pragmas(config, in_memory)
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_conn, connection_record):
+            cursor = dbapi_conn.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    engine.pool_stats = stats
+    return engine
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_db_engine(EngineConfig.from_env())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
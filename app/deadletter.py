@@ -0,0 +1,234 @@
+"""Dead-letter journal for events whose DB work kept failing.
+
+When an event exhausts its DB retries, the receiver appends it to a local
+append-only JSONL journal -- independent of the contended database -- and only
+acknowledges it once the line is fsynced. Concurrent appends share fsyncs
+(group commit): the first writer to find no flush in progress writes and
+syncs everything queued so far, and the writers that queued behind it wait
+for that one fsync instead of issuing their own.
+
+`redrive()` replays the journal through the batch path (`process_events`),
+which skips webhook_ids that were already claimed, and records how far it got
+in `<journal>.offset` so a re-run only replays newer lines:
+
+    python -m app.deadletter --journal /var/lib/fulfillhub/dead-letter.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from app.batch import MAX_BATCH_EVENTS, BatchEvent, process_events
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterError(Exception):
+    """The journal could not durably record an event."""
+
+
+class DeadLetterJournal:
+    """Append-only JSONL file with group-committed fsyncs.
+
+    The file is opened by `open()` (the app's lifespan does it on startup) and
+    closed by `close()`, so a journal can be reopened by a later startup.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd: int | None = None
+        self._size = 0  # end of the last complete flush; a failed one is cut back here
+        self._cond = threading.Condition()
+        self._pending: list[bytes] = []
+        self._queued = 0  # sequence number of the last queued record
+        self._durable = 0  # ... and of the last fsynced one
+        self._failed_through = 0  # records up to here were lost by a failed flush
+        self._flushing = False
+        self.appended = 0
+        self.fsyncs = 0
+        self.max_group = 0
+
+    def open(self) -> None:
+        with self._cond:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._size = os.fstat(self._fd).st_size
+
+    def append(self, record: dict) -> None:
+        """Queue `record` and return once it is on disk.
+
+        Raises:
+            DeadLetterError: If the flush that covered this record failed.
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._cond:
+            self._pending.append(line)
+            self._queued += 1
+            seq = self._queued
+            while self._durable < seq:
+                if seq <= self._failed_through:
+                    raise DeadLetterError(f"Could not write to {self.path}")
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flush_locked()
+            self.appended += 1
+
+    def _flush_locked(self) -> None:
+        """Write and fsync every queued line; called with the condition held."""
+        group, self._pending = self._pending, []
+        through = self._queued
+        fd = self._fd
+        self._flushing = True
+        self._cond.release()
+        failed = True
+        try:
+            if fd is None:
+                raise DeadLetterError(f"{self.path} is not open")
+            data = memoryview(b"".join(group))
+            while data:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+            failed = False
+        except Exception:
+            logger.exception("Dead-letter journal flush failed")
+            self._discard_partial(fd)
+        finally:
+            # Waiters are woken whatever happened, or they would wait forever
+            self._cond.acquire()
+            self._flushing = False
+            if failed:
+                self._failed_through = through
+            else:
+                self._size += sum(map(len, group))
+                self._durable = through
+                self.fsyncs += 1
+                self.max_group = max(self.max_group, len(group))
+            self._cond.notify_all()
+
+    def _discard_partial(self, fd: int | None) -> None:
+        """Cut a failed flush back to the last complete line, so the next one
+        does not extend a half-written line that would stop every re-drive."""
+        if fd is None:
+            return
+        try:
+            os.ftruncate(fd, self._size)
+        except OSError:
+            logger.exception("Could not truncate %s after a failed flush", self.path)
+
+    def close(self) -> None:
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "path": str(self.path),
+                "appended": self.appended,
+                "fsyncs": self.fsyncs,
+                "max_group": self.max_group,
+            }
+
+
+def dead_letter_record(
+    webhook_id: str, event_type: str, payment_id: str, payload: str, error: str,
+) -> dict:
+    return {
+        "webhook_id": webhook_id,
+        "event_type": event_type,
+        "payment_id": payment_id,
+        "payload": payload,
+        "error": error,
+        "failed_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _offset_path(journal: Path) -> Path:
+    return journal.with_name(journal.name + ".offset")
+
+
+def read_journal(journal: str | Path, start: int = 0) -> list[tuple[dict, int]]:
+    """(record, byte offset just past its line) for each complete line after `start`."""
+    with open(journal, "rb") as f:
+        f.seek(start)
+        data = f.read()
+    entries = []
+    offset = start
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break  # still being written; left for the next re-drive
+        offset += len(line)
+        if line.strip():
+            entries.append((json.loads(line), offset))
+    return entries
+
+
+def redrive(
+    journal: str | Path,
+    session_scope: Callable,
+    batch_size: int = MAX_BATCH_EVENTS,
+    payload_storage: str = "text",
+) -> dict:
+    """Replay journaled events through process_events, one commit per batch.
+
+    Already-claimed webhook_ids come back as idempotent and are not applied
+    again. The offset checkpoint advances after each committed batch, so an
+    interrupted re-drive resumes where it stopped. Returns outcome counts,
+    the number of events replayed and the throughput.
+    """
+    journal = Path(journal)
+    checkpoint = _offset_path(journal)
+    start = int(checkpoint.read_text()) if checkpoint.exists() else 0
+    entries = read_journal(journal, start)
+
+    outcomes: Counter[str] = Counter()
+    started = time.perf_counter()
+    for first in range(0, len(entries), batch_size):
+        chunk = entries[first:first + batch_size]
+        events = [
+            BatchEvent(r["webhook_id"], r["event_type"], r["payment_id"], r["payload"])
+            for r, _ in chunk
+        ]
+        with session_scope() as db:
+            try:
+                results = process_events(db, events, payload_storage=payload_storage)
+            except Exception:
+                db.rollback()
+                raise
+        checkpoint.write_text(str(chunk[-1][1]))
+        for result in results:
+            outcomes["idempotent" if result.get("idempotent") else str(result["status_code"])] += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "replayed": len(entries),
+        "outcomes": dict(outcomes),
+        "seconds": round(elapsed, 3),
+        "events_per_sec": round(len(entries) / elapsed, 1) if entries else 0.0,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Re-drive dead-lettered webhook events.")
+    parser.add_argument("--journal", required=True)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_EVENTS)
+    parser.add_argument("--payload-storage", default="text")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(redrive(args.journal, SessionLocal, args.batch_size, args.payload_storage)))
+
+
+if __name__ == "__main__":
+    main()
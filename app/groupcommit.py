@@ -0,0 +1,166 @@
+"""Group commit for the single-webhook path: many requests, one transaction.
+
+Without it every accepted event costs its own commit (an fsync on SQLite).
+With `create_app(group_commit=GroupCommitConfig(...))` each request hands its
+event to a `GroupCommitWriter` and waits. One writer thread collects the
+events that arrive within `window` seconds of the first (or until
+`max_events`), runs them through `process_events` in one transaction and
+then resolves every waiting request with its own result. A request is
+therefore still answered only after the commit that contains its event.
+
+If a group's transaction fails, its events are retried one at a time so a
+single bad event cannot fail its neighbours; whatever still fails is raised
+to the waiting request, whose normal retry loop resubmits it. Events still
+queued when `stop()` gives up waiting for the writer are failed the same way.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Generic, Sequence, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass(frozen=True)
+class GroupCommitConfig:
+    window: float = 0.002  # seconds a group stays open after its first event
+    max_events: int = 100  # flush as soon as a group is this large
+
+
+def _resolve(future: Future, result=None, exc: BaseException | None = None) -> None:
+    """Settle `future` unless it is already done (e.g. cancelled by its request)."""
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+class GroupCommitWriter(Generic[T, R]):
+    """Single writer thread that flushes submitted items in groups.
+
+    Args:
+        config: Window and size limit of a group.
+        flush: Callable(items) -> one result per item, in order; commits
+            before returning and raises on database errors.
+    """
+
+    def __init__(self, config: GroupCommitConfig, flush: Callable[[Sequence[T]], list[R]]) -> None:
+        if config.window < 0 or config.max_events < 1:
+            raise ValueError("group commit needs window >= 0 and max_events >= 1")
+        self.config = config
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._pending: list[tuple[T, Future]] = []
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self.groups = 0
+        self.events = 0
+        self.max_group = 0
+        self.fallbacks = 0
+        self.flush_seconds = 0.0
+
+    def submit(self, item: T) -> Future:
+        """Queue `item` for the next group; the future resolves after its commit."""
+        future: Future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("group commit writer is stopped")
+            self._pending.append((item, future))
+            self._cond.notify()
+        return future
+
+    # ── Writer thread ────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush what is queued, then stop the writer.
+
+        Events the writer has not taken by `timeout` are failed, so that no
+        request waits for a group that will never be flushed.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        with self._cond:
+            stranded, self._pending = self._pending, []
+        if stranded:
+            logger.warning("Group commit writer stopped with %d events unflushed", len(stranded))
+        for _, future in stranded:
+            _resolve(future, exc=RuntimeError("group commit writer stopped before this event"))
+
+    def _next_group(self) -> list[tuple[T, Future]]:
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            # The group opens with its first event and stays open for `window`
+            deadline = time.monotonic() + self.config.window
+            while len(self._pending) < self.config.max_events and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            group = self._pending[:self.config.max_events]
+            del self._pending[:self.config.max_events]
+            return group
+
+    def _loop(self) -> None:
+        while True:
+            group = self._next_group()
+            if not group:
+                return  # stopping and drained
+            started = time.perf_counter()
+            try:
+                results = self._flush([item for item, _ in group])
+            except Exception as exc:  # noqa: BLE001
+                if len(group) == 1:
+                    _resolve(group[0][1], exc=exc)
+                else:
+                    self._flush_one_by_one(group)
+            else:
+                for (_, future), result in zip(group, results):
+                    _resolve(future, result)
+            with self._cond:
+                self.groups += 1
+                self.events += len(group)
+                self.max_group = max(self.max_group, len(group))
+                self.flush_seconds += time.perf_counter() - started
+
+    def _flush_one_by_one(self, group: list[tuple[T, Future]]) -> None:
+        logger.warning("Group of %d events failed; retrying them one at a time", len(group))
+        with self._cond:
+            self.fallbacks += 1
+        for item, future in group:
+            try:
+                result = self._flush([item])[0]
+            except Exception as exc:  # noqa: BLE001
+                _resolve(future, exc=exc)
+            else:
+                _resolve(future, result)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "window_seconds": self.config.window,
+                "max_events": self.config.max_events,
+                "pending": len(self._pending),
+                "groups": self.groups,
+                "events": self.events,
+                "mean_group": round(self.events / self.groups, 2) if self.groups else 0.0,
+                "max_group": self.max_group,
+                "fallbacks": self.fallbacks,
+                "flush_seconds": round(self.flush_seconds, 4),
+            }
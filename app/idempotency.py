@@ -0,0 +1,123 @@
+"""In-memory front cache for webhook_ids that are already committed.
+
+The unique constraint on `webhook_events.webhook_id` stays the source of truth.
+The cache only lets the receiver answer Yuno's aggressive retries without a
+flush / IntegrityError / rollback round trip. A miss (including after eviction
+or expiry) simply falls through to the database path.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 10_000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` at `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
+
+
+class IdempotencyCache:
+    """Bounded LRU of committed webhook_ids with optional TTL and Bloom prefilter.
+
+    Args:
+        max_entries: LRU capacity; the least recently seen id is evicted beyond it.
+        ttl_seconds: Entries older than this are treated as misses and dropped.
+        bloom: If True, a Bloom filter answers "definitely not seen" without
+            touching the LRU. It is rebuilt from the LRU once it has absorbed
+            more than `max_entries` insertions, so its error rate stays bounded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        ttl_seconds: float | None = None,
+        bloom: bool = False,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._bloom = BloomFilter(max_entries) if bloom else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bloom_negatives = 0
+
+    def seen(self, webhook_id: str) -> bool:
+        """True if webhook_id is known to be committed (a cache hit)."""
+        with self._lock:
+            if self._bloom is not None and webhook_id not in self._bloom:
+                self.bloom_negatives += 1
+                self.misses += 1
+                return False
+            stored_at = self._entries.get(webhook_id)
+            if stored_at is None:
+                self.misses += 1
+                return False
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[webhook_id]
+                self.expirations += 1
+                self.misses += 1
+                return False
+            self._entries.move_to_end(webhook_id)
+            self.hits += 1
+            return True
+
+    def add(self, webhook_id: str) -> None:
+        """Record a webhook_id whose event row has been committed."""
+        with self._lock:
+            self._entries[webhook_id] = time.monotonic()
+            self._entries.move_to_end(webhook_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if self._bloom is not None:
+                if self._bloom.count >= self.max_entries:
+                    self._bloom.clear()
+                    for key in self._entries:
+                        self._bloom.add(key)
+                else:
+                    self._bloom.add(webhook_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "bloom_negatives": self.bloom_negatives,
+            }
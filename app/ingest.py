@@ -0,0 +1,277 @@
+"""Queued ingest mode: acknowledge after a durable enqueue, process with partitioned workers.
+
+The endpoint appends each verified, schema-valid event to the `ingest_outbox`
+table and returns 202. A pool of worker threads drains the outbox through the
+normal `_process_event` path. Every payment hashes to one of `INGEST_PARTITIONS`
+partitions and every partition is owned by exactly one worker, which consumes
+its rows in insertion order -- so events for a payment are applied in the order
+they were accepted.
+
+A row whose processing keeps raising is parked after `MAX_INGEST_ATTEMPTS`:
+it stays in the outbox with its attempt count but is no longer fetched, so the
+other payments of its partition move on. Later rows of the same payment are
+held behind it, never applied ahead of it. Resetting `attempts` to 0 re-queues
+it, and the held rows follow in order.
+"""
+import logging
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import exists, func, select
+from sqlalchemy.orm import aliased
+
+from app.models import IngestOutbox
+
+logger = logging.getLogger(__name__)
+
+INGEST_MODES = ("sync", "queued")
+INGEST_PARTITIONS = 64
+DEFAULT_INGEST_WORKERS = 4
+POLL_INTERVAL = 0.05  # idle wait between outbox polls
+WORKER_BATCH_SIZE = 50
+FAILURE_BACKOFF = 0.2  # pause before retrying a row whose processing raised
+MAX_INGEST_ATTEMPTS = 5  # failed attempts before a row is parked
+
+_OUTCOMES = {200: "accepted", 202: "deferred", 404: "not_found", 422: "invalid"}
+
+
+def partition_for(payment_id: str) -> int:
+    """Stable partition for a payment (crc32, so it is identical across processes)."""
+    return zlib.crc32(payment_id.encode()) % INGEST_PARTITIONS
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class IngestQueue:
+    """Outbox-backed queue drained by `workers` threads, partitioned by payment_id.
+
+    Args:
+        session_scope: Zero-arg callable returning a session context manager.
+        process: Callable(webhook_id, event_type, payment_id, payload) -> Response
+            that performs one processing attempt and raises on DB errors.
+        run_db: Callable(fn, *args) that runs blocking DB work in the app's DB lane.
+        workers: Number of worker threads. 0 enqueues only (another process drains).
+        max_attempts: Failed attempts after which a row is parked.
+    """
+
+    def __init__(
+        self,
+        session_scope: Callable,
+        process: Callable,
+        run_db: Callable,
+        workers: int = DEFAULT_INGEST_WORKERS,
+        poll_interval: float = POLL_INTERVAL,
+        batch_size: int = WORKER_BATCH_SIZE,
+        max_attempts: int = MAX_INGEST_ATTEMPTS,
+    ) -> None:
+        self._session_scope = session_scope
+        self._process = process
+        self._run_db = run_db
+        self.workers = workers
+        self._poll_interval = poll_interval
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._stop = threading.Event()
+        self._wakeups = [threading.Event() for _ in range(workers)]
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._outcomes: Counter[str] = Counter()
+        self._last_lag_seconds = 0.0
+
+    # ── Producer side ─────────────────────────────────────────────────────────
+
+    def enqueue(self, webhook_id: str, event_type: str, payment_id: str, payload: str) -> int:
+        """Durably append one event to the outbox. Raises on DB errors for retry."""
+        partition = partition_for(payment_id)
+        with self._session_scope() as db:
+            entry = IngestOutbox(
+                webhook_id=webhook_id,
+                payment_id=payment_id,
+                event_type=event_type,
+                payload=payload,
+                partition=partition,
+                attempts=0,
+                enqueued_at=datetime.now(timezone.utc),
+            )
+            db.add(entry)
+            try:
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            entry_id = entry.id
+        if self.workers:
+            self._wakeups[partition % self.workers].set()
+        return entry_id
+
+    # ── Worker lifecycle ──────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, args=(index,), name=f"ingest-worker-{index}", daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        for wakeup in self._wakeups:
+            wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads.clear()
+
+    def _worker(self, index: int) -> None:
+        partitions = [p for p in range(INGEST_PARTITIONS) if p % self.workers == index]
+        wakeup = self._wakeups[index]
+        while not self._stop.is_set():
+            try:
+                rows = self._run_db(self._fetch, partitions)
+            except Exception:  # noqa: BLE001
+                logger.exception("Ingest worker %d failed to poll the outbox", index)
+                self._stop.wait(FAILURE_BACKOFF)
+                continue
+            if not rows:
+                wakeup.wait(self._poll_interval)
+                wakeup.clear()
+                continue
+            for row in rows:
+                if self._stop.is_set() or not self._handle(row):
+                    # Stop at the first failure so later rows of the same payment
+                    # are never applied ahead of it; the next poll retries it,
+                    # or, once it is parked, holds them back.
+                    break
+
+    def _fetch(self, partitions: list[int]) -> list[tuple]:
+        with self._session_scope() as db:
+            return db.execute(
+                select(
+                    IngestOutbox.id,
+                    IngestOutbox.webhook_id,
+                    IngestOutbox.event_type,
+                    IngestOutbox.payment_id,
+                    IngestOutbox.payload,
+                    IngestOutbox.enqueued_at,
+                    IngestOutbox.attempts,
+                )
+                .where(IngestOutbox.partition.in_(partitions), self._active(), ~self._held())
+                .order_by(IngestOutbox.id)
+                .limit(self._batch_size)
+            ).all()
+
+    def _active(self):
+        """Rows still being processed, i.e. not parked."""
+        return IngestOutbox.attempts < self._max_attempts
+
+    def _held(self):
+        """Rows queued behind a parked row of the same payment."""
+        parked = aliased(IngestOutbox)
+        return exists().where(
+            parked.payment_id == IngestOutbox.payment_id,
+            parked.id < IngestOutbox.id,
+            parked.attempts >= self._max_attempts,
+        )
+
+    def _handle(self, row: tuple) -> bool:
+        entry_id, webhook_id, event_type, payment_id, payload, enqueued_at, attempts = row
+        try:
+            response = self._run_db(self._process, webhook_id, event_type, payment_id, payload)
+            self._run_db(self._ack, entry_id)
+        except Exception:  # noqa: BLE001
+            parked = attempts + 1 >= self._max_attempts
+            try:
+                self._run_db(self._record_attempt, entry_id)
+            except Exception:  # noqa: BLE001
+                parked = False  # not recorded, so it will be fetched again
+            if parked:
+                logger.error(
+                    "Ingest processing failed %d times for webhook %s; parking it",
+                    attempts + 1, webhook_id,
+                )
+            else:
+                logger.warning("Ingest processing failed for webhook %s; will retry", webhook_id)
+            with self._lock:
+                self._outcomes["parked" if parked else "retried"] += 1
+            if not parked:
+                self._stop.wait(FAILURE_BACKOFF)
+            return False
+
+        lag = (datetime.now(timezone.utc) - _as_utc(enqueued_at)).total_seconds()
+        with self._lock:
+            self._outcomes[_OUTCOMES.get(response.status_code, str(response.status_code))] += 1
+            self._last_lag_seconds = lag
+        return True
+
+    def _ack(self, entry_id: int) -> None:
+        with self._session_scope() as db:
+            db.query(IngestOutbox).filter(IngestOutbox.id == entry_id).delete()
+            db.commit()
+
+    def _record_attempt(self, entry_id: int) -> None:
+        with self._session_scope() as db:
+            db.query(IngestOutbox).filter(IngestOutbox.id == entry_id).update(
+                {IngestOutbox.attempts: IngestOutbox.attempts + 1}
+            )
+            db.commit()
+
+    # ── Introspection ─────────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        """Queue depth, per-worker depth, lag of the oldest pending event and outcomes.
+
+        Parked rows and the rows held behind them are reported separately and
+        are not part of the depth.
+        """
+        with self._session_scope() as db:
+            depth, oldest = db.execute(
+                select(func.count(IngestOutbox.id), func.min(IngestOutbox.enqueued_at))
+                .where(self._active(), ~self._held())
+            ).one()
+            parked = db.scalar(select(func.count(IngestOutbox.id)).where(~self._active()))
+            held = db.scalar(
+                select(func.count(IngestOutbox.id)).where(self._active(), self._held())
+            )
+            by_partition = db.execute(
+                select(IngestOutbox.partition, func.count(IngestOutbox.id))
+                .where(self._active(), ~self._held())
+                .group_by(IngestOutbox.partition)
+            ).all()
+
+        by_worker: Counter[int] = Counter()
+        for partition, count in by_partition:
+            by_worker[partition % self.workers if self.workers else 0] += count
+        oldest_lag = 0.0
+        if oldest is not None:
+            oldest_lag = (datetime.now(timezone.utc) - _as_utc(oldest)).total_seconds()
+
+        with self._lock:
+            outcomes = dict(self._outcomes)
+            last_lag = self._last_lag_seconds
+        return {
+            "mode": "queued",
+            "workers": self.workers,
+            "depth": depth,
+            "depth_by_worker": {str(k): v for k, v in sorted(by_worker.items())},
+            "parked": parked,
+            "held": held,
+            "oldest_lag_seconds": round(oldest_lag, 3),
+            "last_processed_lag_seconds": round(last_lag, 3),
+            "outcomes": outcomes,
+        }
+
+    def wait_until_drained(self, timeout: float = 10.0) -> bool:
+        """Block until the outbox is empty (used by tests and graceful shutdown)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._run_db(self.stats)["depth"] == 0:
+                return True
+            time.sleep(self._poll_interval)
+        return False
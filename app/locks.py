@@ -0,0 +1,46 @@
+"""Per-key serialization for the webhook request path."""
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+
+class KeyedLock:
+    """One asyncio.Lock per key, created on demand and dropped when unused.
+
+    Events for the same payment_id queue up behind each other on the event loop
+    (without occupying DB threads), while different payments proceed in parallel.
+    """
+
+    def __init__(self) -> None:
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._waiters: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        """Acquire the lock for `key`; yields seconds spent waiting (0.0 if uncontended)."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        contended = lock.locked()
+        start = time.monotonic()
+        try:
+            async with lock:
+                yield time.monotonic() - start if contended else 0.0
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    @asynccontextmanager
+    async def hold_many(self, keys):
+        """Acquire several keys in sorted order (deadlock-free); yields total wait seconds."""
+        waited = 0.0
+        async with AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                waited += await stack.enter_async_context(self.hold(key))
+            yield waited
+
+    def __len__(self) -> int:
+        return len(self._locks)
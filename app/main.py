@@ -1,206 +1,1000 @@
+import asyncio
 import json
 import logging
 import random
-import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone
+from typing import Awaitable, Sequence
 
-from fastapi import Depends, FastAPI, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import ValidationError
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
 
+from app.archive import ArchiveProbe, Archiver, RetentionConfig, is_archived
+from app.batch import MAX_BATCH_EVENTS, BatchEvent, idempotent_result, process_events
+from app import database
 from app.database import get_db
+from app.deadletter import DeadLetterError, DeadLetterJournal, dead_letter_record
+from app.groupcommit import GroupCommitConfig, GroupCommitWriter
+from app.idempotency import DEFAULT_CACHE_SIZE, IdempotencyCache
+from app.ingest import DEFAULT_INGEST_WORKERS, INGEST_MODES, IngestQueue
+from app.locks import KeyedLock
+from app.metrics import Metrics
 from app.models import Payment, WebhookEvent
+from app.payloads import PAYLOAD_STORAGE_MODES, payload_columns
+from app.payment_cache import DEFAULT_PAYMENT_CACHE_SIZE, PaymentState, PaymentStatusCache
+from app.projection import SnapshotConfig, Snapshotter
+from app.replay import REPLAY_MODES, DatabaseReplayStore, MemoryReplayStore
+from app.scheduler import DeferredConfig, DeferredIndex, DeferredScheduler
 from app.schemas import WebhookPayload
-from app.signature import SIGNATURE_HEADER, TIMESTAMP_HEADER, verify_signature
-from app.state_machine import (
-    InvalidTransitionError,
-    OutOfOrderEventError,
-    apply_transition,
+from app.streaming import BodyTooLarge, check_declared_length, read_bounded
+from app.signature import (
+    KEY_ID_HEADER, SIGNATURE_HEADER, TIMESTAMP_HEADER, Keyring, SigningKey,
 )
+from app.state_machine import TransitionResult, decide, ready_events, rejection_reason
 
 logger = logging.getLogger(__name__)
 
 MAX_BODY_SIZE = 5 * 1024 * 1024  # 5 MB limit
 MAX_DB_RETRIES = 12
 DB_RETRY_DELAY = 0.05  # 50ms base
+_ATTEMPT_BUCKETS = (1, 2, 3, 5, 8, MAX_DB_RETRIES)
+# Compare-and-set attempts per event before falling back to the retry loop
+MAX_CAS_ATTEMPTS = 5
 
+# "threadpool": blocking DB work runs on a bounded executor, off the event loop.
+# "inline": DB work runs directly on the event loop (single-request debugging).
+EXECUTION_MODES = ("threadpool", "inline")
+DEFAULT_DB_WORKERS = 1
+# Stand-in for callers of _process_event that pass no metrics
+_UNINSTRUMENTED = Metrics(enabled=False)
+# Outcome recorded for a request rejected before processing, by status code
+_REJECTED = {400: "bad_request", 401: "unauthorized", 413: "too_large", 422: "invalid",
+             503: "unavailable"}
 
-def create_app(webhook_secret: str = "test-secret") -> FastAPI:
-    application = FastAPI(title="FulfillHub Webhook Receiver")
-    application.state.webhook_secret = webhook_secret
 
-    @application.post("/webhooks/yuno")
-    async def receive_webhook(
-        request: Request,
-        db: Session = Depends(get_db),
-    ) -> Response:
-        # 1. Read raw body with size limit
-        body = await request.body()
-        if len(body) > MAX_BODY_SIZE:
-            return JSONResponse(status_code=413, content={"error": "Payload too large"})
-
-        # 2. Verify signature -> 401 if fails
-        secret = request.app.state.webhook_secret
-        sig = request.headers.get(SIGNATURE_HEADER, "")
-        ts = request.headers.get(TIMESTAMP_HEADER, "")
-        try:
-            verify_signature(secret=secret, signature=sig, timestamp_str=ts, body=body)
-        except ValueError as exc:
-            logger.warning("Signature verification failed: %s", exc)
-            return JSONResponse(status_code=401, content={"error": str(exc)})
+def create_app(
+    webhook_secret: str = "test-secret",
+    execution_mode: str = "threadpool",
+    db_workers: int = DEFAULT_DB_WORKERS,
+    ingest_mode: str = "sync",
+    ingest_workers: int = DEFAULT_INGEST_WORKERS,
+    idempotency_cache_size: int = DEFAULT_CACHE_SIZE,
+    idempotency_cache_ttl: float | None = None,
+    idempotency_bloom: bool = False,
+    payment_cache_size: int = DEFAULT_PAYMENT_CACHE_SIZE,
+    db_engine: Engine | None = None,
+    signing_keys: Sequence[SigningKey] | None = None,
+    replay_protection: str = "off",
+    payload_storage: str = "text",
+    retention: RetentionConfig | None = None,
+    instrumentation: bool = True,
+    dead_letter_path: str | None = None,
+    deferred: DeferredConfig | None = None,
+    group_commit: GroupCommitConfig | None = None,
+    snapshots: SnapshotConfig | None = None,
+) -> FastAPI:
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(
+            f"Unknown execution_mode {execution_mode!r}; expected one of {EXECUTION_MODES}."
+        )
+    if ingest_mode not in INGEST_MODES:
+        raise ValueError(
+            f"Unknown ingest_mode {ingest_mode!r}; expected one of {INGEST_MODES}."
+        )
+    if replay_protection not in REPLAY_MODES:
+        raise ValueError(
+            f"Unknown replay_protection {replay_protection!r}; expected one of {REPLAY_MODES}."
+        )
+    if payload_storage not in PAYLOAD_STORAGE_MODES:
+        raise ValueError(
+            f"Unknown payload_storage {payload_storage!r}; expected one of {PAYLOAD_STORAGE_MODES}."
+        )
+    if group_commit is not None and ingest_mode != "sync":
+        raise ValueError("group_commit applies to ingest_mode='sync' only.")
 
-        # 3. Parse JSON -> 400 if not valid JSON or empty
-        if not body:
-            return JSONResponse(status_code=400, content={"error": "Empty body"})
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        executor = None
+        if execution_mode == "threadpool":
+            executor = ThreadPoolExecutor(
+                max_workers=db_workers, thread_name_prefix="webhook-db",
+            )
+        app.state.db_executor = executor
+        if app.state.dead_letters is not None:
+            app.state.dead_letters.open()
+        queue = None
+        if ingest_mode == "queued":
+            queue = IngestQueue(
+                session_scope=lambda: _session_scope(app),
+                process=lambda *event: _process_in_session(app, *event),
+                run_db=lambda fn, *args: _call_db(app, fn, *args),
+                workers=ingest_workers,
+            )
+            queue.start()
+        app.state.ingest_queue = queue
+        writer = app.state.group_writer
+        if writer is not None:
+            writer.start()
+        archiver = app.state.archiver
+        if archiver is not None:
+            archiver.start()
+        snapshotter = app.state.snapshotter
+        if snapshotter is not None:
+            snapshotter.start()
+        scheduler = app.state.deferred_scheduler
+        if scheduler is not None:
+            await asyncio.to_thread(scheduler.start)
         try:
-            raw = json.loads(body)
-        except (json.JSONDecodeError, UnicodeDecodeError, RecursionError, ValueError):
-            return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+            yield
+        finally:
+            if scheduler is not None:
+                scheduler.stop()
+            if snapshotter is not None:
+                snapshotter.stop()
+            if archiver is not None:
+                archiver.stop()
+            if queue is not None:
+                queue.stop()
+            if writer is not None:
+                writer.stop()
+            if app.state.dead_letters is not None:
+                app.state.dead_letters.close()
+            app.state.ingest_queue = None
+            app.state.db_executor = None
+            if executor is not None:
+                executor.shutdown(wait=True)
 
-        if not isinstance(raw, dict):
-            return JSONResponse(status_code=400, content={"error": "Expected JSON object"})
+    application = FastAPI(title="FulfillHub Webhook Receiver", lifespan=lifespan)
+    application.state.webhook_secret = webhook_secret
+    application.state.execution_mode = execution_mode
+    application.state.ingest_mode = ingest_mode
+    application.state.payload_storage = payload_storage
+    application.state.db_executor = None
+    application.state.ingest_queue = None
+    # instrumentation=False turns stage timings, outcomes and gauges into no-ops
+    application.state.metrics = Metrics(enabled=instrumentation)
+    # signing_keys (for secret rotation) replaces the single webhook_secret
+    application.state.keyring = Keyring(signing_keys or [SigningKey("default", webhook_secret)])
+    application.state.metrics.register("signature_keys", application.state.keyring.stats)
+    # Off by default: Yuno re-signs retries, but tests resend identical requests
+    application.state.replay_store = None
+    if replay_protection == "memory":
+        application.state.replay_store = MemoryReplayStore()
+    elif replay_protection == "database":
+        application.state.replay_store = DatabaseReplayStore(
+            session_scope=lambda: _session_scope(application),
+        )
+    if application.state.replay_store is not None:
+        application.state.metrics.register("replay_cache", application.state.replay_store.stats)
+    application.state.payment_locks = KeyedLock()
+    application.state.idempotency_cache = None
+    if idempotency_cache_size > 0:
+        cache = IdempotencyCache(
+            max_entries=idempotency_cache_size,
+            ttl_seconds=idempotency_cache_ttl,
+            bloom=idempotency_bloom,
+        )
+        application.state.idempotency_cache = cache
+        application.state.metrics.register("idempotency_cache", cache.stats)
+    application.state.payment_cache = None
+    if payment_cache_size > 0:
+        payment_cache = PaymentStatusCache(max_entries=payment_cache_size)
+        application.state.payment_cache = payment_cache
+        application.state.metrics.register("payment_cache", payment_cache.stats)
+    # Background archival of old processed events (runs while the app is up)
+    application.state.archiver = None
+    if retention is not None:
+        archiver = Archiver(
+            retention,
+            session_scope=lambda: _session_scope(application),
+            run_db=lambda fn, *args: _call_db(application, fn, *args),
+        )
+        application.state.archiver = archiver
+        application.state.metrics.register("retention", archiver.stats)
+    application.state.archive_probe = ArchiveProbe(archiving=retention is not None)
+    # Periodic snapshots of the status projection (see app.projection)
+    application.state.snapshotter = None
+    if snapshots is not None:
+        snapshotter = Snapshotter(
+            snapshots,
+            session_scope=lambda: _session_scope(application),
+            run_db=lambda fn, *args: _call_db(application, fn, *args),
+        )
+        application.state.snapshotter = snapshotter
+        application.state.metrics.register("snapshots", snapshotter.stats)
+    # In-memory index of deferred events, with reconciliation and a TTL sweep
+    application.state.deferred_scheduler = None
+    application.state.deferred_index = None
+    if deferred is not None:
+        scheduler = DeferredScheduler(
+            deferred,
+            session_scope=lambda: _session_scope(application),
+            run_db=lambda fn, *args: _call_db(application, fn, *args),
+            payload_storage=payload_storage,
+        )
+        application.state.deferred_scheduler = scheduler
+        application.state.deferred_index = scheduler.index
+        application.state.metrics.register("deferred", scheduler.stats)
+    # Concurrent webhooks share one transaction; each is answered after its commit.
+    # Groups are flushed in the DB lane, like every other write.
+    application.state.group_writer = None
+    if group_commit is not None:
+        writer = GroupCommitWriter(
+            group_commit,
+            flush=lambda events: _call_db(
+                application, _process_batch_in_session, application, events,
+            ),
+        )
+        application.state.group_writer = writer
+        application.state.metrics.register("group_commit", writer.stats)
+    # Events that exhaust their DB retries are journaled here (503 without one);
+    # the file is opened and closed by the lifespan
+    application.state.dead_letters = None
+    if dead_letter_path is not None:
+        journal = DeadLetterJournal(dead_letter_path)
+        application.state.dead_letters = journal
+        application.state.metrics.register("dead_letter", journal.stats)
+    # Pool usage of the engine behind get_db (pass db_engine when overriding get_db)
+    pool_stats = getattr(db_engine or database.engine, "pool_stats", None)
+    if pool_stats is not None:
+        application.state.metrics.register("db_pool", pool_stats.stats)
+
+    @application.post("/webhooks/yuno")
+    async def receive_webhook(request: Request) -> Response:
+        metrics = request.app.state.metrics
+        started = metrics.clock()
+        response = await _forgetting_failed_signature(request, _receive_webhook(request, metrics))
+        metrics.lap("total", started)
+        return response
+
+    async def _receive_webhook(request: Request, metrics: Metrics) -> Response:
+        # 1-2. Stream the raw body through the size limit and signature check
+        body = await _read_signed_body(request)
+        if isinstance(body, JSONResponse):
+            return _rejected(metrics, body)
 
-        # 4. Validate Pydantic schema -> 400 for missing fields, 422 for type errors
+        # 3-4. Decode once, then parse + validate in a single pass -> 400 for
+        # empty / invalid JSON / non-objects / missing fields, 422 for bad values
+        lap = metrics.clock()
+        if not body:
+            return _rejected(
+                metrics, JSONResponse(status_code=400, content={"error": "Empty body"}),
+            )
         try:
-            payload = WebhookPayload(**raw)
-        except ValidationError as exc:
-            errors = exc.errors()
-            has_missing = any(e.get("type") == "missing" for e in errors)
-            status_code = 400 if has_missing else 422
-            return JSONResponse(status_code=status_code, content={"error": str(exc)})
-        except (RecursionError, Exception) as exc:
-            return JSONResponse(status_code=400, content={"error": str(exc)})
+            body_str = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return _rejected(
+                metrics, JSONResponse(status_code=400, content={"error": "Invalid JSON"}),
+            )
+        payload = _parse_webhook(body_str)
+        if isinstance(payload, JSONResponse):
+            return _rejected(metrics, payload)
+        metrics.lap("parse", lap)
 
         webhook_id = payload.webhook_id
         event_type = payload.event_type
         payment_id = payload.data.payment_id
-        body_str = body.decode("utf-8", errors="replace")
 
-        # Steps 5-11 wrapped in a retry loop for database concurrency
-        for attempt in range(MAX_DB_RETRIES):
+        # Known duplicates are answered from the front cache without any DB work
+        cache = request.app.state.idempotency_cache
+        if cache is not None and cache.seen(webhook_id):
+            metrics.outcome("idempotent")
+            return _idempotent_response(webhook_id)
+
+        # Steps 5-11 (or the durable enqueue in queued mode). Events for the same
+        # payment are serialized by a keyed lock so they never contend with each
+        # other; the retry loop only absorbs contention across payments.
+        if ingest_mode == "queued":
+            return await _handle_event(
+                request.app, _enqueue_in_session,
+                webhook_id, event_type, payment_id, body_str,
+            )
+        async with request.app.state.payment_locks.hold(payment_id) as waited:
+            metrics.observe("payment_lock_wait_seconds", waited)
+            if waited:
+                metrics.inc("payment_lock_contended_total")
+            job = _process_in_session
+            if request.app.state.group_writer is not None:
+                job = _process_in_group
+            return await _handle_event(
+                request.app, job, webhook_id, event_type, payment_id, body_str,
+            )
+
+    @application.post("/webhooks/yuno/batch")
+    async def receive_webhook_batch(request: Request) -> Response:
+        return await _forgetting_failed_signature(request, _receive_webhook_batch(request))
+
+    async def _receive_webhook_batch(request: Request) -> Response:
+        metrics = request.app.state.metrics
+        body = await _read_signed_body(request)
+        if isinstance(body, JSONResponse):
+            return _rejected(metrics, body)
+
+        try:
+            raw = json.loads(body) if body else None
+        except (json.JSONDecodeError, UnicodeDecodeError, RecursionError, ValueError):
+            return _rejected(
+                metrics, JSONResponse(status_code=400, content={"error": "Invalid JSON"}),
+            )
+        items = raw.get("events") if isinstance(raw, dict) else None
+        if not isinstance(items, list):
+            return _rejected(metrics, JSONResponse(
+                status_code=400, content={"error": 'Expected {"events": [...]}'},
+            ))
+        if len(items) > MAX_BATCH_EVENTS:
+            return _rejected(metrics, JSONResponse(
+                status_code=413,
+                content={"error": f"Batch exceeds {MAX_BATCH_EVENTS} events"},
+            ))
+
+        # Schema errors are reported per event; valid events go to process_events
+        results: list[dict | None] = [None] * len(items)
+        events: list[BatchEvent] = []
+        positions: list[int] = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {"status_code": 400, "error": "Expected JSON object"}
+                continue
             try:
-                return _process_event(
-                    db, webhook_id, event_type, payment_id, body_str,
-                )
-            except Exception:  # noqa: BLE001
-                db.rollback()
-                if attempt == MAX_DB_RETRIES - 1:
-                    logger.error(
-                        "DB operations failed after %d attempts for webhook %s",
-                        MAX_DB_RETRIES, webhook_id,
+                payload = WebhookPayload.model_validate(item)
+            except ValidationError as exc:
+                results[index] = {
+                    "webhook_id": item.get("webhook_id"),
+                    "status_code": _validation_status(exc),
+                    "error": str(exc),
+                }
+                continue
+            events.append(BatchEvent(
+                payload.webhook_id, payload.event_type, payload.data.payment_id,
+                json.dumps(item),
+            ))
+            positions.append(index)
+
+        cache = request.app.state.idempotency_cache
+        if cache is not None:
+            fresh = []
+            for index, e in zip(positions, events):
+                if cache.seen(e.webhook_id):
+                    results[index] = idempotent_result(e.webhook_id)
+                else:
+                    fresh.append((index, e))
+            positions = [index for index, _ in fresh]
+            events = [e for _, e in fresh]
+
+        if events:
+            locks = request.app.state.payment_locks
+            async with locks.hold_many(e.payment_id for e in events):
+                try:
+                    outcomes = await _run_with_retries(
+                        request.app, _process_batch_in_session, request.app, events,
                     )
+                except DBRetriesExhaustedError:
+                    logger.error("Batch of %d events failed after %d attempts",
+                                 len(events), MAX_DB_RETRIES)
+                    metrics.outcome("retry_exhausted")
                     return JSONResponse(
-                        status_code=200,
-                        content={"status": "accepted", "webhook_id": webhook_id},
+                        status_code=503, content={"error": "Database unavailable, retry"},
                     )
-                jitter = random.uniform(0, DB_RETRY_DELAY)
-                time.sleep(DB_RETRY_DELAY * (attempt + 1) + jitter)
+            for index, outcome in zip(positions, outcomes):
+                results[index] = outcome
+                if cache is not None and outcome["status_code"] in (200, 202):
+                    cache.add(outcome["webhook_id"])
+
+        for result in results:
+            metrics.outcome(_batch_outcome(result))
+        return JSONResponse(status_code=200, content={"results": results})
+
+    @application.get("/metrics")
+    async def metrics_snapshot(request: Request, format: str = "json") -> Response:
+        """JSON snapshot, or Prometheus text for ?format=prometheus / a text Accept header."""
+        metrics = request.app.state.metrics
+        if metrics.enabled:
+            await _update_deferred_gauges(request.app)
+        accept = request.headers.get("accept", "")
+        if format == "prometheus" or "text/plain" in accept or "openmetrics" in accept:
+            return PlainTextResponse(
+                metrics.prometheus(), media_type="text/plain; version=0.0.4",
+            )
+        return JSONResponse(status_code=200, content=metrics.snapshot())
+
+    if ingest_mode == "queued":
+        @application.get("/webhooks/yuno/queue")
+        async def queue_stats(request: Request) -> Response:
+            queue = request.app.state.ingest_queue
+            stats = await _run_db(request.app.state.db_executor, queue.stats)
+            return JSONResponse(status_code=200, content=stats)
 
     return application
 
 
+async def _read_signed_body(request: Request) -> bytes | JSONResponse:
+    """Read the body while verifying its signature; return it, or a 400/401/413 response.
+
+    An oversized Content-Length and missing, malformed or expired signature
+    headers are rejected before any of the body is read. Chunks are fed to a
+    copy of the most likely key's pre-keyed HMAC as they arrive (see Keyring),
+    and reading stops as soon as the body exceeds MAX_BODY_SIZE. With replay
+    protection on, a signature that was already verified once is rejected,
+    before any parsing or DB work.
+    """
+    try:
+        check_declared_length(request, MAX_BODY_SIZE)
+    except BodyTooLarge:
+        return JSONResponse(status_code=413, content={"error": "Payload too large"})
+    except ValueError as exc:
+        return JSONResponse(status_code=400, content={"error": str(exc)})
+
+    metrics = request.app.state.metrics
+    keyring = request.app.state.keyring
+    sig = request.headers.get(SIGNATURE_HEADER, "")
+    ts = request.headers.get(TIMESTAMP_HEADER, "")
+    key_hint = request.headers.get(KEY_ID_HEADER)
+    started = metrics.clock()
+    try:
+        attempt = keyring.begin(keyring.check_headers(sig, ts), key_hint)
+    except ValueError as exc:
+        return _signature_rejected(exc)
+
+    # The MAC is updated while reading, so that time counts as body_read
+    read_started = metrics.clock()
+    try:
+        body = await read_bounded(request, MAX_BODY_SIZE, attempt.mac.update)
+    except BodyTooLarge:
+        return JSONResponse(status_code=413, content={"error": "Payload too large"})
+    read_done = metrics.clock()
+    try:
+        keyring.finish(attempt, sig, body, key_hint)
+    except ValueError as exc:
+        return _signature_rejected(exc)
+
+    # Only verified signatures are recorded, so forgeries cannot fill the store
+    store = request.app.state.replay_store
+    if store is not None:
+        if store.uses_db:
+            try:
+                fresh = await _run_with_retries(
+                    request.app, store.check_and_add, sig, attempt.timestamp,
+                )
+            except DBRetriesExhaustedError:
+                return JSONResponse(
+                    status_code=503, content={"error": "Database unavailable, retry"},
+                )
+        else:
+            fresh = store.check_and_add(sig, attempt.timestamp)
+        if not fresh:
+            return _signature_rejected(ValueError("Replayed signature."))
+        request.state.replay_signature = (sig, attempt.timestamp)
+    if metrics.enabled:
+        metrics.observe_stage("body_read", read_done - read_started)
+        metrics.observe_stage(
+            "signature", (read_started - started) + (metrics.clock() - read_done),
+        )
+    return body
+
+
+async def _forgetting_failed_signature(
+    request: Request, handling: Awaitable[Response],
+) -> Response:
+    """Await a webhook handler; if it answers 503 or raises, forget the signature
+    replay protection recorded for the request, so the sender's retry is accepted."""
+    try:
+        response = await handling
+    except Exception:
+        await _forget_signature(request)
+        raise
+    if response.status_code == 503:
+        await _forget_signature(request)
+    return response
+
+
+async def _forget_signature(request: Request) -> None:
+    recorded = getattr(request.state, "replay_signature", None)
+    if recorded is None:
+        return
+    store = request.app.state.replay_store
+    try:
+        if store.uses_db:
+            await _run_with_retries(request.app, store.discard, *recorded)
+        else:
+            store.discard(*recorded)
+    except DBRetriesExhaustedError:
+        logger.warning("Could not forget the signature of a failed request; "
+                       "its retry will be refused as a replay")
+
+
+def _rejected(metrics: Metrics, response: JSONResponse) -> JSONResponse:
+    """Count a request turned away before processing, by its status code."""
+    metrics.outcome(_REJECTED.get(response.status_code, "rejected"))
+    return response
+
+
+def _batch_outcome(result: dict) -> str:
+    if result.get("idempotent"):
+        return "idempotent"
+    return {200: "accepted", 202: "deferred", 404: "not_found"}.get(
+        result["status_code"], _REJECTED.get(result["status_code"], "rejected"),
+    )
+
+
+def _signature_rejected(exc: ValueError) -> JSONResponse:
+    logger.warning("Signature verification failed: %s", exc)
+    return JSONResponse(status_code=401, content={"error": str(exc)})
+
+
+def _parse_webhook(body_str: str) -> WebhookPayload | JSONResponse:
+    """Parse and validate a webhook body in one pass, or return the 400/422 response.
+
+    The body is validated straight from JSON text, so no intermediate dict is
+    built. The JSON parser's nesting limit rejects pathologically deep documents
+    as invalid JSON. The same string is later persisted as the event payload.
+    """
+    try:
+        return WebhookPayload.model_validate_json(body_str)
+    except ValidationError as exc:
+        root_errors = {e["type"] for e in exc.errors() if not e["loc"]}
+        if "json_invalid" in root_errors:
+            return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+        if "model_type" in root_errors:
+            return JSONResponse(status_code=400, content={"error": "Expected JSON object"})
+        return JSONResponse(status_code=_validation_status(exc), content={"error": str(exc)})
+
+
+def _validation_status(exc: ValidationError) -> int:
+    """400 when required fields are missing, 422 for wrong types or values."""
+    has_missing = any(e.get("type") == "missing" for e in exc.errors())
+    return 400 if has_missing else 422
+
+
+class DBRetriesExhaustedError(Exception):
+    """A DB job kept failing for MAX_DB_RETRIES attempts."""
+
+
+async def _run_with_retries(app: FastAPI, job, *args):
+    """Run a DB job with linear backoff plus jitter, recording retry metrics.
+
+    A blocking job runs on the DB executor; a coroutine job is awaited as is.
+    Raises DBRetriesExhaustedError once MAX_DB_RETRIES attempts have failed.
+    """
+    executor = app.state.db_executor
+    metrics = app.state.metrics
+    for attempt in range(MAX_DB_RETRIES):
+        try:
+            if asyncio.iscoroutinefunction(job):
+                result = await job(*args)
+            else:
+                result = await _run_db(executor, job, *args)
+        except Exception as exc:  # noqa: BLE001
+            if attempt == MAX_DB_RETRIES - 1:
+                metrics.inc("db_retry_exhausted_total")
+                metrics.observe_histogram("db_attempts", MAX_DB_RETRIES, _ATTEMPT_BUCKETS)
+                raise DBRetriesExhaustedError(str(exc)) from exc
+            metrics.inc("db_retries_total")
+            jitter = random.uniform(0, DB_RETRY_DELAY)
+            await asyncio.sleep(DB_RETRY_DELAY * (attempt + 1) + jitter)
+        else:
+            metrics.observe("db_attempts_per_event", attempt + 1)
+            metrics.observe_histogram("db_attempts", attempt + 1, _ATTEMPT_BUCKETS)
+            return result
+
+
+async def _handle_event(
+    app: FastAPI,
+    job,
+    webhook_id: str,
+    event_type: str,
+    payment_id: str,
+    body_str: str,
+) -> JSONResponse:
+    """Run one event's DB job with retries.
+
+    On exhaustion the event is dead-lettered and acknowledged with 202 once the
+    journal has it on disk; without a journal (or if the journal write fails)
+    the receiver answers 503 so that Yuno retries instead of losing the event.
+    """
+    try:
+        return await _run_with_retries(
+            app, job, app, webhook_id, event_type, payment_id, body_str,
+        )
+    except DBRetriesExhaustedError as exc:
+        logger.error(
+            "DB operations failed after %d attempts for webhook %s",
+            MAX_DB_RETRIES, webhook_id,
+        )
+        metrics = app.state.metrics
+        metrics.outcome("retry_exhausted")
+        journal = app.state.dead_letters
+        if journal is not None:
+            record = dead_letter_record(webhook_id, event_type, payment_id, body_str, str(exc))
+            try:
+                await asyncio.to_thread(journal.append, record)
+            except DeadLetterError:
+                logger.exception("Could not dead-letter webhook %s", webhook_id)
+            else:
+                metrics.inc("dead_lettered_total")
+                return JSONResponse(
+                    status_code=202,
+                    content={"status": "dead_lettered", "webhook_id": webhook_id},
+                )
+        return JSONResponse(
+            status_code=503, content={"error": "Database unavailable, retry"},
+        )
+
+
+def _deferred_backlog(app: FastAPI) -> tuple[int, datetime | None]:
+    """(number of deferred events, oldest received_at); reads only the partial index."""
+    with _session_scope(app) as db:
+        return db.execute(
+            select(func.count(), func.min(WebhookEvent.received_at))
+            .where(WebhookEvent.processing_status == "deferred")
+        ).one()
+
+
+async def _update_deferred_gauges(app: FastAPI) -> None:
+    index = app.state.deferred_index
+    if index is not None:
+        backlog = index.stats()
+        app.state.metrics.set_gauge("deferred_events", backlog["events"])
+        app.state.metrics.set_gauge("deferred_oldest_age_seconds", backlog["oldest_age_seconds"])
+        return
+    try:
+        count, oldest = await _run_db(app.state.db_executor, _deferred_backlog, app)
+    except Exception:  # noqa: BLE001
+        logger.warning("Could not read the deferred backlog", exc_info=True)
+        return
+    age = 0.0
+    if oldest is not None:
+        oldest = oldest if oldest.tzinfo is not None else oldest.replace(tzinfo=timezone.utc)
+        age = max((datetime.now(timezone.utc) - oldest).total_seconds(), 0.0)
+    app.state.metrics.set_gauge("deferred_events", count)
+    app.state.metrics.set_gauge("deferred_oldest_age_seconds", round(age, 3))
+
+
+async def _run_db(executor: ThreadPoolExecutor | None, fn, *args):
+    """Run blocking DB work on the executor, or inline when there is none."""
+    if executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, fn, *args)
+
+
+def _call_db(app: FastAPI, fn, *args):
+    """Synchronous counterpart of _run_db for non-async callers (ingest workers, group commit)."""
+    executor = app.state.db_executor
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+@contextmanager
+def _session_scope(app: FastAPI):
+    """Open a session via the (overridable) get_db dependency on the calling thread.
+
+    The session is created, used and closed on one thread so that pooled SQLite
+    connections are never checked in from a different thread than they run on.
+    """
+    provider = app.dependency_overrides.get(get_db, get_db)
+    sessions = provider()
+    db = next(sessions)
+    try:
+        yield db
+    finally:
+        sessions.close()
+
+
+def _process_in_session(
+    app: FastAPI,
+    webhook_id: str,
+    event_type: str,
+    payment_id: str,
+    body_str: str,
+) -> JSONResponse:
+    """Run one attempt of _process_event in a fresh session; errors propagate for retry.
+
+    Once the event row is committed (processed, deferred or already present),
+    its webhook_id is recorded in the idempotency front cache.
+    """
+    with _session_scope(app) as db:
+        try:
+            response = _process_event(
+                db, webhook_id, event_type, payment_id, body_str,
+                payment_cache=app.state.payment_cache, metrics=app.state.metrics,
+                payload_storage=app.state.payload_storage,
+                deferred_index=app.state.deferred_index,
+                archive_probe=app.state.archive_probe,
+            )
+        except Exception:
+            db.rollback()
+            raise
+    cache = app.state.idempotency_cache
+    if cache is not None and response.status_code in (200, 202):
+        cache.add(webhook_id)
+    return response
+
+
+async def _process_in_group(
+    app: FastAPI,
+    webhook_id: str,
+    event_type: str,
+    payment_id: str,
+    body_str: str,
+) -> JSONResponse:
+    """Hand one event to the group-commit writer and wait for its group to commit.
+
+    Errors of the group's transaction propagate for retry, as in _process_in_session.
+    """
+    metrics = app.state.metrics
+    started = metrics.clock()
+    future = app.state.group_writer.submit(BatchEvent(webhook_id, event_type, payment_id, body_str))
+    result = await asyncio.wrap_future(future)
+    metrics.lap("group_commit", started)
+    metrics.outcome(_batch_outcome(result))
+    cache = app.state.idempotency_cache
+    if cache is not None and result["status_code"] in (200, 202):
+        cache.add(webhook_id)
+    if "error" in result:
+        return JSONResponse(status_code=result["status_code"], content={"error": result["error"]})
+    return JSONResponse(
+        status_code=result["status_code"],
+        content={k: v for k, v in result.items() if k != "status_code"},
+    )
+
+
+def _enqueue_in_session(
+    app: FastAPI,
+    webhook_id: str,
+    event_type: str,
+    payment_id: str,
+    body_str: str,
+) -> JSONResponse:
+    """Durably enqueue an event for the ingest workers; errors propagate for retry."""
+    app.state.ingest_queue.enqueue(webhook_id, event_type, payment_id, body_str)
+    app.state.metrics.outcome("queued")
+    return JSONResponse(
+        status_code=202,
+        content={"status": "queued", "webhook_id": webhook_id},
+    )
+
+
+def _process_batch_in_session(app: FastAPI, events: list[BatchEvent]) -> list[dict]:
+    """Run one attempt of process_events in a fresh session; errors propagate for retry."""
+    with _session_scope(app) as db:
+        try:
+            results = process_events(
+                db, events, payload_storage=app.state.payload_storage,
+                deferred_index=app.state.deferred_index,
+            )
+        except Exception:
+            db.rollback()
+            raise
+    # process_events writes statuses through the ORM, not the cache
+    payment_cache = app.state.payment_cache
+    if payment_cache is not None:
+        for payment_id in {e.payment_id for e in events}:
+            payment_cache.invalidate(payment_id)
+    return results
+
+
+def _idempotent_response(webhook_id: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=200,
+        content={"status": "accepted", "webhook_id": webhook_id, "idempotent": True},
+    )
+
+
+class StalePaymentStatusError(Exception):
+    """The payment kept changing under MAX_CAS_ATTEMPTS compare-and-set writes."""
+
+
+def _read_payment_state(db: Session, payment_id: str) -> PaymentState | None:
+    row = db.execute(
+        select(Payment.status, Payment.version).where(Payment.id == payment_id)
+    ).first()
+    return PaymentState(*row) if row is not None else None
+
+
+def _payment_not_found(db: Session, payment_id: str, metrics: Metrics) -> JSONResponse:
+    db.rollback()
+    metrics.outcome("not_found")
+    return JSONResponse(
+        status_code=404,
+        content={"error": f"Payment '{payment_id}' not found"},
+    )
+
+
 def _process_event(
     db: Session,
     webhook_id: str,
     event_type: str,
     payment_id: str,
     body_str: str,
+    payment_cache: PaymentStatusCache | None = None,
+    metrics: Metrics | None = None,
+    payload_storage: str = "text",
+    deferred_index: DeferredIndex | None = None,
+    archive_probe: ArchiveProbe | None = None,
 ) -> JSONResponse:
     """Execute database operations for a single webhook event.
 
-    Any database errors (OperationalError, etc.) propagate to the caller for retry.
+    The payment's (status, version) comes from `payment_cache` when it holds the
+    payment and is read before the idempotency claim, so an event for an
+    unknown payment is answered 404 without an insert and rollback. The
+    transition is persisted with a compare-and-set UPDATE on the version. A lost
+    compare-and-set re-reads just that row and re-decides in the same
+    transaction, keeping the idempotency claim.
+
+    Any database errors (OperationalError, etc.) propagate to the caller for
+    retry, as does StalePaymentStatusError when every compare-and-set loses.
+
+    Stage timings and outcomes go to `metrics` when it is instrumented, and
+    `deferred_index` follows the events this commit defers or replays.
+    Archived fingerprints are looked up only when `archive_probe` (if given)
+    says there can be any.
     """
-    # 5. Atomic idempotency claim via unique constraint
+    obs = metrics if metrics is not None else _UNINSTRUMENTED
+    lap = obs.clock()
+    # 5. Look up payment state (cache first) -> 404 before anything is written.
+    # It is read before the claim, so it stays unconfirmed until step 7.
+    state = payment_cache.get(payment_id) if payment_cache is not None else None
+    if state is None:
+        state = _read_payment_state(db, payment_id)
+        if state is None:
+            return _payment_not_found(db, payment_id, obs)
+    unconfirmed = True
+    lap = obs.lap("payment_load", lap)
+
+    # 6. Atomic idempotency claim via unique constraint
+    now = datetime.now(timezone.utc)
     event = WebhookEvent(
         webhook_id=webhook_id,
         payment_id=payment_id,
         event_type=event_type,
-        payload=body_str,
+        **payload_columns(body_str, payload_storage),
         processing_status="processing",
-        received_at=datetime.now(timezone.utc),
+        received_at=now,
     )
     db.add(event)
     try:
         db.flush()
     except IntegrityError:
         db.rollback()
-        return JSONResponse(
-            status_code=200,
-            content={"status": "accepted", "webhook_id": webhook_id, "idempotent": True},
-        )
-
-    # 6. Look up payment -> 404 if not found
-    payment = db.get(Payment, payment_id)
-    if payment is None:
+        obs.outcome("idempotent")
+        return _idempotent_response(webhook_id)
+    # Checked after the claim: an event being archived concurrently is either
+    # still in webhook_events (the claim fails) or already fingerprinted.
+    if (archive_probe is None or archive_probe.needed(db)) and is_archived(db, webhook_id):
         db.rollback()
-        return JSONResponse(
-            status_code=404,
-            content={"error": f"Payment '{payment_id}' not found"},
-        )
+        obs.outcome("idempotent")
+        return _idempotent_response(webhook_id)
+    lap = obs.lap("idempotency_claim", lap)
 
-    # 7. Apply state transition
-    try:
-        new_status = apply_transition(payment.status, event_type)
-    except OutOfOrderEventError:
-        event.processing_status = "deferred"
-        db.commit()
-        return JSONResponse(
-            status_code=202,
-            content={"status": "deferred", "webhook_id": webhook_id},
-        )
-    except InvalidTransitionError as exc:
-        db.rollback()
-        return JSONResponse(status_code=422, content={"error": str(exc)})
+    for _ in range(MAX_CAS_ATTEMPTS):
+        # 7. Decide the state transition. Only an APPLIED decision is protected
+        # by the compare-and-set, so a state read before the claim that defers
+        # or rejects the event is confirmed against the database first.
+        result, new_status = decide(state.status, event_type)
+        if unconfirmed and result is not TransitionResult.APPLIED:
+            state, unconfirmed = _read_payment_state(db, payment_id), False
+            if state is None:
+                if payment_cache is not None:
+                    payment_cache.invalidate(payment_id)
+                return _payment_not_found(db, payment_id, obs)
+            result, new_status = decide(state.status, event_type)
+        if result is TransitionResult.DEFERRED:
+            event.processing_status = "deferred"
+            row_id = event.id
+            lap = obs.lap("transition", lap)
+            db.commit()
+            obs.lap("commit", lap)
+            if payment_cache is not None:
+                payment_cache.put(payment_id, state)
+            if deferred_index is not None:
+                deferred_index.add(row_id, payment_id, event_type, now)
+            obs.outcome("deferred")
+            return JSONResponse(
+                status_code=202,
+                content={"status": "deferred", "webhook_id": webhook_id},
+            )
+        if result is TransitionResult.INVALID:
+            reason = rejection_reason(state.status, event_type)
+            db.rollback()
+            obs.outcome("invalid")
+            return JSONResponse(status_code=422, content={"error": reason})
+        lap = obs.lap("transition", lap)
 
-    # 8. Update payment status + mark event processed
-    payment.status = new_status
-    payment.updated_at = datetime.now(timezone.utc)
-    event.processing_status = "processed"
-    event.processed_at = datetime.now(timezone.utc)
+        # 8. Chain through any deferred events this transition unblocked
+        final_status, replayed = _replay_deferred_events(db, payment_id, new_status)
+        lap = obs.lap("replay", lap)
 
-    # 9. Commit
-    db.commit()
+        # 9. Compare-and-set the payment on its version (timed as part of "commit")
+        swapped = db.execute(
+            update(Payment)
+            .where(Payment.id == payment_id, Payment.version == state.version)
+            .values(status=final_status, version=state.version + 1, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if swapped:
+            break
+        if metrics is not None:
+            metrics.inc("payment_cas_conflicts_total")
+        state, unconfirmed = _read_payment_state(db, payment_id), False
+        if state is None:
+            if payment_cache is not None:
+                payment_cache.invalidate(payment_id)
+            return _payment_not_found(db, payment_id, obs)
+    else:
+        if payment_cache is not None:
+            payment_cache.invalidate(payment_id)
+        raise StalePaymentStatusError(
+            f"Payment '{payment_id}' changed during {MAX_CAS_ATTEMPTS} attempts"
+        )
 
-    # 10. Attempt deferred replay
-    _replay_deferred_events(db, payment)
+    # 10. Mark events processed and commit them with the payment in one transaction
+    replayed_ids = [e.id for e in replayed]
+    for processed in (event, *replayed):
+        processed.processing_status = "processed"
+        processed.processed_at = now
+    db.commit()
+    obs.lap("commit", lap)
+    if payment_cache is not None:
+        payment_cache.put(payment_id, PaymentState(final_status, state.version + 1))
+    if deferred_index is not None and replayed_ids:
+        deferred_index.remove(replayed_ids)
 
     # 11. Return 200
+    obs.outcome("accepted")
     return JSONResponse(
         status_code=200,
         content={"status": "accepted", "webhook_id": webhook_id},
     )
 
 
-def _replay_deferred_events(db: Session, payment: Payment) -> None:
-    """Replay deferred events for a payment after a successful transition.
+def _replay_deferred_events(
+    db: Session, payment_id: str, status: str,
+) -> tuple[str, list[WebhookEvent]]:
+    """Work out which deferred events a transition to `status` unblocks.
 
-    Loops until no more progress can be made, enabling full reverse-order delivery.
+    The deferred set is loaded once (via ix_webhook_events_payment_status) and
+    indexed by event type. Each step looks up which of the current state's
+    ready_events() have a waiting event and applies the oldest one, so a full
+    reverse-order lifecycle is chained in a single pass. Nothing is written;
+    the caller persists the result together with the triggering event.
+
+    Returns the final status and the events applied, in order.
     """
-    made_progress = True
-    while made_progress:
-        made_progress = False
-        deferred = (
-            db.query(WebhookEvent)
-            .filter(
-                WebhookEvent.payment_id == payment.id,
-                WebhookEvent.processing_status == "deferred",
-            )
-            .order_by(WebhookEvent.id)
-            .all()
+    deferred = (
+        db.query(WebhookEvent)
+        .filter(
+            WebhookEvent.payment_id == payment_id,
+            WebhookEvent.processing_status == "deferred",
         )
-        for event in deferred:
-            try:
-                new_status = apply_transition(payment.status, event.event_type)
-            except (InvalidTransitionError, OutOfOrderEventError):
-                continue
-            payment.status = new_status
-            payment.updated_at = datetime.now(timezone.utc)
-            event.processing_status = "processed"
-            event.processed_at = datetime.now(timezone.utc)
-            try:
-                db.commit()
-                made_progress = True
-            except Exception:  # noqa: BLE001
-                db.rollback()
+        .order_by(WebhookEvent.id)
+        .all()
+    )
+    if not deferred:
+        return status, []
+
+    waiting: dict[str, deque[WebhookEvent]] = defaultdict(deque)
+    for event in deferred:
+        waiting[event.event_type].append(event)
+
+    applied: list[WebhookEvent] = []
+    while True:
+        ready = [
+            waiting[event_type][0]
+            for event_type in ready_events(status)
+            if waiting.get(event_type)
+        ]
+        if not ready:
+            break
+        event = min(ready, key=lambda e: e.id)
+        waiting[event.event_type].popleft()
+        _, status = decide(status, event.event_type)
+        applied.append(event)
+    return status, applied
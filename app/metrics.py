@@ -0,0 +1,273 @@
+"""In-process metrics: thread-safe counters, latency summaries and histograms.
+
+Besides the always-on counters and summaries, an instrumented `Metrics` records
+per-stage latency histograms for the webhook hot path, outcome counts, other
+histograms and gauges. With `enabled=False` those calls return after one
+attribute check, and `clock()` does not even read the timer.
+
+`snapshot()` is the JSON form served at `GET /metrics`; `prometheus()` renders
+the same data in the Prometheus text exposition format.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Sequence
+
+# Seconds; spans a sub-millisecond parse up to a multi-second retry storm.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+PROMETHEUS_PREFIX = "fulfillhub"
+
+
+class Summary:
+    """Running count / sum / max of an observed value."""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.total, 6), "max": round(self.max, 6)}
+
+
+class Histogram:
+    """Fixed-bucket histogram; bucket i counts values <= bounds[i] (last is +Inf)."""
+
+    __slots__ = ("bounds", "counts", "count", "total")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """(upper bound, count of values <= bound) pairs, ending with +Inf."""
+        running = 0
+        pairs = []
+        for bound, count in zip((*self.bounds, math.inf), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside its bucket (0.0 when empty)."""
+        rank = q * self.count
+        running = 0
+        lower = 0.0
+        for index, count in enumerate(self.counts):
+            if count and running + count >= rank:
+                if index == len(self.bounds):
+                    return lower  # past the last bound: report that bound
+                return lower + (self.bounds[index] - lower) * (rank - running) / count
+            running += count
+            if index < len(self.bounds):
+                lower = self.bounds[index]
+        return 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "buckets": {
+                ("+Inf" if math.isinf(bound) else repr(bound)): running
+                for bound, running in self.cumulative()
+            },
+        }
+
+
+class Metrics:
+    """Registry of named counters and summaries shared by one app instance.
+
+    Args:
+        enabled: Record stage timings, outcomes, histograms and gauges. The
+            plain counters and summaries are always recorded.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._summaries: dict[str, Summary] = defaultdict(Summary)
+        self._stages: dict[str, Histogram] = {}
+        self._outcomes: dict[str, int] = defaultdict(int)
+        self._histograms: dict[str, Histogram] = {}
+        self._gauges: dict[str, float] = {}
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._summaries[name].observe(value)
+
+    # ── Instrumentation (no-ops when disabled) ───────────────────────────────
+
+    def clock(self) -> float:
+        """Start/lap timestamp for stage timings; 0.0 when disabled."""
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def lap(self, stage: str, started: float) -> float:
+        """Record the time since `started` under `stage` and return the new lap start."""
+        if not self.enabled:
+            return started
+        now = time.perf_counter()
+        self.observe_stage(stage, now - started)
+        return now
+
+    def outcome(self, outcome: str) -> None:
+        if self.enabled:
+            with self._lock:
+                self._outcomes[outcome] += 1
+
+    def observe_histogram(
+        self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set_gauge(self, name: str, value: float) -> None:
+        if self.enabled:
+            with self._lock:
+                self._gauges[name] = value
+
+    # ── Reading ──────────────────────────────────────────────────────────────
+
+    def register(self, name: str, collector: Callable[[], dict]) -> None:
+        """Include collector()'s dict under `name` in every snapshot."""
+        self._collectors[name] = collector
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def outcome_count(self, outcome: str) -> int:
+        with self._lock:
+            return self._outcomes.get(outcome, 0)
+
+    def stage(self, stage: str) -> Histogram | None:
+        return self._stages.get(stage)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snapshot = {
+                "counters": dict(self._counters),
+                "summaries": {name: s.as_dict() for name, s in self._summaries.items()},
+                "stages": {name: h.as_dict() for name, h in self._stages.items()},
+                "outcomes": dict(self._outcomes),
+                "histograms": {name: h.as_dict() for name, h in self._histograms.items()},
+                "gauges": dict(self._gauges),
+            }
+        for name, collector in self._collectors.items():
+            snapshot[name] = collector()
+        return snapshot
+
+    def prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        """Render every metric in the Prometheus text exposition format (0.0.4)."""
+        lines: list[str] = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                _family(lines, f"{prefix}_{name}", "counter", [("", value)])
+            for name, summary in sorted(self._summaries.items()):
+                metric = f"{prefix}_{name}"
+                _family(lines, metric, "summary", [
+                    ("_count", summary.count), ("_sum", summary.total),
+                ])
+                _family(lines, f"{metric}_max", "gauge", [("", summary.max)])
+            if self._stages:
+                lines.append(f"# TYPE {prefix}_webhook_stage_seconds histogram")
+                for stage, histogram in sorted(self._stages.items()):
+                    _histogram_lines(
+                        lines, f"{prefix}_webhook_stage_seconds", histogram,
+                        f'stage="{stage}"',
+                    )
+            if self._outcomes:
+                metric = f"{prefix}_webhook_outcomes_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(
+                    f'{metric}{{outcome="{outcome}"}} {_number(value)}'
+                    for outcome, value in sorted(self._outcomes.items())
+                )
+            for name, histogram in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                _histogram_lines(lines, f"{prefix}_{name}", histogram)
+            for name, value in sorted(self._gauges.items()):
+                _family(lines, f"{prefix}_{name}", "gauge", [("", value)])
+        for name, collector in self._collectors.items():
+            for path, value in _numeric_leaves(collector(), [name]):
+                metric = _METRIC_NAME.sub("_", f"{prefix}_{'_'.join(path)}")
+                _family(lines, metric, "gauge", [("", value)])
+        return "\n".join(lines) + "\n"
+
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _number(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _family(lines: list[str], metric: str, kind: str, samples) -> None:
+    lines.append(f"# TYPE {metric} {kind}")
+    lines.extend(f"{metric}{suffix} {_number(value)}" for suffix, value in samples)
+
+
+def _histogram_lines(lines: list[str], metric: str, histogram: Histogram, labels: str = "") -> None:
+    sep = "," if labels else ""
+    for bound, running in histogram.cumulative():
+        le = "+Inf" if math.isinf(bound) else repr(bound)
+        lines.append(f'{metric}_bucket{{{labels}{sep}le="{le}"}} {running}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{suffix} {_number(histogram.total)}")
+    lines.append(f"{metric}_count{suffix} {histogram.count}")
+
+
+def _numeric_leaves(value, path: list[str]):
+    """(path, number) for every int/float/bool leaf of a collector's nested dict."""
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _numeric_leaves(child, [*path, str(key)])
+    elif isinstance(value, (int, float)):
+        yield path, value
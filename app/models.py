@@ -2,7 +2,8 @@ import uuid
 from datetime import datetime, timezone
 
 from sqlalchemy import (
-    Column, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint,
+    BigInteger, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, String,
+    Text, UniqueConstraint, text,
 )
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -11,6 +12,10 @@ class Base(DeclarativeBase):
     pass
 
 
+def _inserted_status(context) -> str:
+    return context.get_current_parameters().get("status") or "pending"
+
+
 class Payment(Base):
     __tablename__ = "payments"
 
@@ -19,12 +24,20 @@ class Payment(Base):
     amount = Column(Integer, nullable=False)  # centavos
     currency = Column(String(10), nullable=False)
     status = Column(String(50), nullable=False, default="pending")
+    # Status the payment was created with, where its event log starts (see
+    # app.projection); NULL only for rows that predate the column.
+    initial_status = Column(String(50), nullable=True, default=_inserted_status)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
                         onupdate=lambda: datetime.now(timezone.utc))
+    # Bumped by every status write; ORM flushes check it (version_id_col) and the
+    # webhook path compare-and-sets on it.
+    version = Column(Integer, nullable=False, default=1)
 
     events = relationship("WebhookEvent", back_populates="payment")
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 class WebhookEvent(Base):
     __tablename__ = "webhook_events"
@@ -33,13 +46,101 @@ class WebhookEvent(Base):
     webhook_id = Column(String(255), nullable=False, unique=True)
     payment_id = Column(String(36), ForeignKey("payments.id"), nullable=False)
     event_type = Column(String(100), nullable=False)
-    payload = Column(Text, nullable=True)
+    # The payload is stored either as text or compressed (see app.payloads);
+    # read it through the `payload` property, which decodes either form.
+    payload_text = Column("payload", Text, nullable=True)
+    payload_zlib = Column(LargeBinary, nullable=True)
     processing_status = Column(String(50), nullable=False, default="processing")
     received_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     processed_at = Column(DateTime, nullable=True)
 
     payment = relationship("Payment", back_populates="events")
 
+    @property
+    def payload(self) -> str | None:
+        if self.payload_zlib is not None:
+            from app.payloads import decompress_payload
+            return decompress_payload(self.payload_zlib)
+        return self.payload_text
+
+    @payload.setter
+    def payload(self, value: str | None) -> None:
+        self.payload_text = value
+        self.payload_zlib = None
+
+    __table_args__ = (
+        # webhook_id needs no extra index: its unique constraint already is one.
+        # Deferred replay loads one payment's deferred events with this index.
+        Index("ix_webhook_events_payment_status", "payment_id", "processing_status"),
+        # Partial: only deferred rows, so the backlog gauges never scan the table
+        # and events that are never deferred never touch it.
+        Index(
+            "ix_webhook_events_deferred_received", "received_at",
+            sqlite_where=text("processing_status = 'deferred'"),
+            postgresql_where=text("processing_status = 'deferred'"),
+        ),
+    )
+
+
+class PaymentSnapshot(Base):
+    """A payment's status after folding its event log up to `last_event_id`."""
+
+    __tablename__ = "payment_snapshots"
+
+    payment_id = Column(String(36), primary_key=True)
+    status = Column(String(50), nullable=False)
+    last_event_id = Column(Integer, nullable=False, default=0)
+    # Events up to last_event_id that were still deferred, as comma-separated
+    # ids; first_waiting_id lets the tail query find them with a range test.
+    waiting = Column(Text, nullable=False, default="")
+    first_waiting_id = Column(Integer, nullable=True)
+    taken_at = Column(DateTime, nullable=False)
+
+
+class ArchivedThrough(Base):
+    """How far a payment's log has been archived: its events up to
+    `last_event_id` may no longer be in `webhook_events`."""
+
+    __tablename__ = "archived_through"
+
+    payment_id = Column(String(36), primary_key=True)
+    last_event_id = Column(Integer, nullable=False)
+
+
+class IngestOutbox(Base):
+    """Durably accepted events awaiting processing in queued ingest mode."""
+
+    __tablename__ = "ingest_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    webhook_id = Column(String(255), nullable=False)
+    payment_id = Column(String(36), nullable=False)
+    event_type = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=True)
+    partition = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    enqueued_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
     __table_args__ = (
-        Index("ix_webhook_events_webhook_id", "webhook_id"),
+        Index("ix_ingest_outbox_partition_id", "partition", "id"),
+        # Finds a parked row ahead of a fetched one (IngestQueue._held)
+        Index("ix_ingest_outbox_payment_id", "payment_id", "id"),
     )
+
+
+class SeenSignature(Base):
+    """Verified signatures still inside the age window (shared replay protection)."""
+
+    __tablename__ = "seen_signatures"
+
+    signature = Column(String(64), primary_key=True)
+    bucket = Column(Integer, nullable=False, index=True)
+
+
+class ArchivedWebhook(Base):
+    """Fingerprints of archived events, still deduplicated until the window passes."""
+
+    __tablename__ = "archived_webhooks"
+
+    fingerprint = Column(BigInteger, primary_key=True, autoincrement=False)
+    received_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,140 @@
+"""Compact storage for `WebhookEvent` payloads.
+
+Webhook bodies are small JSON documents that repeat the same keys and event
+names, so plain zlib barely shrinks them. The "zlib-dict" mode primes raw
+DEFLATE with a preset dictionary of that shared vocabulary, which turns a
+~170 byte payload into ~40 bytes.
+
+Compressed payloads go to `webhook_events.payload_zlib` (LargeBinary). The first
+byte names the codec, so rows written in any mode -- including legacy rows in
+the `payload` Text column -- decode transparently through `WebhookEvent.payload`.
+
+Existing databases: `ensure_payload_column(engine)` adds the column, then
+`migrate_payloads(db, mode)` rewrites old rows in small committed batches:
+
+    python -m app.payloads --mode zlib-dict
+"""
+import argparse
+import zlib
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models import WebhookEvent
+
+PAYLOAD_STORAGE_MODES = ("text", "zlib", "zlib-dict")
+MIGRATION_BATCH_SIZE = 500
+
+_ZLIB = b"\x01"
+_ZLIB_DICT_V1 = b"\x02"
+_WBITS = -15  # raw DEFLATE: no zlib header/checksum, the codec byte replaces it
+_LEVEL = 9
+
+# Shared vocabulary of Yuno webhook bodies. Never edit in place: add a new
+# version (codec byte + dictionary) so rows written with this one still decode.
+_DICTIONARY_V1 = (
+    '{"webhook_id": "wh-", "event_type": "payment.refunded", "payment.chargeback", '
+    '"payment.declined", "payment.settled", "payment.captured", "payment.authorized", '
+    '"data": {"payment_id": "pay_", "merchant_id": "merchant_", "amount": 10000, '
+    '"currency": "USD"}}'
+).encode()
+_DICTIONARIES = {_ZLIB: None, _ZLIB_DICT_V1: _DICTIONARY_V1}
+
+
+def _deflate(data: bytes, zdict: bytes | None) -> bytes:
+    kwargs = {"zdict": zdict} if zdict is not None else {}
+    compressor = zlib.compressobj(_LEVEL, zlib.DEFLATED, _WBITS, 9, zlib.Z_DEFAULT_STRATEGY, **kwargs)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_payload(payload: str, mode: str) -> bytes:
+    """Encode a payload for `payload_zlib` in a compressed mode."""
+    codec = _ZLIB_DICT_V1 if mode == "zlib-dict" else _ZLIB
+    return codec + _deflate(payload.encode("utf-8"), _DICTIONARIES[codec])
+
+
+def decompress_payload(blob: bytes) -> str:
+    codec, data = blob[:1], blob[1:]
+    if codec not in _DICTIONARIES:
+        raise ValueError(f"Unknown payload codec {codec!r}")
+    zdict = _DICTIONARIES[codec]
+    kwargs = {"zdict": zdict} if zdict is not None else {}
+    decompressor = zlib.decompressobj(_WBITS, **kwargs)
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+def payload_columns(payload: str | None, mode: str) -> dict:
+    """Column values storing `payload` in `mode` (for inserts and bulk updates)."""
+    if mode not in PAYLOAD_STORAGE_MODES:
+        raise ValueError(
+            f"Unknown payload storage {mode!r}; expected one of {PAYLOAD_STORAGE_MODES}."
+        )
+    if payload is None or mode == "text":
+        return {"payload_text": payload, "payload_zlib": None}
+    return {"payload_text": None, "payload_zlib": compress_payload(payload, mode)}
+
+
+def ensure_payload_column(engine: Engine) -> bool:
+    """Add `webhook_events.payload_zlib` to a database created before it existed."""
+    columns = {c["name"] for c in inspect(engine).get_columns("webhook_events")}
+    if "payload_zlib" in columns:
+        return False
+    blob = "BYTEA" if engine.dialect.name == "postgresql" else "BLOB"
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE webhook_events ADD COLUMN payload_zlib {blob}"))
+    return True
+
+
+def migrate_payloads(db: Session, mode: str, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Rewrite stored payloads into `mode`, committing every `batch_size` rows.
+
+    Rows already stored the way `mode` would store them are skipped, so the
+    migration can be interrupted and re-run. Returns the number of rows rewritten.
+    """
+    if mode == "text":
+        pending = WebhookEvent.payload_zlib.is_not(None)
+    else:
+        codec = _ZLIB_DICT_V1 if mode == "zlib-dict" else _ZLIB
+        pending = WebhookEvent.payload_text.is_not(None) | (
+            WebhookEvent.payload_zlib.is_not(None)
+            & (func.substr(WebhookEvent.payload_zlib, 1, 1) != codec)
+        )
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(WebhookEvent.id, WebhookEvent.payload_text, WebhookEvent.payload_zlib)
+            .where(WebhookEvent.id > last_id, pending)
+            .order_by(WebhookEvent.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return migrated
+        db.execute(update(WebhookEvent), [
+            {"id": row_id, **payload_columns(
+                decompress_payload(blob) if blob is not None else payload, mode,
+            )}
+            for row_id, payload, blob in rows
+        ])
+        db.commit()
+        migrated += len(rows)
+        last_id = rows[-1].id
+
+
+def main(argv: list[str] | None = None) -> None:
+    from app.database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Rewrite stored webhook payloads.")
+    parser.add_argument("--mode", choices=PAYLOAD_STORAGE_MODES, required=True)
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if ensure_payload_column(engine):
+        print("added webhook_events.payload_zlib")
+    with SessionLocal() as db:
+        print(f"rewrote {migrate_payloads(db, args.mode, args.batch_size)} payloads")
+
+
+if __name__ == "__main__":
+    main()
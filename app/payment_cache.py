@@ -0,0 +1,65 @@
+"""Write-through cache of payment (status, version), keyed by payment_id.
+
+Lifecycle events for a payment arrive in bursts, so the receiver keeps the last
+status and version it committed for each hot payment. A transition decided from
+a cached entry is persisted with a compare-and-set UPDATE on the version, so a
+stale entry can never overwrite a newer status: the UPDATE matches no row and
+the event is re-decided from a fresh read.
+"""
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+DEFAULT_PAYMENT_CACHE_SIZE = 10_000
+
+
+class PaymentState(NamedTuple):
+    status: str
+    version: int
+
+
+class PaymentStatusCache:
+    """Bounded LRU of payment_id -> last committed PaymentState."""
+
+    def __init__(self, max_entries: int = DEFAULT_PAYMENT_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, PaymentState] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, payment_id: str) -> PaymentState | None:
+        with self._lock:
+            state = self._entries.get(payment_id)
+            if state is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(payment_id)
+            self.hits += 1
+            return state
+
+    def put(self, payment_id: str, state: PaymentState) -> None:
+        """Record the state just committed (or read) for a payment."""
+        with self._lock:
+            self._entries[payment_id] = state
+            self._entries.move_to_end(payment_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, payment_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(payment_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,212 @@
+"""Bulk payment preloading: stream CSV or JSONL into `payments` with chunked upserts.
+
+Webhooks can only be applied to payments that already exist, so payments are
+loaded ahead of their events. Rows are read lazily and written `chunk_size` at
+a time with one Core executemany of
+`INSERT ... ON CONFLICT (id) DO UPDATE`, each chunk in its own transaction,
+so memory stays bounded whatever the size of the file.
+
+A row that already exists gets its merchant_id, amount and currency updated,
+and `updated_at` only if one of them changed, so re-running an import does
+not mark its payments as changed for the Snapshotter. Its status is left alone, because once a payment has events its status
+belongs to them (see app.projection). `status` only seeds new payments, and
+is recorded as their `initial_status`, where the projection's fold starts.
+
+    python -m app.preload payments.csv
+    python -m app.preload payments.jsonl --chunk-size 10000
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+from typing import IO, Iterable, Iterator
+
+from sqlalchemy import bindparam, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Payment
+from app.schemas import MAX_AMOUNT
+from app.state_machine import STATES
+
+PRELOAD_CHUNK_SIZE = 5000
+FORMATS = ("csv", "jsonl")
+REQUIRED_FIELDS = ("id", "merchant_id", "amount", "currency")
+
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+_SUFFIXES = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+# Columns an import may change on an existing payment
+_DETAILS = ("merchant_id", "amount", "currency")
+# Keep IN lists well under SQLite's bound-parameter limit.
+_LOOKUP_SIZE = 500
+_payments = Payment.__table__
+
+
+class PaymentImportError(ValueError):
+    """An input row cannot be turned into a payment."""
+
+
+def payment_row(record: dict, line: int) -> dict:
+    """Validate one input record into a `payments` row; `line` is for the error message."""
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, "")]
+    if missing:
+        raise PaymentImportError(f"line {line}: missing {', '.join(missing)}")
+    amount = record["amount"]
+    if isinstance(amount, str):  # CSV, or a JSON string
+        try:
+            amount = int(amount)
+        except ValueError:
+            amount = None
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        raise PaymentImportError(f"line {line}: amount {record['amount']!r} is not an integer")
+    if not 0 <= amount <= MAX_AMOUNT:
+        raise PaymentImportError(f"line {line}: amount {amount} is not between 0 and {MAX_AMOUNT}")
+    status = record.get("status") or "pending"
+    if status not in STATES:
+        raise PaymentImportError(f"line {line}: unknown status {status!r}")
+    return {
+        "id": str(record["id"]),
+        "merchant_id": str(record["merchant_id"]),
+        "amount": amount,
+        "currency": str(record["currency"]),
+        "status": status,
+    }
+
+
+def read_csv(stream: IO[str]) -> Iterator[dict]:
+    """Rows of a CSV file with a header line (line numbers count the header)."""
+    for line, record in enumerate(csv.DictReader(stream), start=2):
+        yield payment_row(record, line)
+
+
+def read_jsonl(stream: IO[str]) -> Iterator[dict]:
+    """Rows of a file with one JSON object per line; blank lines are skipped."""
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            raise PaymentImportError(f"line {line}: invalid JSON") from None
+        if not isinstance(record, dict):
+            raise PaymentImportError(f"line {line}: expected a JSON object")
+        yield payment_row(record, line)
+
+
+def read_payments(stream: IO[str], fmt: str) -> Iterator[dict]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}.")
+    return read_csv(stream) if fmt == "csv" else read_jsonl(stream)
+
+
+def upsert_payments(
+    db: Session, rows: Iterable[dict], chunk_size: int = PRELOAD_CHUNK_SIZE,
+) -> dict:
+    """Upsert `rows` (as produced by `payment_row`) chunk by chunk, committing each.
+
+    A chunk containing an invalid row is not written; earlier chunks stay
+    committed. Dialects without INSERT ... ON CONFLICT look up each chunk's
+    existing payments and write updates and inserts separately. Returns counts
+    and the rate in rows per second.
+    """
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    stmt = None
+    if insert is not None:
+        stmt = insert(_payments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={column: stmt.excluded[column] for column in (*_DETAILS, "updated_at")},
+            where=or_(*(_payments.c[column] != stmt.excluded[column] for column in _DETAILS)),
+        )
+    started = time.perf_counter()
+    written = chunks = 0
+    chunk: list[dict] = []
+
+    def flush() -> None:
+        nonlocal written, chunks
+        try:
+            if stmt is None:
+                _upsert_each(db, chunk)
+            else:
+                db.connection().execute(stmt, chunk)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        written += len(chunk)
+        chunks += 1
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    seconds = time.perf_counter() - started
+    return {
+        "rows": written,
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(written / seconds, 1) if seconds else 0.0,
+    }
+
+
+def _upsert_each(db: Session, chunk: list[dict]) -> None:
+    """The ON CONFLICT upsert of one chunk, as a lookup, an UPDATE and an INSERT."""
+    merged: dict[str, dict] = {}
+    for row in chunk:  # a repeated id updates the details of its first row
+        if row["id"] in merged:
+            merged[row["id"]].update({column: row[column] for column in _DETAILS})
+        else:
+            merged[row["id"]] = dict(row)
+    ids = list(merged)
+    existing: dict[str, tuple] = {}
+    for start in range(0, len(ids), _LOOKUP_SIZE):
+        for payment_id, *details in db.execute(
+            select(_payments.c.id, *(_payments.c[column] for column in _DETAILS))
+            .where(_payments.c.id.in_(ids[start:start + _LOOKUP_SIZE]))
+        ):
+            existing[payment_id] = tuple(details)
+    changed = [
+        {"key": payment_id, **{column: row[column] for column in _DETAILS}}
+        for payment_id, row in merged.items()
+        if payment_id in existing
+        and existing[payment_id] != tuple(row[column] for column in _DETAILS)
+    ]
+    if changed:
+        db.connection().execute(
+            update(_payments).where(_payments.c.id == bindparam("key")), changed,
+        )
+    new = [row for payment_id, row in merged.items() if payment_id not in existing]
+    if new:
+        db.connection().execute(_payments.insert(), new)
+
+
+def main(argv: list[str] | None = None) -> int:
+    from app.database import SessionLocal, engine, init_db
+    from app.projection import ensure_initial_status_column
+
+    parser = argparse.ArgumentParser(description="Bulk-load payments from CSV or JSONL.")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file suffix")
+    parser.add_argument("--chunk-size", type=int, default=PRELOAD_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or _SUFFIXES.get(args.path.suffix.lower())
+    if fmt is None:
+        parser.error(f"cannot tell the format of {args.path}; pass --format")
+    init_db()
+    ensure_initial_status_column(engine)
+    with open(args.path, newline="", encoding="utf-8") as stream, SessionLocal() as db:
+        try:
+            stats = upsert_payments(db, read_payments(stream, fmt), args.chunk_size)
+        except PaymentImportError as exc:
+            parser.exit(1, f"{args.path}: {exc}\n")
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
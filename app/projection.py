@@ -0,0 +1,450 @@
+"""Event-sourced payments: `webhook_events` is the log, `Payment.status` its projection.
+
+The receiver already appends each event and updates the payment in one
+transaction, so `Payment.status` is an incrementally maintained projection of
+the log. This module derives it from the log instead, to rebuild or audit it:
+
+* the log of a payment is its `processed` and `deferred` events in id order
+  (`stale` events were never applied; rejected events are never stored), and
+  folding it with `fold()` from `Payment.initial_status`, the status the
+  payment was created or preloaded with, gives exactly the receiver's status,
+  deferred replay included;
+* a `PaymentSnapshot` records a payment's folded status up to `last_event_id`
+  plus the events that were still waiting, so later folds start from the
+  snapshot and read only the tail of the log;
+* work is paged by payment id, `PAGE_SIZE` payments per round trip, with one
+  range query over the (payment_id, processing_status) index for the page's
+  tail events and executemany writes, so memory stays bounded and a million
+  events take seconds.
+
+The `Snapshotter` takes snapshots in the background for payments changed
+since their last one; `python -m app.projection rebuild|snapshot|verify` runs
+the same work from the command line. Snapshots rely on event ids becoming
+visible in order (SQLite's single writer guarantees it). Archived events are
+not read: a payment whose `archived_through` mark is past its snapshot (or
+that has no snapshot) cannot be folded and is skipped, never rewritten. Keep
+the snapshot interval far below the retention horizon so that does not happen.
+
+Existing databases: `ensure_initial_status_column(engine)` adds
+`payments.initial_status`; payments without events get their current status
+as baseline, the others stay NULL and are skipped until a snapshot covers them.
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Iterator, NamedTuple
+
+from sqlalchemy import bindparam, exists, inspect, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models import ArchivedThrough, Payment, PaymentSnapshot, WebhookEvent
+from app.state_machine import TransitionResult, fold
+
+logger = logging.getLogger(__name__)
+
+# Events that are part of a payment's log
+LOG_STATUSES = ("processed", "deferred")
+PAGE_SIZE = 2000
+# Keep IN lists well under SQLite's bound-parameter limit.
+_CHUNK_SIZE = 500
+
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+_payments = Payment.__table__
+_snapshots = PaymentSnapshot.__table__
+_SET_STATUS = (
+    update(_payments)
+    .where(_payments.c.id == bindparam("payment_id"))
+    .values(
+        status=bindparam("new_status"),
+        version=_payments.c.version + 1,
+        updated_at=bindparam("now"),
+    )
+)
+
+
+@dataclass(frozen=True)
+class SnapshotConfig:
+    interval: float = 300.0  # seconds between background runs
+    page_size: int = PAGE_SIZE
+
+
+class Projection(NamedTuple):
+    payment_id: str
+    stored: str  # Payment.status as stored
+    status: str  # status according to the log
+    last_event_id: int
+    waiting: tuple[int, ...]  # deferred events still waiting after last_event_id
+    events: int  # log events folded for this projection
+
+
+def _waiting_ids(waiting: str | None) -> set[int]:
+    return {int(i) for i in waiting.split(",")} if waiting else set()
+
+
+def _pages(db: Session, page_size: int, changed_only: bool) -> Iterator[tuple[str | None, list]]:
+    """(previous page's last id, page) with rows of (payment_id, status,
+    initial status, snapshot status, last_event_id, waiting, archived
+    through), in id order.
+
+    With `changed_only`, only payments updated since their snapshot (or never
+    snapshotted).
+    """
+    query = (
+        select(
+            Payment.id, Payment.status, Payment.initial_status, PaymentSnapshot.status,
+            PaymentSnapshot.last_event_id, PaymentSnapshot.waiting,
+            ArchivedThrough.last_event_id,
+        )
+        .outerjoin(PaymentSnapshot, PaymentSnapshot.payment_id == Payment.id)
+        .outerjoin(ArchivedThrough, ArchivedThrough.payment_id == Payment.id)
+        .order_by(Payment.id)
+        .limit(page_size)
+    )
+    if changed_only:
+        query = query.where(or_(
+            PaymentSnapshot.payment_id.is_(None),
+            Payment.updated_at > PaymentSnapshot.taken_at,
+        ))
+    after = None
+    while True:
+        page = db.connection().execute(
+            query if after is None else query.where(Payment.id > after)
+        ).all()
+        if not page:
+            return
+        yield after, page
+        after = page[-1][0]
+
+
+def _tail_events(db: Session, payment_filter) -> Iterator[tuple[str, int, str]]:
+    """(payment_id, event id, event type) of log events that may be past a snapshot."""
+    return db.connection().execute(
+        select(WebhookEvent.payment_id, WebhookEvent.id, WebhookEvent.event_type)
+        .outerjoin(PaymentSnapshot, PaymentSnapshot.payment_id == WebhookEvent.payment_id)
+        .where(
+            payment_filter,
+            WebhookEvent.processing_status.in_(LOG_STATUSES),
+            # Superset of the tail; events waiting at the snapshot are picked below
+            or_(
+                PaymentSnapshot.payment_id.is_(None),
+                WebhookEvent.id > PaymentSnapshot.last_event_id,
+                WebhookEvent.id >= PaymentSnapshot.first_waiting_id,
+            ),
+        )
+        .order_by(WebhookEvent.payment_id, WebhookEvent.id)
+    )
+
+
+def _foldable(base: str | None, last_event_id: int, waiting: set[int], archived: int | None) -> bool:
+    """Whether the events after the snapshot (or all of them) are still in the table."""
+    if base is None:
+        return False
+    if archived is None:
+        return True
+    return archived <= last_event_id and all(archived < event_id for event_id in waiting)
+
+
+def _project_page(
+    db: Session, page: list, after: str | None, contiguous: bool,
+) -> tuple[list[Projection], list[str]]:
+    """Fold each payment's log tail (since its snapshot) for one page of payments.
+
+    Returns the projections and the ids of payments skipped because part of
+    their log is archived or they have no baseline. A contiguous page (every
+    payment in the id range after its predecessor page) reads its events with
+    one range scan; a sparse one with IN lists.
+    """
+    if contiguous:
+        in_range = WebhookEvent.payment_id <= page[-1][0]
+        if after is not None:
+            in_range = in_range & (WebhookEvent.payment_id > after)
+        filters = [in_range]
+    else:
+        ids = [row[0] for row in page]
+        filters = [
+            WebhookEvent.payment_id.in_(ids[start:start + _CHUNK_SIZE])
+            for start in range(0, len(ids), _CHUNK_SIZE)
+        ]
+    tails: dict[str, list[tuple[int, str]]] = defaultdict(list)
+    for payment_filter in filters:
+        for payment_id, event_id, event_type in _tail_events(db, payment_filter):
+            tails[payment_id].append((event_id, event_type))
+
+    projections, skipped = [], []
+    for payment_id, stored, initial, snapshot, last_event_id, waiting, archived in page:
+        base = snapshot or initial
+        last_event_id = last_event_id or 0
+        was_waiting = _waiting_ids(waiting)
+        if not _foldable(base, last_event_id, was_waiting, archived):
+            skipped.append(payment_id)
+            continue
+        tail = [
+            (event_id, event_type) for event_id, event_type in tails.get(payment_id, ())
+            if event_id > last_event_id or event_id in was_waiting
+        ]
+        folded = fold(base, [event_type for _, event_type in tail])
+        projections.append(Projection(
+            payment_id, stored, folded.status,
+            max(last_event_id, tail[-1][0]) if tail else last_event_id,
+            tuple(
+                event_id for (event_id, _), result in zip(tail, folded.results)
+                if result is TransitionResult.DEFERRED
+            ),
+            len(tail),
+        ))
+    return projections, skipped
+
+
+def project(
+    db: Session, page_size: int = PAGE_SIZE, changed_only: bool = False,
+) -> Iterator[tuple[list[Projection], list[str]]]:
+    """Projections of every payment (or those changed since their snapshot), page
+    by page, each with the ids of the page's payments that cannot be folded."""
+    for after, page in _pages(db, page_size, changed_only):
+        yield _project_page(db, page, after, contiguous=not changed_only)
+
+
+_SNAPSHOT_COLUMNS = ("status", "last_event_id", "waiting", "first_waiting_id", "taken_at")
+
+
+def _write_snapshots(db: Session, projections: list[Projection], now: datetime) -> None:
+    """Upsert a snapshot per projection.
+
+    Dialects without INSERT ... ON CONFLICT look up the existing snapshots and
+    write updates and inserts separately.
+    """
+    if not projections:
+        return
+    rows = [
+        {
+            "payment_id": p.payment_id,
+            "status": p.status,
+            "last_event_id": p.last_event_id,
+            "waiting": ",".join(map(str, p.waiting)),
+            "first_waiting_id": p.waiting[0] if p.waiting else None,
+            "taken_at": now,
+        }
+        for p in projections
+    ]
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        _write_snapshots_each(db, rows)
+        return
+    stmt = insert(_snapshots)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["payment_id"],
+        set_={column: stmt.excluded[column] for column in _SNAPSHOT_COLUMNS},
+    )
+    db.connection().execute(stmt, rows)
+
+
+def _write_snapshots_each(db: Session, rows: list[dict]) -> None:
+    ids = [row["payment_id"] for row in rows]
+    existing: set[str] = set()
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        existing.update(db.scalars(
+            select(_snapshots.c.payment_id)
+            .where(_snapshots.c.payment_id.in_(ids[start:start + _CHUNK_SIZE]))
+        ))
+    updates = [
+        {"key": row["payment_id"], **{column: row[column] for column in _SNAPSHOT_COLUMNS}}
+        for row in rows if row["payment_id"] in existing
+    ]
+    if updates:
+        db.connection().execute(
+            update(_snapshots).where(_snapshots.c.payment_id == bindparam("key")), updates,
+        )
+    inserts = [row for row in rows if row["payment_id"] not in existing]
+    if inserts:
+        db.connection().execute(_snapshots.insert(), inserts)
+
+
+def rebuild(db: Session, page_size: int = PAGE_SIZE, snapshot: bool = True) -> dict:
+    """Recompute every payment's status from its log and write the ones that differ.
+
+    Each page is written and committed on its own. With `snapshot`, a snapshot
+    of every payment is written too, so the next fold starts from here.
+    Payments that cannot be folded are left alone and counted as skipped.
+    Returns counts and the rate in events per second.
+    """
+    started = time.perf_counter()
+    payments = events = changed = skipped = 0
+    for projections, unfoldable in project(db, page_size):
+        now = datetime.now(timezone.utc)
+        updates = [
+            {"payment_id": p.payment_id, "new_status": p.status, "now": now}
+            for p in projections if p.status != p.stored
+        ]
+        if updates:
+            db.connection().execute(_SET_STATUS, updates)
+        if snapshot:
+            _write_snapshots(db, projections, now)
+        db.commit()
+        payments += len(projections)
+        events += sum(p.events for p in projections)
+        changed += len(updates)
+        skipped += len(unfoldable)
+    if skipped:
+        logger.warning("Skipped %d payments whose log is archived past their snapshot", skipped)
+    seconds = time.perf_counter() - started
+    return {
+        "payments": payments,
+        "events": events,
+        "changed": changed,
+        "skipped": skipped,
+        "seconds": round(seconds, 4),
+        "events_per_sec": round(events / seconds, 1) if seconds else 0.0,
+    }
+
+
+def take_snapshots(db: Session, page_size: int = PAGE_SIZE) -> int:
+    """Snapshot every payment changed since its last snapshot; returns how many."""
+    written = 0
+    for projections, _ in project(db, page_size, changed_only=True):
+        _write_snapshots(db, projections, datetime.now(timezone.utc))
+        db.commit()
+        written += len(projections)
+    return written
+
+
+def verify(db: Session, page_size: int = PAGE_SIZE) -> list[Projection]:
+    """Payments whose stored status differs from their log (nothing is written).
+
+    Payments that cannot be folded are not checked.
+    """
+    drift, skipped = [], 0
+    for projections, unfoldable in project(db, page_size):
+        drift.extend(p for p in projections if p.status != p.stored)
+        skipped += len(unfoldable)
+    if skipped:
+        logger.warning("Not verified: %d payments whose log is archived past their snapshot", skipped)
+    return drift
+
+
+def ensure_initial_status_column(engine: Engine) -> bool:
+    """Add `payments.initial_status` to a database created before it existed.
+
+    Payments with no events, live or archived, get their current status as
+    baseline; the others cannot be told apart from a payment created in a
+    later status, so they stay NULL.
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns("payments")}
+    if "initial_status" in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE payments ADD COLUMN initial_status VARCHAR(50)"))
+        conn.execute(
+            update(_payments)
+            .where(
+                ~exists().where(WebhookEvent.payment_id == _payments.c.id),
+                ~exists().where(ArchivedThrough.payment_id == _payments.c.id),
+            )
+            # Keep updated_at, so the Snapshotter does not see every payment as changed
+            .values(initial_status=_payments.c.status, updated_at=_payments.c.updated_at)
+        )
+    return True
+
+
+class Snapshotter:
+    """Takes snapshots of changed payments in the background.
+
+    Args:
+        config: Interval and page size.
+        session_scope: Zero-arg callable returning a session context manager.
+        run_db: Callable(fn, *args) that runs blocking DB work in the app's DB
+            lane; defaults to calling `fn` directly.
+    """
+
+    def __init__(
+        self, config: SnapshotConfig, session_scope: Callable, run_db: Callable | None = None,
+    ) -> None:
+        self.config = config
+        self._session_scope = session_scope
+        self._run_db = run_db or (lambda fn, *args: fn(*args))
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.snapshots = 0
+        self.last_run_seconds = 0.0
+
+    def _snapshot(self) -> int:
+        with self._session_scope() as db:
+            try:
+                return take_snapshots(db, self.config.page_size)
+            except Exception:
+                db.rollback()
+                raise
+
+    def run_once(self) -> int:
+        """Snapshot every payment changed since its last snapshot; returns how many."""
+        started = time.perf_counter()
+        written = self._run_db(self._snapshot)
+        with self._lock:
+            self.runs += 1
+            self.snapshots += written
+            self.last_run_seconds = time.perf_counter() - started
+        return written
+
+    # ── Background thread ────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="snapshotter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.config.interval):
+            try:
+                self.run_once()
+            except Exception:  # noqa: BLE001
+                logger.exception("Snapshot run failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "snapshots": self.snapshots,
+                "last_run_seconds": round(self.last_run_seconds, 4),
+            }
+
+
+def main(argv: list[str] | None = None) -> int:
+    from app.database import SessionLocal, engine, init_db
+
+    parser = argparse.ArgumentParser(description="Rebuild or audit payment statuses from the event log.")
+    parser.add_argument("command", choices=("rebuild", "snapshot", "verify"))
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--no-snapshot", action="store_true", help="rebuild without writing snapshots")
+    args = parser.parse_args(argv)
+
+    init_db()  # creates payment_snapshots on databases that predate it
+    ensure_initial_status_column(engine)
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            print(rebuild(db, args.page_size, snapshot=not args.no_snapshot))
+        elif args.command == "snapshot":
+            print(f"snapshotted {take_snapshots(db, args.page_size)} payments")
+        else:
+            drift = verify(db, args.page_size)
+            for p in drift:
+                print(f"{p.payment_id}: stored {p.stored!r}, log says {p.status!r}")
+            print(f"{len(drift)} payments differ from their log")
+            return 1 if drift else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,147 @@
+"""Replay protection: remember every verified signature for as long as it is valid.
+
+A signature binds its timestamp, and a timestamp is only accepted for
+MAX_AGE_SECONDS, so a signature needs to be remembered only until its timestamp
+ages out. Signatures are grouped into buckets of `bucket_seconds` by their
+timestamp, and whole buckets are dropped once every timestamp in them is past
+the window -- memory stays O(requests signed in the last window).
+
+A signature is recorded when its request arrives, so two concurrent copies
+cannot both get through; `discard` forgets it again when that request failed
+with a retryable error, so the sender's identical retry is not a replay.
+
+Two backends share the `check_and_add`/`discard` interface: `MemoryReplayStore` for one
+process, and `DatabaseReplayStore`, a `seen_signatures` table that several
+workers on the same database can share.
+"""
+import threading
+import time
+from typing import Callable
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from app.models import SeenSignature
+from app.signature import MAX_AGE_SECONDS
+
+REPLAY_MODES = ("off", "memory", "database")
+DEFAULT_BUCKET_SECONDS = 10
+
+
+class MemoryReplayStore:
+    """In-process store: a dict of bucket -> set of signatures."""
+
+    uses_db = False
+
+    def __init__(
+        self, window: int = MAX_AGE_SECONDS, bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+    ) -> None:
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self._buckets: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.expired_buckets = 0
+
+    def _oldest_live_bucket(self, now: float) -> int:
+        return int(now - self.window) // self.bucket_seconds
+
+    def check_and_add(self, signature: str, timestamp: int, now: float | None = None) -> bool:
+        """Record a verified signature; False if it was already seen (a replay)."""
+        now = now if now is not None else time.time()
+        bucket = timestamp // self.bucket_seconds
+        with self._lock:
+            oldest = self._oldest_live_bucket(now)
+            for stale in [b for b in self._buckets if b < oldest]:
+                del self._buckets[stale]
+                self.expired_buckets += 1
+            seen = self._buckets.setdefault(bucket, set())
+            if signature in seen:
+                self.replays += 1
+                return False
+            seen.add(signature)
+            return True
+
+    def discard(self, signature: str, timestamp: int) -> None:
+        """Forget a recorded signature, so that it is accepted once more."""
+        with self._lock:
+            self._buckets.get(timestamp // self.bucket_seconds, set()).discard(signature)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": sum(len(s) for s in self._buckets.values()),
+                "buckets": len(self._buckets),
+                "replays": self.replays,
+                "expired_buckets": self.expired_buckets,
+            }
+
+
+class DatabaseReplayStore:
+    """Shared store: one `seen_signatures` row per signature, expired by bucket.
+
+    The primary key on the signature makes check-and-add a single INSERT; a
+    conflict is a replay, whichever worker recorded the signature first.
+    """
+
+    uses_db = True
+
+    def __init__(
+        self,
+        session_scope: Callable,
+        window: int = MAX_AGE_SECONDS,
+        bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+    ) -> None:
+        self._session_scope = session_scope
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self._purged_below: int | None = None
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replays = 0
+        self.expired_rows = 0
+
+    def check_and_add(self, signature: str, timestamp: int, now: float | None = None) -> bool:
+        now = now if now is not None else time.time()
+        oldest = int(now - self.window) // self.bucket_seconds
+        purge = self._purged_below != oldest  # at most once per bucket boundary
+        with self._session_scope() as db:
+            expired = 0
+            if purge:
+                expired = db.execute(
+                    delete(SeenSignature).where(SeenSignature.bucket < oldest)
+                ).rowcount
+            db.add(SeenSignature(
+                signature=signature, bucket=timestamp // self.bucket_seconds,
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # also undoes the purge; the next call retries it
+                with self._lock:
+                    self.replays += 1
+                return False
+        if purge:
+            self._purged_below = oldest
+        with self._lock:
+            self.recorded += 1
+            self.expired_rows += expired
+        return True
+
+    def discard(self, signature: str, timestamp: int) -> None:
+        """Forget a recorded signature, so that it is accepted once more."""
+        with self._session_scope() as db:
+            db.execute(delete(SeenSignature).where(SeenSignature.signature == signature))
+            db.commit()
+
+    def stats(self) -> dict:
+        """This worker's counters (no DB query, so it is safe on the event loop)."""
+        with self._lock:
+            return {
+                "backend": "database",
+                "recorded": self.recorded,
+                "replays": self.replays,
+                "expired_rows": self.expired_rows,
+            }
+
@@ -0,0 +1,285 @@
+"""Deferred-event scheduler: an in-memory backlog index, reconciliation and a TTL sweep.
+
+A deferred event is only retried when another event for its payment succeeds,
+so one whose prerequisite never arrives would wait forever. The scheduler keeps
+every deferred event in a `DeferredIndex` (loaded once at startup through the
+partial index on deferred rows, then kept current by the webhook and batch
+paths), so backlog counts and ages are read from memory instead of
+`webhook_events`.
+
+Each run of the background `DeferredScheduler`:
+
+1. asks the reconciliation hook, for payments whose oldest deferred event has
+   waited `reconcile_after`, for the events the payment is missing (a real hook
+   calls the provider's API; `StubReconciler` serves canned events locally) and
+   feeds them through `process_events`, which replays whatever they unblock;
+2. marks events that have waited longer than `ttl` as `stale`. Stale events
+   are never replayed, and a redelivery of one is answered as a duplicate.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Mapping, NamedTuple, Sequence
+
+from sqlalchemy import select, update
+
+from app.batch import CHUNK_SIZE, BatchEvent, process_events
+from app.models import WebhookEvent
+from app.state_machine import waiting_for
+
+logger = logging.getLogger(__name__)
+
+# (payment_id, state its oldest deferred event waits for) -> events to ingest
+ReconcileHook = Callable[[str, str], Sequence[BatchEvent]]
+
+
+@dataclass(frozen=True)
+class DeferredConfig:
+    ttl: timedelta = timedelta(hours=24)
+    reconcile_after: timedelta = timedelta(minutes=5)
+    reconcile: ReconcileHook | None = None
+    interval: float = 30.0  # seconds between background runs
+
+
+class DeferredEntry(NamedTuple):
+    row_id: int
+    payment_id: str
+    event_type: str
+    waiting_for: str
+    received_at: datetime
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+class DeferredIndex:
+    """Thread-safe index of deferred events by row id and by payment.
+
+    Entries are also kept sorted by `received_at` (events from concurrent
+    requests can commit out of that order), so the events older than a cutoff
+    are a prefix found by bisection.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: dict[int, DeferredEntry] = {}
+        self._by_payment: dict[str, set[int]] = defaultdict(set)
+        self._waiting: Counter[str] = Counter()
+        self._by_age: list[tuple[datetime, int]] = []  # (received_at, row_id), sorted
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, row_id: int) -> bool:
+        return row_id in self._entries
+
+    def add(self, row_id: int, payment_id: str, event_type: str, received_at: datetime) -> None:
+        entry = DeferredEntry(
+            row_id, payment_id, event_type, waiting_for(event_type) or "unknown",
+            _aware(received_at),
+        )
+        with self._lock:
+            if row_id in self._entries:
+                return
+            self._entries[row_id] = entry
+            bisect.insort(self._by_age, (entry.received_at, row_id))
+            self._by_payment[payment_id].add(row_id)
+            self._waiting[entry.waiting_for] += 1
+
+    def remove(self, row_ids: Iterable[int]) -> None:
+        with self._lock:
+            for row_id in row_ids:
+                entry = self._entries.pop(row_id, None)
+                if entry is None:
+                    continue
+                del self._by_age[bisect.bisect_left(self._by_age, (entry.received_at, row_id))]
+                rows = self._by_payment[entry.payment_id]
+                rows.discard(row_id)
+                if not rows:
+                    del self._by_payment[entry.payment_id]
+                self._waiting[entry.waiting_for] -= 1
+                if not self._waiting[entry.waiting_for]:
+                    del self._waiting[entry.waiting_for]
+
+    def for_payment(self, payment_id: str) -> list[DeferredEntry]:
+        with self._lock:
+            return [self._entries[row_id] for row_id in sorted(self._by_payment.get(payment_id, ()))]
+
+    def older_than(self, cutoff: datetime) -> list[DeferredEntry]:
+        """Entries received before `cutoff`, oldest first."""
+        with self._lock:
+            end = bisect.bisect_left(self._by_age, (_aware(cutoff),))
+            return [self._entries[row_id] for _, row_id in self._by_age[:end]]
+
+    def stats(self, now: datetime | None = None) -> dict:
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            oldest = self._entries[self._by_age[0][1]] if self._by_age else None
+            return {
+                "events": len(self._entries),
+                "payments": len(self._by_payment),
+                "oldest_age_seconds": (
+                    round(max((now - oldest.received_at).total_seconds(), 0.0), 3)
+                    if oldest is not None else 0.0
+                ),
+                "waiting_for": dict(self._waiting),
+            }
+
+
+class StubReconciler:
+    """Local stand-in for the provider's API: serves canned events once per payment."""
+
+    def __init__(self, events: Mapping[str, Sequence[BatchEvent]] | None = None) -> None:
+        self.events = {pid: list(batch) for pid, batch in (events or {}).items()}
+        self.calls: list[tuple[str, str]] = []
+
+    def __call__(self, payment_id: str, waiting_for: str) -> list[BatchEvent]:
+        self.calls.append((payment_id, waiting_for))
+        return self.events.pop(payment_id, [])
+
+
+class DeferredScheduler:
+    """Background reconciliation and TTL sweep over a `DeferredIndex`."""
+
+    def __init__(
+        self,
+        config: DeferredConfig,
+        session_scope: Callable,
+        run_db: Callable | None = None,
+        payload_storage: str = "text",
+    ) -> None:
+        self.config = config
+        self.index = DeferredIndex()
+        self._session_scope = session_scope
+        self._run_db = run_db or (lambda fn, *args: fn(*args))
+        self._payload_storage = payload_storage
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._reconciled_rows: set[int] = set()
+        self.runs = 0
+        self.stale = 0
+        self.reconcile_calls = 0
+        self.reconciled_events = 0
+        self.reconcile_errors = 0
+        self.last_run_seconds = 0.0
+
+    def load(self) -> int:
+        """Fill the index from the database's deferred rows; returns how many."""
+        with self._session_scope() as db:
+            rows = db.execute(
+                select(
+                    WebhookEvent.id, WebhookEvent.payment_id,
+                    WebhookEvent.event_type, WebhookEvent.received_at,
+                )
+                .where(WebhookEvent.processing_status == "deferred")
+                .order_by(WebhookEvent.received_at, WebhookEvent.id)
+            ).all()
+        for row in rows:
+            self.index.add(*row)
+        return len(rows)
+
+    def _ingest(self, events: Sequence[BatchEvent]) -> list[dict]:
+        with self._session_scope() as db:
+            try:
+                return process_events(
+                    db, events, payload_storage=self._payload_storage, deferred_index=self.index,
+                )
+            except Exception:
+                db.rollback()
+                raise
+
+    def _reconcile(self, now: datetime) -> int:
+        """Ask the hook for each due payment's missing events and ingest them."""
+        due: dict[str, list[DeferredEntry]] = defaultdict(list)
+        for entry in self.index.older_than(now - self.config.reconcile_after):
+            if entry.row_id not in self._reconciled_rows:
+                due[entry.payment_id].append(entry)
+        ingested = 0
+        for payment_id, entries in due.items():
+            self._reconciled_rows.update(entry.row_id for entry in entries)
+            with self._lock:
+                self.reconcile_calls += 1
+            try:
+                events = list(self.config.reconcile(payment_id, entries[0].waiting_for))
+                if events:
+                    results = self._run_db(self._ingest, events)
+                    ingested += sum(not r.get("idempotent") and r["status_code"] < 300 for r in results)
+            except Exception:  # noqa: BLE001
+                logger.exception("Reconciliation of payment %s failed", payment_id)
+                with self._lock:
+                    self.reconcile_errors += 1
+        with self._lock:
+            self.reconciled_events += ingested
+        return ingested
+
+    def _mark_stale(self, row_ids: list[int]) -> int:
+        with self._session_scope() as db:
+            # Rows applied since they were indexed keep their status
+            marked = db.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id.in_(row_ids), WebhookEvent.processing_status == "deferred")
+                .values(processing_status="stale")
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+        return marked
+
+    def run_once(self, now: datetime | None = None) -> dict:
+        """Reconcile due payments, then sweep expired events to `stale`."""
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        reconciled = self._reconcile(now) if self.config.reconcile is not None else 0
+        stale = 0
+        expired = [entry.row_id for entry in self.index.older_than(now - self.config.ttl)]
+        for start in range(0, len(expired), CHUNK_SIZE):
+            chunk = expired[start:start + CHUNK_SIZE]
+            stale += self._run_db(self._mark_stale, chunk)
+            self.index.remove(chunk)
+        # Forget rows that have left the index (replayed, stale)
+        self._reconciled_rows = {row_id for row_id in self._reconciled_rows if row_id in self.index}
+        if stale:
+            logger.warning("Marked %d deferred events stale after %s", stale, self.config.ttl)
+        with self._lock:
+            self.runs += 1
+            self.stale += stale
+            self.last_run_seconds = time.perf_counter() - started
+        return {"reconciled": reconciled, "stale": stale}
+
+    # ── Background thread ────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="deferred-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.config.interval):
+            try:
+                self.run_once()
+            except Exception:  # noqa: BLE001
+                logger.exception("Deferred scheduler run failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.index.stats(),
+                "runs": self.runs,
+                "stale": self.stale,
+                "reconcile_calls": self.reconcile_calls,
+                "reconciled_events": self.reconciled_events,
+                "reconcile_errors": self.reconcile_errors,
+                "last_run_seconds": round(self.last_run_seconds, 4),
+            }
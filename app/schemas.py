@@ -1,10 +1,12 @@
 from pydantic import BaseModel, Field, StrictStr, field_validator
 
+MAX_AMOUNT = 999999999  # centavos
+
 
 class PaymentData(BaseModel):
     payment_id: StrictStr
     merchant_id: StrictStr
-    amount: int = Field(..., ge=0, le=999999999)
+    amount: int = Field(..., ge=0, le=MAX_AMOUNT)
     currency: StrictStr
 
     @field_validator("amount")
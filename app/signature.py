@@ -1,17 +1,99 @@
 import hashlib
 import hmac
+import threading
 import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple
 
 SIGNATURE_HEADER = "X-Yuno-Signature"
 TIMESTAMP_HEADER = "X-Yuno-Timestamp"
+# Optional hint naming the key that signed the request (during secret rotation)
+KEY_ID_HEADER = "X-Yuno-Key-Id"
 MAX_AGE_SECONDS = 300
 MAX_FUTURE_SKEW_SECONDS = 30
 
 
 def compute_signature(secret: str, timestamp: int, body: bytes) -> str:
     """Compute HMAC-SHA256 signature for the given timestamp and body."""
-    message = f"{timestamp}.".encode() + body
-    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+    mac = hmac.new(secret.encode(), f"{timestamp}.".encode(), hashlib.sha256)
+    mac.update(body)  # no timestamp + body concatenation copy
+    return mac.hexdigest()
+
+
+def _check_headers(
+    signature: str,
+    timestamp_str: str,
+    max_age: int = MAX_AGE_SECONDS,
+    now: float | None = None,
+) -> int:
+    """Validate the signature/timestamp headers on their own; returns the timestamp.
+
+    Raises:
+        ValueError: If signature or timestamp is missing/invalid/expired.
+    """
+    if not signature:
+        raise ValueError("Missing or empty signature header.")
+
+    try:
+        timestamp = int(timestamp_str)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid timestamp: {timestamp_str!r}")
+
+    current_time = now if now is not None else time.time()
+    age = current_time - timestamp
+
+    if age > max_age:
+        raise ValueError(f"Signature expired: {age:.1f}s old (max {max_age}s).")
+
+    if age < -MAX_FUTURE_SKEW_SECONDS:
+        raise ValueError(f"Timestamp too far in the future: {-age:.1f}s.")
+
+    return timestamp
+
+
+class SignatureVerifier:
+    """HMAC-SHA256 verification for one secret, keyed once.
+
+    The keyed HMAC state is built in __init__; every request works on a
+    `.copy()` of it, so the secret is never re-encoded or re-keyed per request.
+    Streaming callers use check_headers() -> begin() -> mac.update(chunk)... ->
+    finish(); verify() does the same for a body already in memory.
+    """
+
+    def __init__(self, secret: str, max_age: int = MAX_AGE_SECONDS) -> None:
+        self._keyed = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        self.max_age = max_age
+
+    def check_headers(self, signature: str, timestamp_str: str, now: float | None = None) -> int:
+        """Reject missing, malformed or stale headers before any body is read."""
+        return _check_headers(signature, timestamp_str, self.max_age, now)
+
+    def begin(self, timestamp: int) -> "hmac.HMAC":
+        """A fresh MAC already fed the `"{timestamp}."` prefix; update it with the body."""
+        mac = self._keyed.copy()
+        mac.update(f"{timestamp}.".encode())
+        return mac
+
+    @staticmethod
+    def finish(mac: "hmac.HMAC", signature: str) -> bool:
+        """Compare the finished MAC with the header in constant time."""
+        if not hmac.compare_digest(mac.hexdigest(), signature):
+            raise ValueError("Signature mismatch.")
+        return True
+
+    def sign(self, timestamp: int, body: bytes) -> str:
+        mac = self.begin(timestamp)
+        mac.update(body)
+        return mac.hexdigest()
+
+    def verify(
+        self, signature: str, timestamp_str: str, body: bytes, now: float | None = None,
+    ) -> bool:
+        timestamp = self.check_headers(signature, timestamp_str, now)
+        mac = self.begin(timestamp)
+        mac.update(body)
+        return self.finish(mac, signature)
 
 
 def verify_signature(
@@ -39,25 +121,158 @@ def verify_signature(
     Raises:
         ValueError: If signature or timestamp is missing/invalid/expired.
     """
-    if not signature:
-        raise ValueError("Missing or empty signature header.")
+    timestamp = _check_headers(signature, timestamp_str, max_age, now)
+    expected = compute_signature(secret, timestamp, body)
+    if not hmac.compare_digest(expected, signature):
+        raise ValueError("Signature mismatch.")
 
-    try:
-        timestamp = int(timestamp_str)
-    except (ValueError, TypeError):
-        raise ValueError(f"Invalid timestamp: {timestamp_str!r}")
+    return True
 
-    current_time = now if now is not None else time.time()
-    age = current_time - timestamp
 
-    if age > max_age:
-        raise ValueError(f"Signature expired: {age:.1f}s old (max {max_age}s).")
+@dataclass(frozen=True)
+class SigningKey:
+    """One webhook secret and the unix-time window in which it is accepted."""
 
-    if age < -MAX_FUTURE_SKEW_SECONDS:
-        raise ValueError(f"Timestamp too far in the future: {-age:.1f}s.")
+    key_id: str
+    secret: str
+    not_before: float | None = None
+    not_after: float | None = None
 
-    expected = compute_signature(secret, timestamp, body)
-    if not hmac.compare_digest(expected, signature):
+    def active(self, now: float) -> bool:
+        return (self.not_before is None or now >= self.not_before) and (
+            self.not_after is None or now < self.not_after
+        )
+
+
+class KeyringAttempt(NamedTuple):
+    """A streaming verification in progress: feed body chunks to `mac`."""
+
+    key_id: str
+    timestamp: int
+    mac: "hmac.HMAC"
+
+
+class Keyring:
+    """Several signing keys, verified most-recently-successful first.
+
+    Each key keeps its own pre-keyed SignatureVerifier. A request streams its
+    body into one MAC only: the key named by the key-id header if it is known
+    and active, otherwise the key that last verified a request. Only when that
+    MAC does not match are the other active keys tried over the buffered body,
+    so outside a rotation every request costs a single HMAC.
+    """
+
+    def __init__(self, keys: Iterable[SigningKey], max_age: int = MAX_AGE_SECONDS) -> None:
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._keys: dict[str, SigningKey] = {}
+        self._verifiers: dict[str, SignatureVerifier] = {}
+        self._order: list[str] = []  # most recently successful first
+        self._verified: Counter[str] = Counter()
+        self.fallback_hmacs = 0
+        self.failures = 0
+        for key in keys:
+            self.add(key)
+        if not self._keys:
+            raise ValueError("A keyring needs at least one signing key.")
+
+    def add(self, key: SigningKey) -> None:
+        """Add or replace a key; a new key is tried after the existing ones."""
+        with self._lock:
+            self._keys[key.key_id] = key
+            self._verifiers[key.key_id] = SignatureVerifier(key.secret, self.max_age)
+            if key.key_id not in self._order:
+                self._order.append(key.key_id)
+
+    def remove(self, key_id: str) -> None:
+        with self._lock:
+            self._keys.pop(key_id, None)
+            self._verifiers.pop(key_id, None)
+            if key_id in self._order:
+                self._order.remove(key_id)
+
+    def check_headers(self, signature: str, timestamp_str: str, now: float | None = None) -> int:
+        return _check_headers(signature, timestamp_str, self.max_age, now)
+
+    def _candidates(self, key_hint: str | None, now: float) -> list[str]:
+        with self._lock:
+            order = [k for k in self._order if self._keys[k].active(now)]
+        if key_hint in order:
+            order.remove(key_hint)
+            order.insert(0, key_hint)
+        return order
+
+    def begin(
+        self, timestamp: int, key_hint: str | None = None, now: float | None = None,
+    ) -> KeyringAttempt:
+        """Start streaming verification with the most likely key."""
+        now = now if now is not None else time.time()
+        candidates = self._candidates(key_hint, now)
+        if not candidates:
+            raise ValueError("No signing key is currently active.")
+        key_id = candidates[0]
+        return KeyringAttempt(key_id, timestamp, self._verifiers[key_id].begin(timestamp))
+
+    def finish(
+        self,
+        attempt: KeyringAttempt,
+        signature: str,
+        body: bytes,
+        key_hint: str | None = None,
+        now: float | None = None,
+    ) -> str:
+        """Return the id of the key that signed the body, or raise ValueError."""
+        if hmac.compare_digest(attempt.mac.hexdigest(), signature):
+            self._record(attempt.key_id)
+            return attempt.key_id
+        now = now if now is not None else time.time()
+        for key_id in self._candidates(key_hint, now):
+            if key_id == attempt.key_id:
+                continue
+            verifier = self._verifiers.get(key_id)
+            if verifier is None:
+                continue
+            with self._lock:
+                self.fallback_hmacs += 1
+            if hmac.compare_digest(verifier.sign(attempt.timestamp, body), signature):
+                self._record(key_id)
+                return key_id
+        with self._lock:
+            self.failures += 1
         raise ValueError("Signature mismatch.")
 
-    return True
+    def verify(
+        self,
+        signature: str,
+        timestamp_str: str,
+        body: bytes,
+        key_hint: str | None = None,
+        now: float | None = None,
+    ) -> str:
+        """Buffered counterpart of begin()/finish(); returns the matching key id."""
+        attempt = self.begin(self.check_headers(signature, timestamp_str, now), key_hint, now)
+        attempt.mac.update(body)
+        return self.finish(attempt, signature, body, key_hint, now)
+
+    def _record(self, key_id: str) -> None:
+        with self._lock:
+            self._verified[key_id] += 1
+            if self._order and self._order[0] != key_id and key_id in self._order:
+                self._order.remove(key_id)
+                self._order.insert(0, key_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": {
+                    key_id: {
+                        "verified": self._verified[key_id],
+                        "not_before": self._keys[key_id].not_before,
+                        "not_after": self._keys[key_id].not_after,
+                    }
+                    for key_id in self._order
+                },
+                "preferred": self._order[0] if self._order else None,
+                "fallback_hmacs": self.fallback_hmacs,
+                "failures": self.failures,
+            }
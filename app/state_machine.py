@@ -1,3 +1,7 @@
+from collections import deque
+from enum import IntEnum
+from typing import Iterable, NamedTuple
+
 TRANSITIONS: dict[str, dict[str, str]] = {
     "pending": {
         "payment.authorized": "authorized",
@@ -34,6 +38,155 @@ class OutOfOrderEventError(Exception):
     """Event type is valid globally but not for the current payment state."""
 
 
+class TransitionResult(IntEnum):
+    APPLIED = 0   # event moves the payment to a new state
+    DEFERRED = 1  # event is valid but its prerequisite has not been applied yet
+    INVALID = 2   # unknown event type, or payment is in a terminal state
+
+
+# ── Compiled transition table ────────────────────────────────────────────────
+# States and events are interned to small integers once at import time. The
+# table is a flat list indexed by state_code * _WIDTH + event_code; each cell
+# holds (result, next_state_code). Unknown states/events get their own codes.
+
+STATES: tuple[str, ...] = tuple(dict.fromkeys(
+    [*TRANSITIONS, *(s for t in TRANSITIONS.values() for s in t.values()),
+     *sorted(TERMINAL_STATES)]
+))
+EVENTS: tuple[str, ...] = tuple(dict.fromkeys(
+    event for transitions in TRANSITIONS.values() for event in transitions
+))
+STATE_CODES: dict[str, int] = {state: code for code, state in enumerate(STATES)}
+EVENT_CODES: dict[str, int] = {event: code for code, event in enumerate(EVENTS)}
+
+_UNKNOWN_STATE = len(STATES)
+_UNKNOWN_EVENT = len(EVENTS)
+_WIDTH = len(EVENTS) + 1
+
+
+def _compile() -> list[tuple[TransitionResult, int]]:
+    table = []
+    for state_code in range(len(STATES) + 1):
+        state = STATES[state_code] if state_code < len(STATES) else None
+        for event_code in range(_WIDTH):
+            event = EVENTS[event_code] if event_code < len(EVENTS) else None
+            target = TRANSITIONS.get(state, {}).get(event)
+            if event is None or state in TERMINAL_STATES:
+                table.append((TransitionResult.INVALID, state_code))
+            elif target is not None:
+                table.append((TransitionResult.APPLIED, STATE_CODES[target]))
+            else:
+                table.append((TransitionResult.DEFERRED, state_code))
+    return table
+
+
+_TABLE = _compile()
+
+# For each state code: event codes that apply from it, in TRANSITIONS order.
+_READY: tuple[tuple[int, ...], ...] = tuple(
+    tuple(
+        e for e in range(len(EVENTS))
+        if _TABLE[s * _WIDTH + e][0] is TransitionResult.APPLIED
+    )
+    for s in range(len(STATES) + 1)
+)
+
+
+def decide(current_status: str, event_type: str) -> tuple[TransitionResult, str]:
+    """
+    Classify an event against the current status without raising.
+
+    Returns (result, status); status is the new status when result is APPLIED,
+    otherwise current_status unchanged.
+    """
+    result, target = _TABLE[
+        STATE_CODES.get(current_status, _UNKNOWN_STATE) * _WIDTH
+        + EVENT_CODES.get(event_type, _UNKNOWN_EVENT)
+    ]
+    if result is TransitionResult.APPLIED:
+        return result, STATES[target]
+    return result, current_status
+
+
+def ready_events(current_status: str) -> tuple[str, ...]:
+    """Event types that can be applied directly from current_status."""
+    return tuple(EVENTS[e] for e in _READY[STATE_CODES.get(current_status, _UNKNOWN_STATE)])
+
+
+def _prerequisites() -> dict[str, str]:
+    """For each event: the first state (in TRANSITIONS order) that accepts it."""
+    first: dict[str, str] = {}
+    for state, transitions in TRANSITIONS.items():
+        for event in transitions:
+            first.setdefault(event, state)
+    return first
+
+
+_PREREQUISITES = _prerequisites()
+
+
+def waiting_for(event_type: str) -> str | None:
+    """The state a deferred `event_type` is waiting for (None for unknown events)."""
+    return _PREREQUISITES.get(event_type)
+
+
+def rejection_reason(current_status: str, event_type: str) -> str:
+    """Human-readable reason for an INVALID or DEFERRED decision."""
+    if event_type not in EVENT_CODES:
+        return f"Event type '{event_type}' is not a valid event in any state."
+    if current_status in TERMINAL_STATES:
+        return f"Payment in terminal state '{current_status}' cannot accept any events."
+    return f"Event '{event_type}' cannot be applied to payment in '{current_status}' status."
+
+
+class FoldResult(NamedTuple):
+    status: str
+    results: list[TransitionResult]
+
+
+def fold(current_status: str, event_types: Iterable[str]) -> FoldResult:
+    """
+    Apply a whole event sequence for one payment, with deferred replay semantics.
+
+    Mirrors the receiver: a DEFERRED event waits and is applied (oldest first) as
+    soon as the payment reaches a state that accepts it. Per-event results are
+    APPLIED, INVALID, or DEFERRED for events still waiting at the end.
+    """
+    state = STATE_CODES.get(current_status, _UNKNOWN_STATE)
+    results: list[TransitionResult] = []
+    waiting: dict[int, deque[int]] = {}
+    table, width, ready = _TABLE, _WIDTH, _READY
+    applied, deferred, invalid = (
+        TransitionResult.APPLIED, TransitionResult.DEFERRED, TransitionResult.INVALID,
+    )
+
+    for index, event_type in enumerate(event_types):
+        event = EVENT_CODES.get(event_type, _UNKNOWN_EVENT)
+        result, target = table[state * width + event]
+        if result is deferred:
+            waiting.setdefault(event, deque()).append(index)
+            results.append(deferred)
+            continue
+        if result is invalid:
+            results.append(invalid)
+            continue
+        results.append(applied)
+        state = target
+        while waiting:
+            candidates = [e for e in ready[state] if waiting.get(e)]
+            if not candidates:
+                break
+            event = min(candidates, key=lambda e: waiting[e][0])
+            queue = waiting[event]
+            results[queue.popleft()] = applied
+            if not queue:
+                del waiting[event]
+            state = table[state * width + event][1]
+
+    status = STATES[state] if state < len(STATES) else current_status
+    return FoldResult(status, results)
+
+
 def apply_transition(current_status: str, event_type: str) -> str:
     """
     Apply a state transition.
@@ -42,21 +195,12 @@ def apply_transition(current_status: str, event_type: str) -> str:
     Raises InvalidTransitionError if event_type is not valid in any state,
       or if the current state is terminal.
     Raises OutOfOrderEventError if event_type is valid globally but not for current_status.
-    """
-    if event_type not in ALL_VALID_EVENTS:
-        raise InvalidTransitionError(
-            f"Event type '{event_type}' is not a valid event in any state."
-        )
 
-    if current_status in TERMINAL_STATES:
-        raise InvalidTransitionError(
-            f"Payment in terminal state '{current_status}' cannot accept any events."
-        )
-
-    state_transitions = TRANSITIONS.get(current_status, {})
-    if event_type in state_transitions:
-        return state_transitions[event_type]
-
-    raise OutOfOrderEventError(
-        f"Event '{event_type}' cannot be applied to payment in '{current_status}' status."
-    )
+    Prefer `decide()` on hot paths; this wrapper keeps the exception-based API.
+    """
+    result, new_status = decide(current_status, event_type)
+    if result is TransitionResult.APPLIED:
+        return new_status
+    if result is TransitionResult.INVALID:
+        raise InvalidTransitionError(rejection_reason(current_status, event_type))
+    raise OutOfOrderEventError(rejection_reason(current_status, event_type))
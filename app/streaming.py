@@ -0,0 +1,50 @@
+"""Bounded request body reading.
+
+A body is never buffered past the limit: a declared Content-Length over the
+limit is refused before anything is read, and the running byte count stops
+the read as soon as the limit is crossed (for chunked or under-declared
+uploads). Each chunk can be handed to a callback -- the signature MAC -- as it
+arrives, so no second pass over the body is needed.
+"""
+from typing import Callable
+
+from starlette.requests import Request
+
+
+class BodyTooLarge(Exception):
+    """The request body is, or declares itself to be, larger than allowed."""
+
+
+def check_declared_length(request: Request, limit: int) -> int | None:
+    """Return the declared Content-Length, if any.
+
+    Raises:
+        BodyTooLarge: If the declared length exceeds `limit`.
+        ValueError: If the header is not a non-negative integer.
+    """
+    header = request.headers.get("content-length")
+    if header is None:
+        return None
+    if not header.isdigit():
+        raise ValueError(f"Invalid Content-Length: {header!r}")
+    declared = int(header)
+    if declared > limit:
+        raise BodyTooLarge(f"Declared body of {declared} bytes exceeds {limit}")
+    return declared
+
+
+async def read_bounded(
+    request: Request, limit: int, on_chunk: Callable[[bytes], object] | None = None,
+) -> bytes:
+    """Read the body chunk by chunk, raising BodyTooLarge once it passes `limit`."""
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(f"Body exceeds {limit} bytes")
+        if on_chunk is not None:
+            on_chunk(chunk)
+        chunks.append(chunk)
+    # join() of a single chunk returns that chunk without copying
+    return b"".join(chunks)
@@ -1,11 +1,10 @@
 import uuid
 
 import pytest
-from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from starlette.testclient import TestClient
 
-from app.database import get_db
+from app.database import EngineConfig, create_db_engine, get_db
 from app.main import create_app
 from app.models import Base, Payment
 
@@ -21,17 +20,9 @@ def context():
 @pytest.fixture(scope="function")
 def db_engine():
     """Create a fresh in-memory SQLite DB per test."""
-    engine = create_engine(
-        f"sqlite:///file:testdb_{uuid.uuid4().hex}?mode=memory&cache=shared&uri=true",
-        connect_args={"check_same_thread": False},
-    )
-
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_conn, connection_record):
-        cursor = dbapi_conn.cursor()
-        cursor.execute("PRAGMA busy_timeout=5000")
-        cursor.close()
-
+    engine = create_db_engine(EngineConfig(
+        url=f"sqlite:///file:testdb_{uuid.uuid4().hex}?mode=memory&cache=shared&uri=true",
+    ))
     Base.metadata.create_all(engine)
     yield engine
     Base.metadata.drop_all(engine)
@@ -39,9 +30,17 @@ def db_engine():
 
 
 @pytest.fixture(scope="function")
-def app(db_engine):
+def app_options():
+    """Extra create_app() keyword arguments; Given steps may fill this before the app is built."""
+    return {}
+
+
+@pytest.fixture(scope="function")
+def app(db_engine, app_options):
     """Create a FastAPI app with isolated DB per test."""
-    application = create_app(webhook_secret=WEBHOOK_SECRET)
+    application = create_app(
+        webhook_secret=WEBHOOK_SECRET, db_engine=db_engine, **app_options,
+    )
     SessionLocal = sessionmaker(bind=db_engine, autocommit=False, autoflush=False)
 
     def override_get_db():
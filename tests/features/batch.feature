@@ -0,0 +1,67 @@
+Feature: Batch Webhook Delivery
+  As the FulfillHub reconciliation service
+  I want to deliver many signed webhook events in one request
+  So that backfills and replays do not cost one round trip per event
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+    And a payment "pay_002" exists in "pending" status
+
+  Scenario: A batch reports a status for each event
+    Given a batch event "wh-b1" of type "payment.authorized" for payment "pay_001"
+    And a batch event "wh-b2" of type "payment.settled" for payment "pay_002"
+    And a batch event "wh-b3" of type "payment.authorized" for payment "pay_UNKNOWN"
+    And a batch event "wh-b4" of type "payment.exploded" for payment "pay_002"
+    And a batch event "wh-b1" of type "payment.authorized" for payment "pay_001"
+    When I send the batch
+    Then the response status should be 200
+    And the batch results should have status codes "200,202,404,422,200"
+    And the payment "pay_001" status should be "authorized"
+    And event "wh-b2" should be stored with processing_status "deferred"
+    And event "wh-b4" should not be stored
+
+  Scenario: A database without INSERT ... ON CONFLICT claims events one at a time
+    Given the database has no bulk idempotency claim
+    And a batch event "wh-p1" of type "payment.authorized" for payment "pay_001"
+    And a batch event "wh-p2" of type "payment.authorized" for payment "pay_002"
+    When I send the batch
+    Then the response status should be 200
+    And the batch results should have status codes "200,200"
+    And the payment "pay_001" status should be "authorized"
+    When I send the batch
+    Then every batch result should be marked idempotent
+
+  Scenario: A lifecycle delivered in reverse order within one batch is fully applied
+    Given a batch event "wh-r3" of type "payment.settled" for payment "pay_001"
+    And a batch event "wh-r2" of type "payment.captured" for payment "pay_001"
+    And a batch event "wh-r1" of type "payment.authorized" for payment "pay_001"
+    When I send the batch
+    Then the batch results should have status codes "200,200,200"
+    And the payment "pay_001" status should be "settled"
+
+  Scenario: A batch unblocks events deferred by the single-event endpoint
+    When I send a "payment.captured" webhook for payment "pay_001"
+    Then the response status should be 202
+    Given a batch event "wh-u1" of type "payment.authorized" for payment "pay_001"
+    When I send the batch
+    Then the payment "pay_001" status should be "captured"
+
+  Scenario: Resending a batch is idempotent
+    Given a batch event "wh-i1" of type "payment.authorized" for payment "pay_001"
+    And a batch event "wh-i2" of type "payment.authorized" for payment "pay_002"
+    When I send the batch
+    And I send the batch
+    Then every batch result should be marked idempotent
+
+  Scenario: A 1000-event batch is claimed and committed with bulk statements
+    Given 1000 payments exist in "pending" status
+    And a batch authorizing every bulk payment
+    When I send the batch and count database statements
+    Then the batch results should all have status code 200
+    And all 1000 bulk payments should be in "authorized" status
+    And the batch should have used at most 2 event inserts and 1 commit
+
+  Scenario: A batch with an invalid signature is rejected
+    Given a batch event "wh-s1" of type "payment.authorized" for payment "pay_001"
+    When I send the batch signed with an incorrect secret key
+    Then the response status should be 401
@@ -0,0 +1,45 @@
+Feature: Load Generation and Benchmark Baselines
+  As the FulfillHub platform team
+  I want repeatable load tests with realistic traffic and stored baselines
+  So that a change that makes the receiver slower fails before it ships
+
+  Scenario: A realistic mix contains every kind of traffic
+    When I build a "realistic" workload for 50 payments
+    Then every payment's lifecycle should be sent exactly once
+    And the workload should contain 4 requests with invalid signatures
+    And the workload should redeliver every event of the 2 hot payments 4 times
+    And some payments' lifecycles should be out of order
+
+  Scenario: The regression gate passes a report against its own baseline
+    When I benchmark 20 payments with the "clean" mix from 4 closed-loop clients
+    And I save the report as the baseline
+    Then the regression gate should pass
+    And the saved baseline should equal the report
+
+  Scenario: The regression gate flags server errors
+    When I benchmark 20 payments with the "clean" mix from 4 closed-loop clients
+    And I save the report as the baseline
+    And the report gains 3 responses with status 503
+    Then the regression gate should flag "errors/5xx"
+
+  @slow
+  Scenario Outline: Open-loop realistic traffic is applied correctly on each target
+    When I benchmark 50 payments with the "realistic" mix open-loop at 200 requests per second over "<target>"
+    Then every benchmarked payment should be "chargebacked"
+    And no benchmark response should be a 5xx or a transport error
+    And every request with an invalid signature should get 401
+    And the report should have ordered latency percentiles
+
+    Examples:
+      | target  |
+      | asgi    |
+      | uvicorn |
+
+  @slow
+  Scenario: The regression gate catches a slower receiver
+    When I benchmark 20 payments with the "clean" mix from 1 closed-loop clients
+    And I save the report as the baseline
+    And the receiver takes an extra 20 ms per event
+    And I benchmark 20 payments with the "clean" mix from 1 closed-loop clients
+    Then the regression gate should flag "p50 latency"
+    And the regression gate should flag "throughput"
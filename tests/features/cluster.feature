@@ -0,0 +1,57 @@
+Feature: Multi-Process Deployment with Payment Affinity
+  As the FulfillHub platform team
+  I want to run several receiver processes behind a router
+  So that throughput is not capped by one interpreter while per-payment ordering stays local
+
+  Scenario: Payments are spread over the workers and always map to the same one
+    When I route 400 payment ids over 4 workers twice
+    Then both routings should be identical
+    And every worker should own between 15% and 35% of the payments
+
+  Scenario: Every event of a payment is handled by the worker that owns it
+    Given a router in front of 3 in-process workers
+    And 12 payments exist in "pending" status
+    When I send every payment's lifecycle in reverse order through the router
+    Then every bulk payment should be "chargebacked"
+    And each payment's events should have reached exactly one worker
+    And that worker should be the payment's owner
+    And the router metrics should report 48 routed events
+
+  Scenario: A batch whose payments share a worker is forwarded to that worker
+    Given a router in front of 3 in-process workers
+    And 12 payments exist in "pending" status
+    When I send one batch authorizing the bulk payments owned by the first one's worker through the router
+    Then the response status should be 200
+    And those payments should be "authorized"
+    And only their worker should have received a request
+
+  Scenario: A batch spanning payments owned by different workers is refused
+    Given a router in front of 3 in-process workers
+    And 12 payments exist in "pending" status
+    When I send one batch authorizing every bulk payment through the router
+    Then the response status should be 422
+    And no worker should have received a request
+    And the router metrics should report 1 rejected batch
+
+  Scenario: A body without a payment_id is passed to a worker to reject
+    Given a router in front of 3 in-process workers
+    When I send a webhook without a payment_id through the router
+    Then the response status should be 400
+
+  Scenario: A deeply nested body is passed to a worker to reject
+    Given a router in front of 3 in-process workers
+    When I send a batch nested 100000 levels deep through the router
+    Then the response status should be 400
+
+  Scenario: An unreachable worker is reported as retryable
+    Given a router in front of 2 workers that refuse connections
+    And a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001" through the router
+    Then the response status should be 503
+    And the router metrics should report 1 upstream error
+
+  @slow
+  Scenario: Throughput is measured for each cluster size
+    When I benchmark clusters of 1 and 2 worker processes with 60 payments
+    Then every cluster run should leave all its payments "chargebacked"
+    And every cluster run should have no 5xx responses
@@ -0,0 +1,81 @@
+Feature: Dead-Letter Journal for Exhausted Retries
+  As the FulfillHub operations team
+  I want events that exhaust their DB retries kept somewhere durable
+  So that a database outage never silently drops a webhook
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+    And a payment "pay_002" exists in "pending" status
+
+  Scenario: Without a journal an exhausted event is refused so Yuno retries it
+    Given the database fails every attempt
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 503
+    And the payment "pay_001" status should be "pending"
+
+  Scenario: With a journal an exhausted event is dead-lettered before it is acknowledged
+    Given the receiver dead-letters events to a journal
+    And the database fails every attempt
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 202
+    And the response should be marked "dead_lettered"
+    And the journal should hold 1 event for payment "pay_001"
+    And the payment "pay_001" status should be "pending"
+    And the receiver should have counted 1 exhausted retry
+
+  Scenario: A failed journal write is refused instead of acknowledged
+    Given the receiver dead-letters events to a journal
+    And the database fails every attempt
+    And the journal disk fails every fsync
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 503
+
+  Scenario: The journal is reopened when the receiver starts again
+    Given the receiver dead-letters events to a journal
+    And the database fails every attempt
+    When the receiver is restarted
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 202
+    And the journal should hold 1 event for payment "pay_001"
+
+  Scenario: A failed write leaves no partial line behind
+    Given a dead-letter journal whose disk fills up halfway through the first write
+    When an append fails and the next one succeeds
+    Then the journal file should hold 1 complete lines
+
+  Scenario: Concurrent appends share fsyncs
+    Given a dead-letter journal whose fsync takes 5 ms
+    When 50 threads append to the journal at once
+    Then the journal file should hold 50 complete lines
+    And the journal should have issued fewer than 10 fsyncs
+
+  Scenario: Re-drive applies dead-lettered events once the database recovers
+    Given the receiver dead-letters events to a journal
+    And the database fails every attempt
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.authorized" webhook for payment "pay_002"
+    And the database recovers
+    And Yuno redelivers the first dead-lettered webhook
+    And I re-drive the journal
+    Then the re-drive should report outcomes "idempotent=1, 200=1"
+    And the payment "pay_001" status should be "authorized"
+    And the payment "pay_002" status should be "authorized"
+    When I re-drive the journal
+    Then the re-drive should have replayed 0 events
+
+  Scenario: A partly written last line is left for the next re-drive
+    Given the receiver dead-letters events to a journal
+    And the database fails every attempt
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And half of another record is appended to the journal
+    And the database recovers
+    And I re-drive the journal
+    Then the re-drive should have replayed 1 events
+    And the payment "pay_001" status should be "authorized"
+
+  @slow
+  Scenario: Re-drive replays a large journal at batch speed
+    Given a journal of 5000 "payment.authorized" events for 5000 payments in a file-backed database
+    When I re-drive the journal into the file-backed database
+    Then the re-drive should report outcomes "200=5000"
+    And the re-drive should replay at least 1000 events per second
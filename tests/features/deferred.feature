@@ -0,0 +1,84 @@
+Feature: Deferred-Event Scheduler
+  As the FulfillHub operations team
+  I want deferred events tracked in memory, reconciled and eventually expired
+  So that an event whose prerequisite never arrives does not wait forever
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+    And the receiver tracks deferred events with a TTL of 24 hours
+
+  Scenario: Out-of-order events are indexed by the state they wait for
+    When I send a "payment.settled" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    Then the deferred index should hold 2 events for 1 payment
+    And the deferred index should count 1 event waiting for "captured"
+    And the deferred index should count 1 event waiting for "authorized"
+
+  Scenario: The arriving prerequisite empties the index
+    When I send a "payment.settled" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    Then the payment "pay_001" status should be "settled"
+    And the deferred index should hold 0 events for 0 payments
+
+  Scenario: Events deferred by a batch are indexed and replayed
+    When I send a batch of "payment.settled, payment.captured" for payment "pay_001"
+    Then the deferred index should hold 2 events for 1 payment
+    When I send a batch of "payment.authorized" for payment "pay_001"
+    Then the payment "pay_001" status should be "settled"
+    And the deferred index should hold 0 events for 0 payments
+
+  Scenario: The sweep marks expired deferred events stale
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And the deferred scheduler runs 25 hours from now
+    Then 1 event should be "stale"
+    And the deferred index should hold 0 events for 0 payments
+    And the deferred metrics should report 1 stale event
+
+  Scenario: A stale event is neither replayed nor accepted again
+    When I send webhook "evt_cap" of type "payment.captured" for payment "pay_001"
+    And the deferred scheduler runs 25 hours from now
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    Then the payment "pay_001" status should be "authorized"
+    When I send webhook "evt_cap" of type "payment.captured" for payment "pay_001"
+    Then the response should be marked idempotent
+    And the payment "pay_001" status should be "authorized"
+
+  Scenario: The sweep leaves recent deferred events alone
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And the deferred scheduler runs 1 hours from now
+    Then 1 event should be "deferred"
+    And the deferred index should hold 1 events for 1 payment
+
+  Scenario: Expired events are found whatever order they were indexed in
+    When deferred events received 1, 30 and 26 hours ago are indexed in that order
+    Then the deferred index should find 2 events older than 24 hours, oldest first
+    And the deferred index should report its oldest event as 30 hours old
+
+  Scenario: Reconciliation fetches the missing event and replays the backlog
+    Given the reconciler knows "payment.authorized" for payment "pay_001"
+    When I send a "payment.settled" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    And the deferred scheduler runs 10 minutes from now
+    Then the reconciler should have been asked about "pay_001" waiting for "captured"
+    And the payment "pay_001" status should be "settled"
+    And the deferred index should hold 0 events for 0 payments
+    And the deferred metrics should report 1 reconciled event
+
+  Scenario: Each deferred event is reconciled once
+    Given the reconciler knows nothing
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And the deferred scheduler runs 10 minutes from now
+    And the deferred scheduler runs 20 minutes from now
+    Then the reconciler should have been called 1 time
+
+  Scenario: The index is rebuilt from the database at startup
+    Given 3 "deferred" "payment.captured" events for payment "pay_001" are already stored
+    When the receiver starts
+    Then the deferred index should hold 3 events for 1 payment
+
+  Scenario: Backlog gauges are read from the index, not the events table
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I scrape the metrics counting queries on the events table
+    Then the deferred gauges should report 1 event
+    And no query should have read the events table
@@ -0,0 +1,72 @@
+Feature: Group Commit for Single Webhooks
+  As the FulfillHub platform team
+  I want concurrent webhooks to share one database transaction
+  So that throughput is not capped by one commit per event, without acknowledging uncommitted events
+
+  Background:
+    Given the receiver group-commits webhooks within 20 ms
+
+  Scenario: Concurrent webhooks share commits
+    Given 24 payments exist in "pending" status
+    When I send 24 concurrent authorization webhooks and count commits
+    Then every response should be 200 "accepted"
+    And every bulk payment should be "authorized"
+    And there should have been fewer commits than webhooks
+    And the group commit metrics should report 24 events in fewer than 24 groups
+
+  Scenario: A webhook is not acknowledged before its group commits
+    Given a payment "pay_001" exists in "pending" status
+    And group commits are held back
+    When I send a "payment.authorized" webhook for payment "pay_001" in the background
+    Then the webhook should still be waiting
+    And the payment "pay_001" status should be "pending"
+    When the held group commits
+    Then the background webhook should get 200 "accepted"
+    And the payment "pay_001" status should be "authorized"
+
+  Scenario: Responses match the one-commit-per-event path
+    Given a payment "pay_001" exists in "pending" status
+    When I send webhook "evt_settle" of type "payment.settled" for payment "pay_001"
+    Then the response should be 202 "deferred" for "evt_settle"
+    When I send webhook "evt_auth" of type "payment.authorized" for payment "pay_001"
+    And I send webhook "evt_capture" of type "payment.captured" for payment "pay_001"
+    Then the payment "pay_001" status should be "settled"
+    When I send webhook "evt_auth" of type "payment.authorized" for payment "pay_001"
+    Then the response should be 200 "accepted" for "evt_auth"
+    And the response should be marked idempotent
+    When I send webhook "evt_refund" of type "payment.refunded" for payment "pay_404"
+    Then the response status should be 404
+    And the metrics should count outcome "deferred" once
+
+  Scenario: A failing group is retried one event at a time
+    Given 6 payments exist in "pending" status
+    And transactions of more than one event fail
+    When I send 6 concurrent authorization webhooks and count commits
+    Then every response should be 200 "accepted"
+    And every bulk payment should be "authorized"
+    And the group commit metrics should report a fallback
+
+  Scenario: Groups are flushed in the receiver's database lane
+    Given a payment "pay_001" exists in "pending" status
+    And the threads that flush groups are recorded
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 200
+    And every group should have been flushed on a database lane thread
+
+  Scenario: Events still queued when the writer stops are failed instead of left waiting
+    Given a group-commit writer whose first flush is held back
+    When 3 events are submitted to the writer
+    And the writer is stopped with a 100 ms timeout
+    Then 2 submitted events should have failed
+    When the held group commits
+    Then the first submitted event should have been flushed
+
+  Scenario: Group commit is only offered for synchronous ingest
+    Then creating a queued receiver with group commit should be rejected
+
+  @slow
+  Scenario: Commits per second and latency are measured for each batch window
+    When I benchmark group-commit windows of "off, 0, 0.005" with 40 payments
+    Then every window run should leave all its payments "chargebacked"
+    And every window run should have only 200 responses
+    And every group-commit window should need fewer commits than one per event
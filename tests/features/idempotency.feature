@@ -35,3 +35,26 @@ Feature: Idempotency and Retry Handling
     When I send the same webhook with id "wh-retry" again simulating a Yuno retry
     Then the response status should be 200
     And the response body should indicate it was an idempotent response
+
+  Scenario: A duplicate webhook is answered from the idempotency cache without database work
+    Given I successfully sent a "payment.authorized" webhook with id "wh-cached" for payment "pay_001"
+    When I resend webhook "wh-cached" while counting database statements
+    Then the response body should indicate it was an idempotent response
+    And no database statements should have been executed
+    And the idempotency cache should report 1 hit
+
+  Scenario: The unique constraint still catches duplicates evicted from the cache
+    Given the idempotency cache holds at most 1 entry
+    And a payment "pay_002" exists in "pending" status
+    And I successfully sent a "payment.authorized" webhook with id "wh-old" for payment "pay_001"
+    And I successfully sent a "payment.authorized" webhook with id "wh-new" for payment "pay_002"
+    When I send the same webhook with id "wh-old" again simulating a Yuno retry
+    Then the response body should indicate it was an idempotent response
+    And there should be exactly 1 processed event for webhook "wh-old" in the database
+    And the idempotency cache should report at least 1 eviction
+
+  Scenario: The Bloom filter rejects unseen webhook ids before the LRU lookup
+    Given the idempotency cache uses a Bloom filter
+    When I send a "payment.authorized" webhook with id "wh-fresh" for payment "pay_001"
+    Then the response status should be 200
+    And the idempotency cache should report at least 1 Bloom filter negative
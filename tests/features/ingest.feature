@@ -0,0 +1,56 @@
+Feature: Queued Ingest Mode
+  As the FulfillHub payment system
+  I want to acknowledge webhooks as soon as they are durably enqueued
+  So that Yuno's timeout budget never depends on database contention
+
+  Background:
+    Given the receiver runs in queued ingest mode with 4 workers
+    And a payment "pay_001" exists in "pending" status
+
+  Scenario: Queued webhook is acknowledged with 202 and processed by a worker
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 202
+    And the response body status should be "queued"
+    When the ingest queue has drained
+    Then the payment "pay_001" status should be "authorized"
+
+  Scenario: Lifecycle events for one payment are applied in arrival order
+    When I send the lifecycle "payment.authorized,payment.captured,payment.settled" for payment "pay_001"
+    And the ingest queue has drained
+    Then the payment "pay_001" status should be "settled"
+    And the ingest queue should report 3 "accepted" and 0 "deferred" outcomes
+
+  Scenario: Many payments are spread across workers and all processed
+    Given 40 payments exist in "pending" status
+    When I send 40 concurrent authorization webhooks for different payments
+    And the ingest queue has drained
+    Then all responses should have status 202
+    And all 40 payments should be in "authorized" status
+
+  Scenario: Queue depth and lag are reported while events wait
+    Given the receiver runs in queued ingest mode with 0 workers
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    Then the ingest queue depth should be 2
+    And the ingest queue should report a non-negative oldest lag
+
+  Scenario: An event that keeps failing is parked so its partition keeps moving
+    Given the receiver runs in queued ingest mode with 1 workers
+    And processing always fails for payment "pay_poison"
+    When I send a "payment.authorized" webhook for payment "pay_poison"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    And the ingest queue has drained
+    Then the payment "pay_001" status should be "authorized"
+    And the ingest queue should report 1 parked event after 5 attempts
+
+  Scenario: Later events of a payment are held behind its parked event
+    Given the receiver runs in queued ingest mode with 1 workers
+    And processing always fails for "payment.authorized" events of payment "pay_poison"
+    And a payment "pay_poison" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_poison"
+    And I send a "payment.captured" webhook for payment "pay_poison"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    And the ingest queue has drained
+    Then the payment "pay_001" status should be "authorized"
+    And the payment "pay_poison" status should be "pending"
+    And the ingest queue should report 1 parked and 1 held event
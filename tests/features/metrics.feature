@@ -0,0 +1,66 @@
+Feature: Hot-Path Instrumentation
+  As the FulfillHub on-call engineer
+  I want per-stage timings and outcome counts for every webhook
+  So that silent failures show up on a dashboard instead of in log lines
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+
+  Scenario: Every stage of an accepted webhook is timed
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 200
+    And the metrics should have timed 1 "body_read, signature, parse, idempotency_claim, payment_load, transition, replay, commit, total" stage
+    And the metrics should report 1 DB attempt histogram observation
+
+  Scenario: Each outcome is counted
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    And I resend the last webhook
+    And I send a "payment.authorized" webhook for payment "pay_UNKNOWN"
+    And I send a "payment.refunded" webhook for payment "pay_001"
+    And I send a "payment.settled" webhook for payment "pay_001"
+    And I send a webhook with an invalid signature
+    Then the metrics should report outcomes "deferred=1, accepted=2, idempotent=1, not_found=1, invalid=1, unauthorized=1"
+
+  Scenario: Rejected batch requests are counted
+    When I send a batch whose body is "not json"
+    And I send a batch whose body is "{}"
+    And I send a batch of 1001 events
+    Then the metrics should report outcomes "bad_request=2, too_large=1"
+
+  Scenario: Exhausted DB retries are counted
+    Given the database fails every attempt
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the metrics should report outcomes "retry_exhausted=1"
+    And the metrics should report 1 DB attempt histogram observation
+
+  Scenario: The deferred backlog is reported as gauges
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I send a "payment.settled" webhook for payment "pay_001"
+    Then the metrics should report 2 deferred events
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the metrics should report 0 deferred events
+
+  Scenario Outline: Metrics are served in the Prometheus text format
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I scrape the metrics <how>
+    Then the scrape should be valid Prometheus text
+    And the scrape should contain 'fulfillhub_webhook_stage_seconds_count{stage="commit"} 1'
+    And the scrape should contain 'fulfillhub_webhook_outcomes_total{outcome="accepted"} 1'
+    And the scrape should contain "fulfillhub_deferred_events 0"
+
+    Examples:
+      | how                                     |
+      | with "?format=prometheus"               |
+      | accepting "text/plain;version=0.0.4"    |
+
+  Scenario: Instrumentation can be switched off
+    Given the receiver runs without instrumentation
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 200
+    And the metrics should have no stage timings or outcomes
+
+  @slow
+  Scenario: Disabled instrumentation costs next to nothing per event
+    When I time 100000 events' worth of instrumentation calls with instrumentation off
+    Then each event should spend under 5 microseconds in instrumentation
@@ -45,10 +45,27 @@ Feature: Negative Testing and Malicious Payload Handling
     When I send a webhook request with a 10 megabyte payload
     Then the response status should be 413 or 422
 
+  Scenario: Concurrent oversized uploads that declare their length are refused unread
+    When 8 clients concurrently upload signed 10 megabyte bodies declaring their Content-Length
+    Then every upload should be rejected with 413
+    And no upload body chunk should have been read
+    And peak memory during the uploads should stay under 1 MB
+
+  Scenario: Concurrent oversized chunked uploads are cut off at the size limit
+    When 8 clients concurrently upload signed 10 megabyte bodies without a Content-Length
+    Then every upload should be rejected with 413
+    And peak memory during the uploads should stay under 48 MB
+
   Scenario: Deeply nested JSON payload does not crash the server
     When I send a webhook with 1000 levels of nested JSON
     Then the response status should not be a 5xx error
 
+  Scenario: Nesting beyond the parser's depth limit is rejected as invalid JSON
+    Given a payment "pay_001" exists in "pending" status
+    When I send an otherwise valid webhook carrying 5000 levels of nested JSON text
+    Then the response status should be 400
+    And the payment "pay_001" status should be "pending"
+
   Scenario Outline: Invalid or empty body formats are rejected
     When I send a request with a "<body_description>" as the body
     Then the response status should be 400 or 422
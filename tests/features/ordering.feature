@@ -59,3 +59,39 @@ Feature: Out-of-Order Event Handling
       | declined       | payment.captured     |
       | chargebacked   | payment.refunded     |
       | refunded       | payment.captured     |
+
+  Scenario: A burst of lifecycle events reads the payment row only once
+    Given a payment "pay_001" exists in "pending" status
+    When I send "payment.authorized,payment.captured,payment.settled" for payment "pay_001" while counting payment reads
+    Then the payments table should have been read 1 time
+    And the payment "pay_001" status should be "settled"
+
+  Scenario: A cached status that defers an event is confirmed against the database
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And the payment "pay_001" is moved to "captured" outside the receiver
+    And I send a "payment.settled" webhook for payment "pay_001"
+    Then the response status should be 200
+    And the payment "pay_001" status should be "settled"
+
+  Scenario: A stale cached status never overwrites a newer status
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And the payment "pay_001" is moved to "declined" outside the receiver
+    And I send a "payment.captured" webhook for payment "pay_001"
+    Then the response status should be 422
+    And the payment "pay_001" status should be "declined"
+    And the metrics should report 1 payment compare-and-set conflict without DB retries
+
+  Scenario Outline: Folding an event sequence matches the receiver's deferred replay
+    When I fold the events "<events>" starting from "<initial_status>"
+    Then the folded status should be "<final_status>"
+    And the folded results should be "<results>"
+
+    Examples:
+      | initial_status | events                                                          | final_status | results                          |
+      | pending        | payment.settled,payment.captured,payment.authorized             | settled      | APPLIED,APPLIED,APPLIED          |
+      | pending        | payment.captured,payment.exploded,payment.authorized            | captured     | APPLIED,INVALID,APPLIED          |
+      | pending        | payment.declined,payment.authorized                             | declined     | APPLIED,INVALID                  |
+      | authorized     | payment.settled,payment.refunded                                | authorized   | DEFERRED,DEFERRED                |
+      | captured       | payment.chargeback,payment.refunded,payment.settled             | refunded     | DEFERRED,APPLIED,INVALID         |
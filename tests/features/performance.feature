@@ -13,3 +13,66 @@ Feature: Performance and Timeout Handling
     Given 20 payments exist in "pending" status
     When I send 20 sequential authorization webhooks and measure response times
     Then the P95 response time should be under 2 seconds
+
+  Scenario Outline: P95 latency under concurrent load in each execution mode
+    Given the receiver runs in "<mode>" execution mode
+    And 40 payments exist in "pending" status
+    When I send 40 authorization webhooks with <concurrency> concurrent clients and measure response times
+    Then no response should have a 5xx status code
+    And all 40 payments should be in "authorized" status
+    And the P95 response time should be under 2 seconds
+
+    Examples:
+      | mode       | concurrency |
+      | inline     | 1           |
+      | inline     | 8           |
+      | threadpool | 1           |
+      | threadpool | 8           |
+
+  Scenario: Concurrent events for one hot payment are serialized without DB retries
+    Given the receiver runs with 4 DB workers
+    And a payment "pay_hot" exists in "pending" status
+    When I send 20 concurrent "payment.authorized" webhooks with distinct ids for payment "pay_hot"
+    Then all responses should have a 2xx status
+    And the payment "pay_hot" status should be "authorized"
+    And the metrics should report payment lock contention
+    And the metrics should report 0 DB retries
+
+  Scenario: Reverse-order lifecycles at scale are replayed in a single pass
+    Given 100 payments exist in "pending" status
+    When I send the 4-event lifecycle in reverse order for every payment and measure throughput
+    Then all 100 payments should be in "chargebacked" status
+    And the deferred events should have been loaded once per payment
+
+  Scenario: A 200,000 event backlog is validated by the compiled state machine in under 2 seconds
+    Given a backlog of 50000 payment lifecycles in shuffled order
+    When I fold every payment's events with the compiled state machine
+    Then every payment in the backlog should fold to "chargebacked"
+    And the backlog should have been folded in under 2 seconds
+
+  Scenario: Workers with their own payment caches hammer the same payments without lost updates
+    Given a file-backed database using the "tuned" engine profile with 20 payments in "pending" status
+    When 8 workers with independent payment caches process every payment's refund lifecycle in shuffled order
+    Then every payment in the file-backed database should be "refunded"
+    And every stress event should be processed, deferred behind the refund, or rejected
+    And the workers should have needed 0 DB retries
+    And the stress run should have finished in under 10 seconds
+
+  Scenario Outline: Engine configurations compared under the same concurrent load
+    Given a file-backed database using the "<profile>" engine profile with 20 payments in "pending" status
+    When 8 workers with independent payment caches process every payment's refund lifecycle in shuffled order
+    Then every payment in the file-backed database should be "refunded"
+    And the workers should have needed 0 DB retries
+    And at most <connections> connections should have been checked out at once
+
+    Examples:
+      | profile    | connections |
+      | baseline   | 8           |
+      | tuned      | 8           |
+      | small-pool | 2           |
+
+  Scenario: Single-pass parsing costs less per request than decode, dict and re-decode
+    Given 5000 distinct webhook bodies
+    When I time the two-step and the single-pass parse of every body
+    Then every body should parse to the same payload both ways
+    And the single-pass parse should be faster per request than the two-step parse
@@ -0,0 +1,68 @@
+Feature: Bulk Payment Preloading
+  As the FulfillHub operations team
+  I want to load payments in bulk from CSV or JSONL exports
+  So that webhooks find their payments without a slow one-by-one import
+
+  Scenario: Payments are imported from a CSV file
+    Given a CSV file with 3 payments
+    When I preload the file
+    Then 3 payments should have been written in 1 chunk
+    And the preload should report its rate in rows per second
+    And the payment "pay_csv_0001" status should be "pending"
+
+  Scenario: Payments are imported from a JSONL file in chunks
+    Given a JSONL file with 12 payments
+    When I preload the file in chunks of 5
+    Then 12 payments should have been written in 3 chunks
+
+  Scenario: An existing payment gets its details updated but keeps its status
+    Given a payment "pay_csv_0000" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_csv_0000"
+    And I preload a CSV file with 2 payments of amount 777
+    Then the payment "pay_csv_0000" status should be "authorized"
+    And the payment "pay_csv_0000" amount should be 777
+    And the payment "pay_csv_0001" amount should be 777
+
+  Scenario: Re-importing unchanged payments leaves them untouched
+    When I preload a CSV file with 3 payments of amount 777
+    And I note when every payment was last updated
+    And I preload a CSV file with 3 payments of amount 777
+    Then no payment should have been updated since
+    When I preload a CSV file with 3 payments of amount 888
+    Then every payment should have been updated since
+
+  Scenario: Payments are upserted on a database without ON CONFLICT
+    Given the database does not support upserts
+    And a payment "pay_csv_0000" exists in "authorized" status
+    When I preload a CSV file with 3 payments of amount 777
+    And I note when every payment was last updated
+    And I preload a CSV file with 3 payments of amount 777
+    Then no payment should have been updated since
+    And the payment "pay_csv_0000" status should be "authorized"
+    And the payment "pay_csv_0002" amount should be 777
+    When I preload a CSV file with 3 payments of amount 888
+    Then every payment should have been updated since
+    And the payment "pay_csv_0000" amount should be 888
+
+  Scenario: An invalid row is reported with its line number
+    Given a CSV file with 3 payments where line 3 has amount "ten"
+    When I try to preload the file
+    Then the preload should fail mentioning "line 3"
+
+  Scenario Outline: A JSON amount that is not an integer in range is reported with its line number
+    Given a JSONL file with 3 payments where line 2 has amount <amount>
+    When I try to preload the file
+    Then the preload should fail mentioning "line 2"
+
+    Examples:
+      | amount     |
+      | 12.5       |
+      | true       |
+      | null       |
+      | -1         |
+      | 1000000000 |
+
+  Scenario: A webhook for an unknown payment is rejected without a write
+    When I send a "payment.captured" webhook for payment "pay_missing" while counting database statements
+    Then the response status should be 404
+    And no statement should have written to the database
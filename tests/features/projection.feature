@@ -0,0 +1,121 @@
+Feature: Event-Sourced Payment Projection
+  As the FulfillHub operations team
+  I want payment statuses derivable from the webhook event log
+  So that a damaged or doubted status can be audited and rebuilt quickly
+
+  Scenario: The log agrees with the receiver for shuffled lifecycles
+    Given 20 payments exist in "pending" status
+    When I send every bulk payment's lifecycle in a shuffled order
+    Then verifying the projection should find 0 differences
+
+  Scenario: A rebuild restores a damaged status
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    And the stored status of "pay_001" is overwritten with "declined"
+    Then verifying the projection should find 1 difference
+    When I rebuild the projection
+    Then the rebuild should have changed 1 payment
+    And the payment "pay_001" status should be "captured"
+    And verifying the projection should find 0 differences
+
+  Scenario: Stale events are not part of the log
+    Given a payment "pay_001" exists in "pending" status
+    And the log of "pay_001" holds "payment.captured:stale, payment.authorized:processed"
+    When I rebuild the projection
+    Then the payment "pay_001" status should be "authorized"
+
+  Scenario: Snapshots are taken only for payments that changed
+    Given 3 payments exist in "pending" status
+    When I send "payment.authorized" for every bulk payment
+    And I take snapshots
+    Then 3 snapshots should have been written
+    When I send "payment.captured" for the first bulk payment
+    And I take snapshots
+    Then 1 snapshot should have been written
+    And the first bulk payment's snapshot should be "captured"
+
+  Scenario: A rebuild after a snapshot folds only the tail of the log
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    And I rebuild the projection
+    And I send a "payment.settled" webhook for payment "pay_001"
+    And I rebuild the projection
+    Then the rebuild should have folded 1 event
+    And verifying the projection should find 0 differences
+
+  Scenario: An event waiting at snapshot time is still folded later
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I take snapshots
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    Then the payment "pay_001" status should be "captured"
+    And verifying the projection should find 0 differences
+
+  Scenario: Payments created in a later status fold from that status
+    Given a payment "pay_001" exists in "authorized" status
+    And 3 payments exist in "authorized" status
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I send "payment.captured" for every bulk payment
+    Then verifying the projection should find 0 differences
+    When I rebuild the projection
+    Then the rebuild should have changed 0 payments
+    And the payment "pay_001" status should be "captured"
+
+  Scenario: A payment whose archived log no snapshot covers is left alone
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    And the processed events are archived
+    And the stored status of "pay_001" is overwritten with "declined"
+    And I rebuild the projection
+    Then the rebuild should have skipped 1 payment
+    And the rebuild should have changed 0 payments
+    And the payment "pay_001" status should be "declined"
+    And verifying the projection should find 0 differences
+
+  Scenario: A payment whose archived log a snapshot covers is still rebuilt
+    Given a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001"
+    And I take snapshots
+    And the processed events are archived
+    And the stored status of "pay_001" is overwritten with "declined"
+    And I rebuild the projection
+    Then the rebuild should have skipped 0 payments
+    And the rebuild should have changed 1 payment
+    And the payment "pay_001" status should be "captured"
+
+  Scenario: Payments without events get a baseline when the column is added
+    Given a database without the initial status column where "pay_quiet" is "captured" and "pay_busy" has events
+    When I ensure the initial status column exists
+    Then the initial status of "pay_quiet" should be "captured"
+    And the initial status of "pay_busy" should be unknown
+    And a rebuild of that database should skip 1 payment
+
+  Scenario: Snapshots are written on a database without upserts
+    Given 3 payments exist in "pending" status
+    And the database does not support upserts
+    When I send "payment.authorized" for every bulk payment
+    And I take snapshots
+    And I send "payment.captured" for the first bulk payment
+    And I take snapshots
+    Then 1 snapshot should have been written
+    And the first bulk payment's snapshot should be "captured"
+    And verifying the projection should find 0 differences
+
+  Scenario: The receiver takes snapshots in the background
+    Given the receiver snapshots payments
+    And a payment "pay_001" exists in "pending" status
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And the snapshotter runs
+    Then the snapshot metrics should report 1 snapshot
+
+  @slow
+  Scenario: A large log is rebuilt in bulk
+    Given 25000 payments with a full lifecycle of 4 events each are stored
+    When I rebuild the projection
+    Then the rebuild should have folded 100000 events
+    And the rebuild should have changed 25000 payments
+    And the rebuild should have processed at least 20000 events per second
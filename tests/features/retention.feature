@@ -0,0 +1,91 @@
+Feature: Retention and Archival of Processed Events
+  As the FulfillHub operations team
+  I want old processed webhook events moved out of the hot table
+  So that idempotency inserts stay fast as history grows
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+    And the receiver archives processed events older than 7 days in batches of 10
+    And 25 "processed" events for payment "pay_001" received 10 days ago
+    And 5 "processed" events for payment "pay_001" received 1 days ago
+    And 2 "deferred" events for payment "pay_001" received 10 days ago
+
+  Scenario: Processed events past the horizon are moved to compressed segments
+    When the archiver runs
+    Then 25 events should have been archived in 3 batches
+    And 7 events should remain in the events table
+    And the archive should hold the 25 old processed events with their payloads
+
+  Scenario: Compressed payloads are archived as text
+    Given 4 "processed" events stored as "zlib-dict" for payment "pay_001" received 10 days ago
+    When the archiver runs
+    Then the archive should hold the 29 old processed events with their payloads
+
+  Scenario: A redelivered archived webhook is still recognised as a duplicate
+    When the archiver runs
+    And I resend archived event 0 as "payment.authorized" for payment "pay_001"
+    Then the response status should be 200
+    And the response should be marked idempotent
+    And the payment "pay_001" status should be "pending"
+    And 7 events should remain in the events table
+
+  Scenario: A batch containing an archived webhook treats it as a duplicate
+    When the archiver runs
+    And I process archived event 1 and a new event as "payment.authorized" for payment "pay_001" in one batch
+    Then the batch results should be "idempotent,accepted"
+    And 8 events should remain in the events table
+
+  Scenario: Fingerprints are forgotten once the dedup window has passed
+    When the archiver runs
+    And the archiver runs 40 days from now
+    Then no archived fingerprints should remain
+    When I resend archived event 0 as "payment.authorized" for payment "pay_001"
+    Then the response status should be 200
+    And the payment "pay_001" status should be "captured"
+
+  Scenario: A receiver that does not archive skips the archived-fingerprint lookup
+    Given the receiver itself does not archive
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    And I send a "payment.captured" webhook for payment "pay_001" while counting archive lookups
+    Then no archive lookup should have been made
+
+  Scenario: Events archived by another process are still recognised as duplicates
+    Given the receiver itself does not archive
+    When another process archives the events
+    And I resend archived event 0 as "payment.authorized" for payment "pay_001"
+    Then the response status should be 200
+    And the response should be marked idempotent
+    And the payment "pay_001" status should be "pending"
+
+  Scenario: A receiver that saw nothing archived notices an external run on its next re-check
+    Given the receiver itself does not archive
+    And the receiver re-checks for archived events every 200 ms
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And another process archives the events
+    And 200 ms pass
+    And I resend archived event 0 as "payment.authorized" for payment "pay_001"
+    Then the response should be marked idempotent
+
+  Scenario: Re-archiving a batch after an interrupted run is read back once
+    When the archiver runs
+    And every archive segment is written a second time
+    Then the archive should hold the 25 old processed events with their payloads
+
+  Scenario: The archiver runs in the background while the receiver is up
+    When the receiver starts
+    Then the retention metrics should report 25 archived events
+
+  Scenario: The events table keeps a single index on webhook_id
+    Then the events table should have exactly one index covering "webhook_id"
+
+  Scenario: The redundant webhook_id index is dropped from existing databases
+    Given the legacy index "ix_webhook_events_webhook_id" exists on "webhook_id"
+    When I drop redundant indexes
+    Then the events table should have exactly one index covering "webhook_id"
+
+  @slow
+  Scenario: Archiving a large backlog never holds the write lock for long
+    Given 5000 "processed" events for payment "pay_001" received 30 days ago
+    When the archiver runs
+    Then 5025 events should have been archived in 503 batches
+    And no archive batch should have taken longer than 0.25 seconds
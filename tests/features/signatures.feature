@@ -38,3 +38,77 @@ Feature: Webhook Signature Verification
 
   Scenario: Signature verification uses constant-time comparison to prevent timing attacks
     Then the signature verification implementation should use hmac.compare_digest
+
+  Scenario: A body streamed in small chunks verifies like a buffered one
+    When I stream a valid "payment.authorized" webhook for payment "pay_001" in 16-byte chunks
+    Then the streamed response status should be 200
+    And the payment "pay_001" status should be "authorized"
+
+  Scenario: An expired signature is rejected before any of the body is read
+    When I stream a 2 megabyte webhook with a signature that is 400 seconds old in 64 KB chunks
+    Then the streamed response status should be 401
+    And 0 body chunks should have been read
+
+  Scenario: An oversized body is cut off as soon as it passes the size limit
+    When I stream a validly signed 10 megabyte webhook in 1 MB chunks
+    Then the streamed response status should be 413
+    And at most 6 body chunks should have been read
+
+  Scenario: During a rotation webhooks signed with either secret are accepted
+    Given the receiver accepts signing keys "k-old:old-secret" and "k-new:new-secret"
+    When I send 1 webhook signed with "old-secret"
+    And I send 3 webhooks signed with "new-secret"
+    Then all responses should have a 2xx status
+    And the keyring should have verified 1 request with key "k-old" and 3 with key "k-new"
+    And the keyring should have computed 1 fallback HMAC
+
+  Scenario: A key-id hint selects the signing key without trying the others
+    Given the receiver accepts signing keys "k-old:old-secret" and "k-new:new-secret"
+    When I send 2 webhooks signed with "new-secret" and key id "k-new"
+    Then all responses should have a 2xx status
+    And the keyring should have computed 0 fallback HMAC
+
+  Scenario: A key past the end of its validity window is rejected
+    Given the receiver accepts key "k-old:old-secret" until 60 seconds ago and key "k-new:new-secret"
+    When I send 1 webhook signed with "old-secret"
+    Then the response status should be 401
+
+  Scenario Outline: A replayed signed request is rejected before any processing
+    Given replay protection uses the "<backend>" store
+    When I send the same signed "payment.authorized" webhook for payment "pay_001" twice
+    Then the responses should have statuses 200 and 401
+    And the replay cache should report 1 replay
+
+    Examples:
+      | backend  |
+      | memory   |
+      | database |
+
+  Scenario Outline: A request that failed with 503 can be retried with the same signature
+    Given replay protection uses the "<backend>" store
+    When I send a signed "payment.authorized" webhook for payment "pay_001" while the database is down, then again once it is back
+    Then the responses should have statuses 503 and 200
+    And the replay cache should report 0 replay
+    And the payment "pay_001" status should be "authorized"
+
+    Examples:
+      | backend  |
+      | memory   |
+      | database |
+
+  Scenario: A duplicate delivery re-signed with a new timestamp is still answered idempotently
+    Given replay protection uses the "memory" store
+    When I send the same "payment.authorized" webhook for payment "pay_001" signed 5 seconds apart
+    Then the responses should have statuses 200 and 200
+    And the replay cache should report 0 replay
+
+  Scenario: Workers sharing the database store reject each other's replays
+    Given replay protection uses the "database" store
+    When I send a signed "payment.authorized" webhook for payment "pay_001" to one worker and replay it to another
+    Then the responses should have statuses 200 and 401
+
+  Scenario: Replay buckets are dropped whole once they leave the signature window
+    Given an in-memory replay store with 10 second buckets
+    When 3000 signatures are recorded over the last 300 seconds
+    And the clock moves forward 310 seconds
+    Then only the signature recorded after the move should be left, in 1 bucket
@@ -0,0 +1,62 @@
+Feature: Compact Payload Storage
+  As the FulfillHub operations team
+  I want stored webhook payloads to take as little space as possible
+  So that the events table stays small and inserts stay fast
+
+  Background:
+    Given a payment "pay_001" exists in "pending" status
+
+  Scenario Outline: Payloads read back unchanged in every storage mode
+    Given the receiver stores payloads as "<mode>"
+    When I send a "payment.authorized" webhook for payment "pay_001"
+    Then the response status should be 200
+    And the stored payload should equal the request body
+    And the stored payload should be kept in the "<column>" column
+
+    Examples:
+      | mode      | column       |
+      | text      | payload      |
+      | zlib      | payload_zlib |
+      | zlib-dict | payload_zlib |
+
+  Scenario: Batch events are stored compressed too
+    Given the receiver stores payloads as "zlib-dict"
+    When I process a batch of 3 "payment.authorized" events for payment "pay_001"
+    Then every stored payload should equal its event body
+    And no stored payload should be kept in the "payload" column
+
+  Scenario: Deferred events are replayed from compressed storage
+    Given the receiver stores payloads as "zlib-dict"
+    When I send a "payment.captured" webhook for payment "pay_001"
+    And I send a "payment.authorized" webhook for payment "pay_001"
+    Then the payment "pay_001" status should be "captured"
+
+  Scenario: Existing text payloads are migrated in batches
+    Given 45 events stored with text payloads for payment "pay_001"
+    When I migrate stored payloads to "zlib-dict" in batches of 20
+    Then 45 payloads should have been migrated
+    And every stored payload should equal its event body
+    And no stored payload should be kept in the "payload" column
+    When I migrate stored payloads to "zlib-dict" in batches of 20
+    Then 0 payloads should have been migrated
+
+  Scenario: Migrating back to text restores the text column
+    Given 10 events stored with text payloads for payment "pay_001"
+    When I migrate stored payloads to "zlib" in batches of 4
+    And I migrate stored payloads to "text" in batches of 4
+    Then 10 payloads should have been migrated
+    And every stored payload should equal its event body
+    And no stored payload should be kept in the "payload_zlib" column
+
+  Scenario: A database created before compressed storage gains the column
+    Given a file-backed events table without the compressed payload column
+    When I ensure the compressed payload column exists
+    Then the events table should have a "payload_zlib" column
+    And ensuring the column again should change nothing
+
+  @slow
+  Scenario: Dictionary compression shrinks stored payloads without slowing inserts
+    When I insert 2000 events in each payload storage mode into a file-backed database
+    Then "zlib-dict" payloads should use at most 35% of the "text" bytes per event
+    And "zlib-dict" payloads should use fewer bytes per event than "zlib"
+    And "zlib-dict" inserts should run at least half as fast as "text" inserts
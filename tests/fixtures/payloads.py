@@ -1,5 +1,13 @@
 import uuid
 
+# A payment's full happy-path lifecycle, in the order Yuno emits it
+PAYMENT_LIFECYCLE = (
+    "payment.authorized",
+    "payment.captured",
+    "payment.settled",
+    "payment.chargeback",
+)
+
 
 def make_webhook_payload(
     event_type: str,
@@ -25,6 +33,16 @@ def make_webhook_payload(
     return payload
 
 
+def make_lifecycle_payloads(
+    payment_id: str, event_types: tuple[str, ...] = PAYMENT_LIFECYCLE, **kwargs,
+) -> list[dict]:
+    """Build one payload per event type, each with its own webhook_id."""
+    return [
+        make_webhook_payload(event_type=event_type, payment_id=payment_id, **kwargs)
+        for event_type in event_types
+    ]
+
+
 def make_payment_record(
     payment_id: str = "pay_001",
     merchant_id: str = "merchant_test",
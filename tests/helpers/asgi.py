@@ -0,0 +1,60 @@
+"""Drive an ASGI app with a request body delivered in chunks.
+
+TestClient hands the app the whole body at once; these helpers feed it one
+`http.request` message per chunk and record how many chunks the app pulled,
+so tests can see whether a request was rejected before its body was read.
+"""
+import asyncio
+import json
+from typing import Iterable
+
+
+async def send_chunked_async(
+    app, path: str, headers: dict[str, str], chunks: Iterable[bytes],
+):
+    """Coroutine form of send_chunked, for running several uploads concurrently."""
+    chunks = iter(chunks)
+    pulled = 0
+    finished = False
+    messages: list[dict] = []
+
+    async def receive():
+        nonlocal pulled, finished
+        if finished:
+            await asyncio.sleep(3600)  # nothing more to send; wait to be cancelled
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            finished = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        pulled += 1
+        await asyncio.sleep(0)  # let concurrent uploads interleave, as over a socket
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+        "app": app,
+    }
+    await app(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, json.loads(body) if body else None, pulled
+
+
+def send_chunked(app, path: str, headers: dict[str, str], chunks: Iterable[bytes]):
+    """POST `chunks` to `path` on `app`; returns (status, json_body, chunks_pulled)."""
+    return asyncio.run(send_chunked_async(app, path, headers, chunks))
@@ -1,5 +1,7 @@
 import json
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 
@@ -44,3 +46,44 @@ def send_concurrent_requests(
         t.join(timeout=30)
 
     return results
+
+
+def send_timed_requests(
+    client,
+    url: str,
+    requests: list[tuple[bytes, dict]],
+    concurrency: int = 1,
+) -> tuple[list[Any], list[float]]:
+    """
+    Send pre-signed requests through a pool of `concurrency` client threads.
+
+    Args:
+        client: httpx or starlette TestClient.
+        url: Endpoint URL.
+        requests: (body, headers) pairs, sent in order as workers free up.
+        concurrency: Number of requests in flight at once.
+
+    Returns:
+        (responses, latencies) in the same order as `requests`; latencies in seconds.
+    """
+    n = len(requests)
+    results: list[Any] = [None] * n
+    latencies: list[float] = [0.0] * n
+
+    def worker(index: int) -> None:
+        body, headers = requests[index]
+        start = time.monotonic()
+        try:
+            results[index] = client.post(
+                url,
+                content=body,
+                headers={**headers, "Content-Type": "application/json"},
+            )
+        except Exception as exc:  # noqa: BLE001
+            results[index] = exc
+        latencies[index] = time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(n)))
+
+    return results, latencies
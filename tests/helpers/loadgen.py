@@ -0,0 +1,572 @@
+"""Load generation and benchmarking for the webhook receiver.
+
+A workload is a list of pre-signed requests built from payment lifecycles
+(`tests/fixtures/payloads.py`) and shaped by a `WorkloadMix`: shuffled
+lifecycles, redelivered duplicates, hot payments that see many deliveries, and
+requests with invalid signatures. `run_benchmark` sends it either open-loop
+(requests leave at a fixed or Poisson arrival rate, whether or not earlier ones
+have finished, and latency is measured from the scheduled send time) or
+closed-loop (a fixed number of clients), to the app in-process over ASGI, to
+a real uvicorn server on a local port, or to a server already running at a
+`base_url`.
+
+Reports are plain dicts that can be saved as JSON baselines; `check_regression`
+compares a report with a baseline and lists what got worse:
+
+    python -m tests.helpers.loadgen --mix realistic --rate 300 --save-baseline base.json
+    python -m tests.helpers.loadgen --mix realistic --rate 300 --baseline base.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import NamedTuple, Sequence
+
+import httpx
+from sqlalchemy import select
+
+from tests.fixtures.payloads import make_lifecycle_payloads
+from tests.helpers.signing import signed_headers
+
+WEBHOOK_URL = "/webhooks/yuno"
+TARGETS = ("asgi", "uvicorn")
+ARRIVALS = ("uniform", "poisson")
+
+
+@dataclass(frozen=True)
+class WorkloadMix:
+    """Shape of the traffic sent on top of one lifecycle per payment.
+
+    Args:
+        out_of_order: Share of payments whose lifecycle events are shuffled.
+        duplicates: Share of events that are redelivered once, later on.
+        hot_payments: Number of payments that get extra redeliveries.
+        hot_redeliveries: Extra deliveries of each event of a hot payment.
+        invalid_signatures: Extra badly signed requests, as a share of events.
+    """
+
+    name: str
+    out_of_order: float = 0.0
+    duplicates: float = 0.0
+    hot_payments: int = 0
+    hot_redeliveries: int = 0
+    invalid_signatures: float = 0.0
+
+
+MIXES = {
+    "clean": WorkloadMix("clean"),
+    "realistic": WorkloadMix(
+        "realistic", out_of_order=0.2, duplicates=0.05, hot_payments=2,
+        hot_redeliveries=4, invalid_signatures=0.02,
+    ),
+    "retry-storm": WorkloadMix(
+        "retry-storm", out_of_order=0.5, duplicates=0.5, hot_payments=5,
+        hot_redeliveries=10, invalid_signatures=0.1,
+    ),
+}
+
+
+class LoadRequest(NamedTuple):
+    kind: str  # "event", "duplicate" or "invalid_signature"
+    payment_id: str
+    body: bytes
+    headers: dict[str, str]
+
+
+def build_workload(
+    payment_ids: list[str], mix: WorkloadMix, secret: str, seed: int = 0,
+) -> list[LoadRequest]:
+    """Interleave every payment's lifecycle into one request stream shaped by `mix`.
+
+    Each payment's events keep their lifecycle order unless the payment was
+    picked for `out_of_order`. Redeliveries are exact copies (same body and
+    signature) scheduled after the original.
+    """
+    rng = random.Random(seed)
+    hot = set(payment_ids[:mix.hot_payments])
+    per_payment = {}
+    for pid in payment_ids:
+        payloads = make_lifecycle_payloads(pid)
+        if rng.random() < mix.out_of_order:
+            rng.shuffle(payloads)
+        per_payment[pid] = payloads
+
+    # Draw the next event from a random payment that still has events left
+    stream: list[LoadRequest] = []
+    remaining = [pid for pid in payment_ids for _ in per_payment[pid]]
+    rng.shuffle(remaining)
+    cursors = Counter()
+    for pid in remaining:
+        payload = per_payment[pid][cursors[pid]]
+        cursors[pid] += 1
+        body = json.dumps(payload).encode()
+        stream.append(LoadRequest("event", pid, body, signed_headers(secret=secret, body=body)))
+
+    n = len(stream)
+    keyed = [(float(index), request) for index, request in enumerate(stream)]
+    for index, request in enumerate(stream):
+        copies = (mix.hot_redeliveries if request.payment_id in hot else 0)
+        copies += rng.random() < mix.duplicates
+        for _ in range(copies):
+            keyed.append((rng.uniform(index, n), request._replace(kind="duplicate")))
+    for _ in range(round(n * mix.invalid_signatures)):
+        victim = stream[rng.randrange(n)]
+        keyed.append((rng.uniform(0, n), victim._replace(
+            kind="invalid_signature",
+            headers={**victim.headers, "X-Yuno-Signature": "0" * 64},
+        )))
+    keyed.sort(key=lambda item: item[0])
+    return [request for _, request in keyed]
+
+
+# ── Targets ──────────────────────────────────────────────────────────────────
+
+@asynccontextmanager
+async def asgi_target(app):
+    """httpx client calling `app` in-process; runs the app's lifespan around it."""
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadgen") as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_target(app, max_connections: int = 100):
+    """httpx client talking to `app` served by uvicorn on a free local port."""
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on", ws="none", log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("uvicorn exited during startup")
+            await asyncio.sleep(0.01)
+        limits = httpx.Limits(max_connections=max_connections)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30,
+        ) as client:
+            yield client
+    finally:
+        server.should_exit = True
+        await asyncio.to_thread(thread.join, 10)
+        sock.close()
+
+
+@asynccontextmanager
+async def url_target(base_url: str, max_connections: int = 100):
+    """httpx client for a server that is already running (e.g. an app.cluster router)."""
+    limits = httpx.Limits(max_connections=max_connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        yield client
+
+
+_TARGETS = {"asgi": asgi_target, "uvicorn": uvicorn_target}
+
+
+# ── Drivers ──────────────────────────────────────────────────────────────────
+
+async def _send(client, request: LoadRequest, since: float, results: list, index: int) -> None:
+    try:
+        response = await client.post(
+            WEBHOOK_URL, content=request.body,
+            headers={**request.headers, "Content-Type": "application/json"},
+        )
+        status = response.status_code
+    except httpx.HTTPError:
+        status = None
+    results[index] = (request.kind, status, time.perf_counter() - since)
+
+
+async def run_open_loop(
+    client, requests: list[LoadRequest], rate: float, arrival: str = "poisson", seed: int = 0,
+) -> tuple[list, float]:
+    """Send requests at `rate` per second regardless of responses; (results, seconds).
+
+    Latency counts from each request's scheduled start, so a receiver that
+    falls behind is charged for the queueing it causes.
+    """
+    if arrival not in ARRIVALS:
+        raise ValueError(f"Unknown arrival {arrival!r}; expected one of {ARRIVALS}.")
+    rng = random.Random(seed)
+    results: list = [None] * len(requests)
+    tasks = []
+    started = time.perf_counter()
+    due = started
+    for index, request in enumerate(requests):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_send(client, request, due, results, index)))
+        due += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started
+
+
+async def run_closed_loop(
+    client, requests: list[LoadRequest], concurrency: int,
+) -> tuple[list, float]:
+    """Send requests from `concurrency` clients, each waiting for its response; (results, seconds)."""
+    results: list = [None] * len(requests)
+    indexes = iter(range(len(requests)))
+
+    async def worker():
+        for index in indexes:
+            await _send(client, requests[index], time.perf_counter(), results, index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted `values` (0.0 when empty)."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(q * len(values)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(results: list, seconds: float) -> dict:
+    latencies = sorted(latency for _, _, latency in results)
+    statuses = Counter(str(status) for _, status, _ in results)
+    return {
+        "requests": len(results),
+        "seconds": round(seconds, 4),
+        "throughput": round(len(results) / seconds, 1) if seconds else 0.0,
+        "latency": {
+            "p50": round(percentile(latencies, 0.50), 6),
+            "p95": round(percentile(latencies, 0.95), 6),
+            "p99": round(percentile(latencies, 0.99), 6),
+            "max": round(latencies[-1], 6) if latencies else 0.0,
+        },
+        "statuses": dict(sorted(statuses.items())),
+        "kinds": dict(sorted(Counter(kind for kind, _, _ in results).items())),
+        "errors": statuses.get("None", 0),
+    }
+
+
+def run_benchmark(
+    app,
+    requests: list[LoadRequest],
+    target: str = "asgi",
+    rate: float | None = None,
+    concurrency: int = 8,
+    arrival: str = "poisson",
+    seed: int = 0,
+    name: str = "webhooks",
+    base_url: str | None = None,
+) -> dict:
+    """Drive `app` with `requests` and return a JSON-serialisable report.
+
+    `target` picks how `app` is served. To drive a server that is already
+    running (e.g. an app.cluster router), pass `base_url` and no app. With
+    `rate` the load is open-loop at that many requests per second; without
+    it, `concurrency` closed-loop clients send as fast as they can.
+    """
+    if (app is None) == (base_url is None):
+        raise ValueError("Pass either an app or a base_url.")
+    if base_url is not None:
+        target = "url"
+    elif target not in TARGETS:
+        raise ValueError(f"Unknown target {target!r}; expected one of {TARGETS}.")
+
+    def connect():
+        return url_target(base_url) if base_url is not None else _TARGETS[target](app)
+
+    async def drive():
+        async with connect() as client:
+            if rate is not None:
+                return await run_open_loop(client, requests, rate, arrival, seed)
+            return await run_closed_loop(client, requests, concurrency)
+
+    results, seconds = asyncio.run(drive())
+    return {
+        "name": name,
+        "target": target,
+        "load": (
+            {"model": "open", "rate": rate, "arrival": arrival} if rate is not None
+            else {"model": "closed", "concurrency": concurrency}
+        ),
+        **summarize(results, seconds),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+    }
+
+
+# ── Baselines and the regression gate ────────────────────────────────────────
+
+def save_baseline(path: str | Path, report: dict) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+def load_baseline(path: str | Path) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+@dataclass(frozen=True)
+class RegressionThresholds:
+    """How much worse than the baseline a report may be before the gate fails.
+
+    Args:
+        latency: Allowed relative increase of p50/p95/p99 (0.5 = 50% slower).
+        latency_slack: Absolute seconds ignored on top, so sub-millisecond
+            jitter cannot fail the gate on its own.
+        throughput: Allowed relative drop in requests per second.
+        errors: Allowed increase in transport errors and 5xx responses.
+    """
+
+    latency: float = 0.5
+    latency_slack: float = 0.002
+    throughput: float = 0.3
+    errors: int = 0
+
+
+def _server_errors(report: dict) -> int:
+    return report["errors"] + sum(
+        count for status, count in report["statuses"].items() if status.startswith("5")
+    )
+
+
+def check_regression(
+    report: dict, baseline: dict, thresholds: RegressionThresholds = RegressionThresholds(),
+) -> list[str]:
+    """Describe every way `report` is worse than `baseline` past `thresholds` ([] if none)."""
+    problems = []
+    for q in ("p50", "p95", "p99"):
+        now, then = report["latency"][q], baseline["latency"][q]
+        limit = then * (1 + thresholds.latency) + thresholds.latency_slack
+        if now > limit:
+            problems.append(f"{q} latency {now:.4f}s exceeds {limit:.4f}s (baseline {then:.4f}s)")
+    floor = baseline["throughput"] * (1 - thresholds.throughput)
+    if report["throughput"] < floor:
+        problems.append(
+            f"throughput {report['throughput']:.1f}/s below {floor:.1f}/s "
+            f"(baseline {baseline['throughput']:.1f}/s)"
+        )
+    errors, allowed = _server_errors(report), _server_errors(baseline) + thresholds.errors
+    if errors > allowed:
+        problems.append(f"{errors} errors/5xx responses, at most {allowed} allowed")
+    return problems
+
+
+def scaling_benchmark(
+    worker_counts: Sequence[int],
+    workdir: str | Path,
+    payments: int = 250,
+    mix: str = "clean",
+    concurrency: int = 16,
+    secret: str = "loadgen-secret",
+) -> list[dict]:
+    """Run the same workload against an app.cluster of each size; one report per size.
+
+    Each run gets a fresh SQLite file shared by its workers. Reports carry
+    `workers` and `speedup` (throughput relative to the first size).
+    """
+    from sqlalchemy.orm import sessionmaker
+
+    from app.cluster import Cluster
+    from app.database import EngineConfig, create_db_engine
+    from app.models import Payment
+    from tests.fixtures.payloads import make_payment_record
+
+    reports = []
+    for workers in worker_counts:
+        url = f"sqlite:///{Path(workdir) / f'cluster-{workers}.db'}"
+        with Cluster(workers, url, webhook_secret=secret, quiet=True) as cluster:
+            engine = create_db_engine(EngineConfig(url=url))
+            payment_ids = [f"pay_scale_{i:05d}" for i in range(payments)]
+            with sessionmaker(bind=engine)() as db:
+                db.add_all(Payment(**make_payment_record(payment_id=pid)) for pid in payment_ids)
+                db.commit()
+            requests = build_workload(payment_ids, MIXES[mix], secret)
+            report = run_benchmark(
+                None, requests, base_url=cluster.url, concurrency=concurrency,
+                name=f"{mix}-{workers}-workers",
+            )
+            with sessionmaker(bind=engine)() as db:
+                report["final_statuses"] = dict(Counter(db.scalars(
+                    select(Payment.status).where(Payment.id.in_(payment_ids))
+                )))
+            engine.dispose()
+        report["workers"] = workers
+        report["speedup"] = round(report["throughput"] / reports[0]["throughput"], 2) if reports else 1.0
+        reports.append(report)
+    return reports
+
+
+def file_backed_app(
+    db_path: str | Path,
+    payment_ids: Sequence[str],
+    secret: str = "loadgen-secret",
+    synchronous: str = "NORMAL",
+    **app_options,
+):
+    """(app, engine): a receiver on a fresh SQLite file holding `payment_ids` as pending."""
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database import EngineConfig, create_db_engine, get_db
+    from app.main import create_app
+    from app.models import Base, Payment
+    from tests.fixtures.payloads import make_payment_record
+
+    engine = create_db_engine(EngineConfig(url=f"sqlite:///{db_path}", synchronous=synchronous))
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    with Session() as db:
+        db.add_all(Payment(**make_payment_record(payment_id=pid)) for pid in payment_ids)
+        db.commit()
+
+    app = create_app(webhook_secret=secret, db_engine=engine, **app_options)
+
+    def override_get_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    return app, engine
+
+
+def group_commit_benchmark(
+    windows: Sequence[float | None],
+    workdir: str | Path,
+    payments: int = 200,
+    mix: str = "clean",
+    concurrency: int = 16,
+    max_events: int = 100,
+    secret: str = "loadgen-secret",
+) -> list[dict]:
+    """Run one workload per group-commit window (None = one commit per event).
+
+    Each run gets a fresh SQLite file with synchronous=FULL, so every commit is
+    an fsync. Reports add `window`, `commits`, `commits_per_sec`,
+    `events_per_commit` and `final_statuses` to the usual latency and throughput.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import sessionmaker
+
+    from app.groupcommit import GroupCommitConfig
+    from app.models import Payment
+
+    payment_ids = [f"pay_group_{i:05d}" for i in range(payments)]
+    requests = build_workload(payment_ids, MIXES[mix], secret)
+    reports = []
+    for index, window in enumerate(windows):
+        options = {}
+        if window is not None:
+            options["group_commit"] = GroupCommitConfig(window=window, max_events=max_events)
+        app, engine = file_backed_app(
+            Path(workdir) / f"group-{index}.db", payment_ids, secret,
+            synchronous="FULL", **options,
+        )
+        commits = []
+
+        def on_commit(conn):
+            commits.append(conn)
+
+        event.listen(engine, "commit", on_commit)
+        report = run_benchmark(
+            app, requests, concurrency=concurrency,
+            name=f"{mix}-window-{'off' if window is None else window}",
+        )
+        event.remove(engine, "commit", on_commit)
+        with sessionmaker(bind=engine)() as db:
+            report["final_statuses"] = dict(Counter(db.scalars(
+                select(Payment.status).where(Payment.id.in_(payment_ids))
+            )))
+        engine.dispose()
+        report["window"] = window
+        report["commits"] = len(commits)
+        report["commits_per_sec"] = round(len(commits) / report["seconds"], 1) if report["seconds"] else 0.0
+        report["events_per_commit"] = round(report["requests"] / len(commits), 2) if commits else 0.0
+        reports.append(report)
+    return reports
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Benchmark a fresh receiver on a temporary file-backed SQLite database."""
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Load-test the webhook receiver.")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="realistic")
+    parser.add_argument("--payments", type=int, default=250)
+    parser.add_argument("--target", choices=TARGETS, default="asgi")
+    parser.add_argument("--rate", type=float, help="open-loop requests/s (default: closed loop)")
+    parser.add_argument("--arrival", choices=ARRIVALS, default="poisson")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if worse than this report")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5)
+    parser.add_argument("--throughput-tolerance", type=float, default=0.3)
+    parser.add_argument("--workers", help="comma-separated cluster sizes to compare, e.g. 1,2,4")
+    parser.add_argument(
+        "--group-commit-windows",
+        help="comma-separated group-commit windows in seconds to compare, 'off' for none",
+    )
+    args = parser.parse_args(argv)
+
+    secret = "loadgen-secret"
+    if args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            reports = scaling_benchmark(
+                [int(n) for n in args.workers.split(",")], tmp, payments=args.payments,
+                mix=args.mix, concurrency=args.concurrency, secret=secret,
+            )
+        print(json.dumps(reports, indent=2, sort_keys=True))
+        return 0
+    if args.group_commit_windows:
+        windows = [
+            None if w == "off" else float(w) for w in args.group_commit_windows.split(",")
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            reports = group_commit_benchmark(
+                windows, tmp, payments=args.payments, mix=args.mix,
+                concurrency=args.concurrency, secret=secret,
+            )
+        print(json.dumps(reports, indent=2, sort_keys=True))
+        return 0
+    with tempfile.TemporaryDirectory() as tmp:
+        payment_ids = [f"pay_load_{i:05d}" for i in range(args.payments)]
+        app, engine = file_backed_app(Path(tmp) / "loadgen.db", payment_ids, secret)
+        requests = build_workload(payment_ids, MIXES[args.mix], secret, seed=args.seed)
+        report = run_benchmark(
+            app, requests, target=args.target, rate=args.rate,
+            concurrency=args.concurrency, arrival=args.arrival, seed=args.seed,
+            name=args.mix,
+        )
+        engine.dispose()
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.save_baseline:
+        save_baseline(args.save_baseline, report)
+    if args.baseline:
+        problems = check_regression(report, load_baseline(args.baseline), RegressionThresholds(
+            latency=args.latency_tolerance, throughput=args.throughput_tolerance,
+        ))
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,9 +12,12 @@ import json
 import uuid
 
 from pytest_bdd import given, parsers, then, when
+from sqlalchemy.exc import OperationalError
 
+import app.main as main
 from app.models import Payment, WebhookEvent
-from tests.fixtures.payloads import make_webhook_payload
+from app.preload import upsert_payments
+from tests.fixtures.payloads import make_payment_record, make_webhook_payload
 from tests.step_defs.common_steps import _post_webhook
 
 
@@ -41,22 +44,22 @@ def create_payment(pid, status, db_session):
 
 @given(parsers.parse('{n:d} payments exist in "{status}" status'))
 def create_n_payments(n, status, db_session, context):
-    payment_ids = []
-    for _ in range(n):
-        pid = f"pay_bulk_{uuid.uuid4().hex[:8]}"
-        payment = Payment(
-            id=pid,
-            merchant_id="merchant_test",
-            amount=10000,
-            currency="USD",
-            status=status,
-        )
-        db_session.add(payment)
-        payment_ids.append(pid)
-    db_session.commit()
+    payment_ids = [f"pay_bulk_{uuid.uuid4().hex[:8]}" for _ in range(n)]
+    upsert_payments(db_session, (
+        make_payment_record(payment_id=pid, status=status) for pid in payment_ids
+    ))
     context["bulk_payment_ids"] = payment_ids
 
 
+@given("the database fails every attempt")
+def failing_database(monkeypatch):
+    def fail(*args):
+        raise OperationalError("UPDATE payments", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(main, "_process_in_session", fail)
+    monkeypatch.setattr(main, "DB_RETRY_DELAY", 0)
+
+
 # ── When ───────────────────────────────────────────────────────────────────────
 
 @when(parsers.parse('I send a "{event_type}" webhook for payment "{pid}"'))
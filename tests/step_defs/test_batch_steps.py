@@ -0,0 +1,124 @@
+import json
+
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event
+
+import app.batch as batch
+from app.models import Payment, WebhookEvent
+from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET
+
+scenarios("batch.feature")
+
+BATCH_URL = "/webhooks/yuno/batch"
+
+
+def _post_batch(client, events: list[dict], secret: str = WEBHOOK_SECRET) -> object:
+    body = json.dumps({"events": events}).encode()
+    headers = signed_headers(secret=secret, body=body)
+    headers["Content-Type"] = "application/json"
+    return client.post(BATCH_URL, content=body, headers=headers)
+
+
+@given(parsers.parse('a batch event "{wid}" of type "{event_type}" for payment "{pid}"'))
+def add_batch_event(wid, event_type, pid, context):
+    context.setdefault("batch", []).append(
+        make_webhook_payload(event_type=event_type, payment_id=pid, webhook_id=wid)
+    )
+
+
+@given("a batch authorizing every bulk payment")
+def batch_for_bulk_payments(context):
+    context["batch"] = [
+        make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+        for pid in context["bulk_payment_ids"]
+    ]
+
+
+@given("the database has no bulk idempotency claim")
+def no_bulk_claim(monkeypatch):
+    monkeypatch.setattr(batch, "_INSERTS", {})
+
+
+@when("I send the batch")
+def send_batch(client, context):
+    context["response"] = _post_batch(client, context["batch"])
+
+
+@when("I send the batch signed with an incorrect secret key")
+def send_batch_wrong_secret(client, context):
+    context["response"] = _post_batch(client, context["batch"], secret="wrong-secret")
+
+
+@when("I send the batch and count database statements")
+def send_batch_counting(client, context, db_engine):
+    statements = []
+    commits = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        statements.append(statement)
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    event.listen(db_engine, "commit", on_commit)
+    try:
+        context["response"] = _post_batch(client, context["batch"])
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+        event.remove(db_engine, "commit", on_commit)
+    context["statements"] = statements
+    context["commits"] = commits
+
+
+@then(parsers.parse('the batch results should have status codes "{codes}"'))
+def check_batch_codes(codes, context):
+    results = context["response"].json()["results"]
+    assert [r["status_code"] for r in results] == [int(c) for c in codes.split(",")], results
+
+
+@then(parsers.parse("the batch results should all have status code {code:d}"))
+def check_all_batch_codes(code, context):
+    results = context["response"].json()["results"]
+    assert all(r["status_code"] == code for r in results), results[:5]
+
+
+@then("every batch result should be marked idempotent")
+def check_batch_idempotent(context):
+    results = context["response"].json()["results"]
+    assert all(r.get("idempotent") is True for r in results), results
+
+
+@then(parsers.parse('event "{wid}" should be stored with processing_status "{status}"'))
+def check_event_status(wid, status, db_session):
+    db_session.expire_all()
+    stored = db_session.query(WebhookEvent).filter(WebhookEvent.webhook_id == wid).one()
+    assert stored.processing_status == status
+
+
+@then(parsers.parse('event "{wid}" should not be stored'))
+def check_event_absent(wid, db_session):
+    db_session.expire_all()
+    assert db_session.query(WebhookEvent).filter(WebhookEvent.webhook_id == wid).count() == 0
+
+
+@then(parsers.parse('all {n:d} bulk payments should be in "{status}" status'))
+def check_bulk_status(n, status, context, db_session):
+    db_session.expire_all()
+    ids = context["bulk_payment_ids"]
+    assert len(ids) == n
+    statuses = {
+        p.status for p in db_session.query(Payment).filter(Payment.id.in_(ids))
+    }
+    assert statuses == {status}, statuses
+
+
+@then(parsers.parse(
+    "the batch should have used at most {inserts:d} event inserts and {commits:d} commit"
+))
+def check_statement_counts(inserts, commits, context):
+    event_inserts = [s for s in context["statements"] if s.startswith("INSERT INTO webhook_events")]
+    assert len(event_inserts) <= inserts, len(event_inserts)
+    assert len(context["commits"]) == commits, len(context["commits"])
@@ -0,0 +1,166 @@
+import json
+import logging
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from pytest_bdd import parsers, scenarios, then, when
+from sqlalchemy import select
+
+import app.main as main
+from app.models import Payment
+from tests.fixtures.payloads import PAYMENT_LIFECYCLE, make_payment_record
+from tests.helpers.loadgen import (
+    MIXES, build_workload, check_regression, load_baseline, run_benchmark, save_baseline,
+)
+from tests.step_defs.common_steps import WEBHOOK_SECRET
+
+scenarios("benchmark.feature")
+
+logger = logging.getLogger(__name__)
+
+
+def _create_payments(db_session, n):
+    prefix = f"pay_bench_{uuid.uuid4().hex[:6]}"
+    payment_ids = [f"{prefix}_{i:04d}" for i in range(n)]
+    db_session.add_all(Payment(**make_payment_record(payment_id=pid)) for pid in payment_ids)
+    db_session.commit()
+    return payment_ids
+
+
+def _benchmark(app, db_session, context, n, mix, **load):
+    payment_ids = _create_payments(db_session, n)
+    workload = build_workload(payment_ids, MIXES[mix], WEBHOOK_SECRET)
+    report = run_benchmark(app, workload, name=mix, **load)
+    logger.info(
+        "benchmark %s/%s: %d requests, %.0f req/s, p50 %.4fs p95 %.4fs p99 %.4fs",
+        mix, report["target"], report["requests"], report["throughput"],
+        report["latency"]["p50"], report["latency"]["p95"], report["latency"]["p99"],
+    )
+    context.update(payment_ids=payment_ids, workload=workload, report=report)
+
+
+@when(parsers.parse("the receiver takes an extra {ms:d} ms per event"))
+def slow_receiver(ms, monkeypatch):
+    process = main._process_in_session
+
+    def slowed(*args):
+        time.sleep(ms / 1000)
+        return process(*args)
+
+    monkeypatch.setattr(main, "_process_in_session", slowed)
+
+
+@when(parsers.parse('I build a "{mix}" workload for {n:d} payments'))
+def build(mix, n, context):
+    context["payment_ids"] = [f"pay_{i:04d}" for i in range(n)]
+    context["workload"] = build_workload(context["payment_ids"], MIXES[mix], WEBHOOK_SECRET)
+
+
+@when(parsers.parse(
+    'I benchmark {n:d} payments with the "{mix}" mix from {clients:d} closed-loop clients'
+))
+def benchmark_closed(n, mix, clients, app, db_session, context):
+    _benchmark(app, db_session, context, n, mix, concurrency=clients)
+
+
+@when(parsers.parse(
+    'I benchmark {n:d} payments with the "{mix}" mix open-loop at {rate:d} requests '
+    'per second over "{target}"'
+))
+def benchmark_open(n, mix, rate, target, app, db_session, context):
+    _benchmark(app, db_session, context, n, mix, rate=rate, target=target)
+
+
+@when("I save the report as the baseline")
+def save_report(tmp_path, context):
+    context["baseline_path"] = tmp_path / "baseline.json"
+    save_baseline(context["baseline_path"], context["report"])
+    context["baseline"] = load_baseline(context["baseline_path"])
+
+
+@when(parsers.parse("the report gains {n:d} responses with status {status:d}"))
+def add_statuses(n, status, context):
+    report = json.loads(json.dumps(context["report"]))
+    report["statuses"][str(status)] = report["statuses"].get(str(status), 0) + n
+    context["report"] = report
+
+
+@then("every payment's lifecycle should be sent exactly once")
+def lifecycles_once(context):
+    sent = defaultdict(list)
+    for request in context["workload"]:
+        if request.kind == "event":
+            sent[request.payment_id].append(json.loads(request.body)["event_type"])
+    assert set(sent) == set(context["payment_ids"])
+    assert all(sorted(events) == sorted(PAYMENT_LIFECYCLE) for events in sent.values())
+
+
+@then(parsers.parse("the workload should contain {n:d} requests with invalid signatures"))
+def invalid_signatures(n, context):
+    assert Counter(r.kind for r in context["workload"])["invalid_signature"] == n
+
+
+@then(parsers.parse(
+    "the workload should redeliver every event of the {n:d} hot payments {times:d} times"
+))
+def hot_redeliveries(n, times, context):
+    copies = Counter(r.body for r in context["workload"] if r.kind == "duplicate")
+    for pid in context["payment_ids"][:n]:
+        bodies = [r.body for r in context["workload"] if r.kind == "event" and r.payment_id == pid]
+        # a hot event may also have been picked as an ordinary duplicate
+        assert all(copies[body] in (times, times + 1) for body in bodies), pid
+
+
+@then("some payments' lifecycles should be out of order")
+def some_out_of_order(context):
+    first = {}
+    for request in context["workload"]:
+        if request.kind == "event":
+            first.setdefault(request.payment_id, json.loads(request.body)["event_type"])
+    assert any(event_type != PAYMENT_LIFECYCLE[0] for event_type in first.values())
+
+
+@then(parsers.parse('every benchmarked payment should be "{status}"'))
+def benchmarked_payments(status, db_session, context):
+    db_session.expire_all()
+    statuses = db_session.scalars(
+        select(Payment.status).where(Payment.id.in_(context["payment_ids"]))
+    ).all()
+    assert len(statuses) == len(context["payment_ids"])
+    assert set(statuses) == {status}
+
+
+@then("no benchmark response should be a 5xx or a transport error")
+def no_server_errors(context):
+    statuses = context["report"]["statuses"]
+    assert not [s for s in statuses if s.startswith("5") or s == "None"], statuses
+
+
+@then("every request with an invalid signature should get 401")
+def invalid_get_401(context):
+    report = context["report"]
+    assert report["statuses"].get("401", 0) == report["kinds"].get("invalid_signature", 0)
+
+
+@then("the report should have ordered latency percentiles")
+def ordered_percentiles(context):
+    latency = context["report"]["latency"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    assert context["report"]["throughput"] > 0
+
+
+@then("the regression gate should pass")
+def gate_passes(context):
+    assert check_regression(context["report"], context["baseline"]) == []
+
+
+@then(parsers.parse('the regression gate should flag "{what}"'))
+def gate_flags(what, context):
+    problems = check_regression(context["report"], context["baseline"])
+    assert any(what in problem for problem in problems), problems
+
+
+@then("the saved baseline should equal the report")
+def baseline_round_trip(context):
+    assert context["baseline"] == context["report"]
@@ -0,0 +1,245 @@
+import json
+import logging
+from collections import Counter, defaultdict
+
+import httpx
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+from starlette.testclient import TestClient
+
+from app.cluster import create_router, routing_keys, worker_for
+from app.database import get_db
+from app.main import create_app
+from app.models import Payment
+from tests.fixtures.payloads import PAYMENT_LIFECYCLE, make_webhook_payload
+from tests.helpers.loadgen import scaling_benchmark
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL
+
+scenarios("cluster.feature")
+
+BATCH_URL = "/webhooks/yuno/batch"
+
+logger = logging.getLogger(__name__)
+
+
+class _RecordingTransport(httpx.ASGITransport):
+    """ASGI transport that notes the payments of every request it carries."""
+
+    def __init__(self, app, seen: list) -> None:
+        super().__init__(app=app)
+        self.seen = seen
+
+    async def handle_async_request(self, request):
+        self.seen.extend(routing_keys(request.content))
+        return await super().handle_async_request(request)
+
+
+class _RefusingTransport(httpx.AsyncBaseTransport):
+    async def handle_async_request(self, request):
+        raise httpx.ConnectError("Connection refused", request=request)
+
+
+def _worker(db_engine):
+    worker = create_app(webhook_secret=WEBHOOK_SECRET, db_engine=db_engine)
+    Session = sessionmaker(bind=db_engine, autocommit=False, autoflush=False)
+
+    def override_get_db():
+        with Session() as db:
+            yield db
+
+    worker.dependency_overrides[get_db] = override_get_db
+    return worker
+
+
+def _open_router(router, request, context):
+    client = TestClient(router)
+    context["router_client"] = client.__enter__()
+    request.addfinalizer(lambda: client.__exit__(None, None, None))
+
+
+def _post(router_client, payload, url=WEBHOOK_URL):
+    body = json.dumps(payload).encode()
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    return router_client.post(url, content=body, headers=headers)
+
+
+def _post_authorizing_batch(context, payment_ids):
+    events = [make_webhook_payload(event_type="payment.authorized", payment_id=pid) for pid in payment_ids]
+    context["response"] = _post(context["router_client"], {"events": events}, url=BATCH_URL)
+
+
+@given(parsers.parse("a router in front of {n:d} in-process workers"))
+def router_in_process(n, db_engine, request, context):
+    context["seen"] = [[] for _ in range(n)]
+    transports = [_RecordingTransport(_worker(db_engine), seen) for seen in context["seen"]]
+    router = create_router([f"http://worker-{i}" for i in range(n)], transports=transports)
+    _open_router(router, request, context)
+
+
+@given(parsers.parse("a router in front of {n:d} workers that refuse connections"))
+def router_refused(n, request, context):
+    router = create_router(
+        [f"http://worker-{i}" for i in range(n)],
+        transports=[_RefusingTransport() for _ in range(n)],
+    )
+    _open_router(router, request, context)
+
+
+@when(parsers.parse("I route {n:d} payment ids over {workers:d} workers twice"))
+def route_twice(n, workers, context):
+    pids = [f"pay_{i:05d}" for i in range(n)]
+    context["workers"] = workers
+    context["routings"] = [[worker_for(pid, workers) for pid in pids] for _ in range(2)]
+
+
+@when("I send every payment's lifecycle in reverse order through the router")
+def send_reversed(context):
+    for pid in context["bulk_payment_ids"]:
+        for event_type in reversed(PAYMENT_LIFECYCLE):
+            response = _post(
+                context["router_client"],
+                make_webhook_payload(event_type=event_type, payment_id=pid),
+            )
+            assert response.status_code in (200, 202), response.text
+
+
+@when("I send one batch authorizing the bulk payments owned by the first one's worker through the router")
+def send_batch_to_one_worker(context):
+    n = len(context["seen"])
+    owner = worker_for(context["bulk_payment_ids"][0], n)
+    context["batch_owner"] = owner
+    context["batch_payment_ids"] = [
+        pid for pid in context["bulk_payment_ids"] if worker_for(pid, n) == owner
+    ]
+    _post_authorizing_batch(context, context["batch_payment_ids"])
+
+
+@when("I send one batch authorizing every bulk payment through the router")
+def send_batch_to_all(context):
+    n = len(context["seen"])
+    assert len({worker_for(pid, n) for pid in context["bulk_payment_ids"]}) > 1
+    _post_authorizing_batch(context, context["bulk_payment_ids"])
+
+
+@when("I send a webhook without a payment_id through the router")
+def send_without_payment(context):
+    payload = make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")
+    del payload["data"]["payment_id"]
+    context["response"] = _post(context["router_client"], payload)
+
+
+@when(parsers.parse("I send a batch nested {depth:d} levels deep through the router"))
+def send_deeply_nested_batch(depth, context):
+    body = b"[" * depth + b"]" * depth
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    context["response"] = context["router_client"].post(BATCH_URL, content=body, headers=headers)
+
+
+@when(parsers.parse('I send a "{event_type}" webhook for payment "{pid}" through the router'))
+def send_through_router(event_type, pid, context):
+    context["response"] = _post(
+        context["router_client"], make_webhook_payload(event_type=event_type, payment_id=pid),
+    )
+
+
+@when(parsers.parse(
+    "I benchmark clusters of {first:d} and {second:d} worker processes with {n:d} payments"
+))
+def benchmark_clusters(first, second, n, tmp_path, context):
+    context["cluster_reports"] = scaling_benchmark([first, second], tmp_path, payments=n)
+    for report in context["cluster_reports"]:
+        logger.info(
+            "cluster of %d workers: %.0f req/s (x%.2f), p95 %.4fs",
+            report["workers"], report["throughput"], report["speedup"], report["latency"]["p95"],
+        )
+
+
+@then("both routings should be identical")
+def routings_identical(context):
+    first, second = context["routings"]
+    assert first == second
+
+
+@then(parsers.parse("every worker should own between {low:d}% and {high:d}% of the payments"))
+def balanced(low, high, context):
+    routing = context["routings"][0]
+    shares = Counter(routing)
+    assert set(shares) == set(range(context["workers"]))
+    for count in shares.values():
+        assert low / 100 <= count / len(routing) <= high / 100, shares
+
+
+@then(parsers.parse('every bulk payment should be "{status}"'))
+def bulk_status(status, db_session, context):
+    db_session.expire_all()
+    statuses = db_session.scalars(
+        select(Payment.status).where(Payment.id.in_(context["bulk_payment_ids"]))
+    ).all()
+    assert set(statuses) == {status}
+
+
+@then("each payment's events should have reached exactly one worker")
+def one_worker_per_payment(context):
+    workers_by_payment = defaultdict(set)
+    for index, seen in enumerate(context["seen"]):
+        for pid in seen:
+            workers_by_payment[pid].add(index)
+    assert set(workers_by_payment) == set(context["bulk_payment_ids"])
+    assert all(len(workers) == 1 for workers in workers_by_payment.values())
+    context["workers_by_payment"] = workers_by_payment
+
+
+@then("that worker should be the payment's owner")
+def owner(context):
+    n = len(context["seen"])
+    for pid, (index,) in context["workers_by_payment"].items():
+        assert index == worker_for(pid, n)
+
+
+@then(parsers.parse('those payments should be "{status}"'))
+def batch_payment_status(status, db_session, context):
+    statuses = db_session.scalars(
+        select(Payment.status).where(Payment.id.in_(context["batch_payment_ids"]))
+    ).all()
+    assert statuses == [status] * len(context["batch_payment_ids"])
+
+
+@then("only their worker should have received a request")
+def only_owner_reached(context):
+    reached = {index for index, seen in enumerate(context["seen"]) if seen}
+    assert reached == {context["batch_owner"]}
+
+
+@then("no worker should have received a request")
+def no_worker_reached(context):
+    assert context["seen"] == [[] for _ in context["seen"]]
+
+
+@then(parsers.parse("the router metrics should report {n:d} rejected batch"))
+def rejected_batches(n, context):
+    assert context["router_client"].get("/metrics").json()["cluster"]["rejected_batches"] == n
+
+
+@then(parsers.parse("the router metrics should report {n:d} routed events"))
+def routed_events(n, context):
+    cluster = context["router_client"].get("/metrics").json()["cluster"]
+    assert sum(cluster["routed"].values()) == n
+
+
+@then(parsers.parse("the router metrics should report {n:d} upstream error"))
+def upstream_errors(n, context):
+    assert context["router_client"].get("/metrics").json()["cluster"]["upstream_errors"] == n
+
+
+@then(parsers.parse('every cluster run should leave all its payments "{status}"'))
+def cluster_statuses(status, context):
+    for report in context["cluster_reports"]:
+        assert list(report["final_statuses"]) == [status], report["final_statuses"]
+
+
+@then("every cluster run should have no 5xx responses")
+def cluster_no_5xx(context):
+    for report in context["cluster_reports"]:
+        assert not [s for s in report["statuses"] if s.startswith("5") or s == "None"], report
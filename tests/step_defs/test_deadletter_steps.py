@@ -0,0 +1,214 @@
+import json
+import logging
+import threading
+import time
+
+import pytest
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy.orm import sessionmaker
+
+import app.deadletter as deadletter
+import app.main as main
+from app.database import EngineConfig, create_db_engine
+from app.deadletter import DeadLetterError, DeadLetterJournal, dead_letter_record, read_journal, redrive
+from app.models import Base, Payment
+from tests.fixtures.payloads import make_payment_record, make_webhook_payload
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL
+
+scenarios("deadletter.feature")
+
+logger = logging.getLogger(__name__)
+
+_process_in_session = main._process_in_session
+
+
+@given("the receiver dead-letters events to a journal")
+def receiver_journal(tmp_path, app_options, context):
+    context["journal"] = tmp_path / "dead-letter.jsonl"
+    app_options["dead_letter_path"] = str(context["journal"])
+
+
+@given("the journal disk fails every fsync")
+def failing_fsync(monkeypatch):
+    def fail(fd):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(deadletter.os, "fsync", fail)
+
+
+@given("a dead-letter journal whose fsync takes 5 ms")
+def slow_journal(tmp_path, monkeypatch, context):
+    real_fsync = deadletter.os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.005)
+        real_fsync(fd)
+
+    monkeypatch.setattr(deadletter.os, "fsync", slow_fsync)
+    context["journal"] = tmp_path / "dead-letter.jsonl"
+    context["dead_letters"] = DeadLetterJournal(context["journal"])
+    context["dead_letters"].open()
+
+
+@given("a dead-letter journal whose disk fills up halfway through the first write")
+def filling_journal(tmp_path, monkeypatch, context):
+    context["journal"] = tmp_path / "dead-letter.jsonl"
+    journal = context["dead_letters"] = DeadLetterJournal(context["journal"])
+    journal.open()
+    real_write = deadletter.os.write
+    writes = []
+
+    def write(fd, data):
+        if fd != journal._fd:
+            return real_write(fd, data)
+        writes.append(len(data))
+        if len(writes) == 1:
+            return real_write(fd, data[:len(data) // 2])
+        if len(writes) == 2:
+            raise OSError("No space left on device")
+        return real_write(fd, data)
+
+    monkeypatch.setattr(deadletter.os, "write", write)
+
+
+@given(parsers.parse(
+    'a journal of {n:d} "{event_type}" events for {m:d} payments in a file-backed database'
+))
+def large_journal(n, event_type, m, tmp_path, context):
+    engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp_path / 'redrive.db'}"))
+    Base.metadata.create_all(engine)
+    context["file_engine"] = engine
+    pids = [f"pay_{i:05d}" for i in range(m)]
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(Payment(**make_payment_record(payment_id=pid)) for pid in pids)
+        db.commit()
+    context["journal"] = tmp_path / "dead-letter.jsonl"
+    with open(context["journal"], "w") as f:
+        for i in range(n):
+            pid = pids[i % m]
+            payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+            record = dead_letter_record(
+                payload["webhook_id"], event_type, pid, json.dumps(payload), "database is locked",
+            )
+            f.write(json.dumps(record) + "\n")
+
+
+@when("the database recovers")
+def database_recovers(monkeypatch):
+    monkeypatch.setattr(main, "_process_in_session", _process_in_session)
+
+
+@when("Yuno redelivers the first dead-lettered webhook")
+def redeliver_first(client, context):
+    (record, _), *_ = read_journal(context["journal"])
+    body = record["payload"].encode()
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    context["response"] = client.post(WEBHOOK_URL, content=body, headers=headers)
+    assert context["response"].status_code == 200
+
+
+@when("half of another record is appended to the journal")
+def partial_record(context):
+    with open(context["journal"], "ab") as f:
+        f.write(b'{"webhook_id":"wh_partial","event_type":"payment.auth')
+
+
+@when("I re-drive the journal")
+def redrive_journal(db_engine, context):
+    context["redrive"] = redrive(context["journal"], sessionmaker(bind=db_engine))
+
+
+@when("I re-drive the journal into the file-backed database")
+def redrive_file_backed(context):
+    engine = context["file_engine"]
+    try:
+        context["redrive"] = redrive(context["journal"], sessionmaker(bind=engine))
+    finally:
+        engine.dispose()
+    logger.info(
+        "re-drive: %d events in %.3fs (%.0f events/s)",
+        context["redrive"]["replayed"], context["redrive"]["seconds"],
+        context["redrive"]["events_per_sec"],
+    )
+
+
+@when("the receiver is restarted")
+def restart_receiver(client):
+    client.__exit__(None, None, None)
+    client.__enter__()
+
+
+@when("an append fails and the next one succeeds")
+def failed_then_successful_append(context):
+    journal = context["dead_letters"]
+    with pytest.raises(DeadLetterError):
+        journal.append(dead_letter_record("wh_1", "payment.authorized", "pay_001", "{}", "locked"))
+    journal.append(dead_letter_record("wh_2", "payment.authorized", "pay_001", "{}", "locked"))
+    journal.close()
+
+
+@when(parsers.parse("{n:d} threads append to the journal at once"))
+def concurrent_appends(n, context):
+    journal = context["dead_letters"]
+    start = threading.Barrier(n)
+
+    def append(i):
+        start.wait()
+        journal.append(dead_letter_record(f"wh_{i}", "payment.authorized", "pay_001", "{}", "locked"))
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+
+@then(parsers.parse('the response should be marked "{status}"'))
+def response_marked(status, context):
+    assert context["response"].json()["status"] == status
+
+
+@then(parsers.parse('the journal should hold {n:d} event for payment "{pid}"'))
+def journal_holds(n, pid, context):
+    records = [record for record, _ in read_journal(context["journal"])]
+    assert len(records) == n
+    assert {r["payment_id"] for r in records} == {pid}
+    assert all(json.loads(r["payload"])["webhook_id"] == r["webhook_id"] for r in records)
+
+
+@then(parsers.parse("the receiver should have counted {n:d} exhausted retry"))
+def exhausted_counted(n, app):
+    assert app.state.metrics.outcome_count("retry_exhausted") == n
+    assert app.state.metrics.counter("dead_lettered_total") == n
+
+
+@then(parsers.parse("the journal file should hold {n:d} complete lines"))
+def complete_lines(n, context):
+    assert len(read_journal(context["journal"])) == n
+    assert context["dead_letters"].stats()["appended"] == n
+
+
+@then(parsers.parse("the journal should have issued fewer than {n:d} fsyncs"))
+def few_fsyncs(n, context):
+    stats = context["dead_letters"].stats()
+    assert stats["fsyncs"] < n, stats
+
+
+@then(parsers.parse('the re-drive should report outcomes "{expected}"'))
+def redrive_outcomes(expected, context):
+    wanted = {
+        name: int(count) for name, count in (item.split("=") for item in expected.split(", "))
+    }
+    assert context["redrive"]["outcomes"] == wanted
+
+
+@then(parsers.parse("the re-drive should have replayed {n:d} events"))
+def redrive_count(n, context):
+    assert context["redrive"]["replayed"] == n
+
+
+@then(parsers.parse("the re-drive should replay at least {rate:d} events per second"))
+def redrive_rate(rate, context):
+    assert context["redrive"]["events_per_sec"] >= rate, context["redrive"]
@@ -0,0 +1,182 @@
+import dataclasses
+import json
+from datetime import datetime, timedelta, timezone
+
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event, func, select
+
+from app.batch import BatchEvent
+from app.models import WebhookEvent
+from app.payloads import payload_columns
+from app.scheduler import DeferredConfig, StubReconciler
+from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, _post_webhook
+
+scenarios("deferred.feature")
+
+BATCH_URL = "/webhooks/yuno/batch"
+_UNITS = {"minutes": timedelta(minutes=1), "hours": timedelta(hours=1)}
+
+
+@given(parsers.parse("the receiver tracks deferred events with a TTL of {hours:d} hours"))
+def receiver_tracks_deferred(hours, app_options):
+    # interval: scenarios run the scheduler themselves
+    app_options["deferred"] = DeferredConfig(ttl=timedelta(hours=hours), interval=3600)
+
+
+def _with_reconciler(app_options, context, events):
+    context["reconciler"] = StubReconciler(events)
+    app_options["deferred"] = dataclasses.replace(
+        app_options["deferred"], reconcile=context["reconciler"],
+    )
+
+
+@given(parsers.parse('the reconciler knows "{event_type}" for payment "{pid}"'))
+def reconciler_knows(event_type, pid, app_options, context):
+    payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+    _with_reconciler(app_options, context, {pid: [
+        BatchEvent(payload["webhook_id"], event_type, pid, json.dumps(payload)),
+    ]})
+
+
+@given("the reconciler knows nothing")
+def reconciler_knows_nothing(app_options, context):
+    _with_reconciler(app_options, context, {})
+
+
+@given(parsers.parse(
+    '{n:d} "{status}" "{event_type}" events for payment "{pid}" are already stored'
+))
+def stored_events(n, status, event_type, pid, db_session):
+    for _ in range(n):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+        db_session.add(WebhookEvent(
+            webhook_id=payload["webhook_id"], payment_id=pid, event_type=event_type,
+            processing_status=status, received_at=datetime.now(timezone.utc),
+            **payload_columns(json.dumps(payload), "text"),
+        ))
+    db_session.commit()
+
+
+@when("the receiver starts")
+def receiver_starts(client):
+    pass
+
+
+@when(parsers.parse('I send webhook "{wid}" of type "{event_type}" for payment "{pid}"'))
+def send_webhook_with_id(wid, event_type, pid, client, context):
+    payload = make_webhook_payload(event_type=event_type, payment_id=pid, webhook_id=wid)
+    context["response"] = _post_webhook(client, payload)
+
+
+@when(parsers.parse('I send a batch of "{event_types}" for payment "{pid}"'))
+def send_batch(event_types, pid, client, context):
+    events = [
+        make_webhook_payload(event_type=event_type.strip(), payment_id=pid)
+        for event_type in event_types.split(",")
+    ]
+    body = json.dumps({"events": events}).encode()
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    context["response"] = client.post(BATCH_URL, content=body, headers=headers)
+    assert context["response"].status_code == 200, context["response"].text
+
+
+@when(parsers.parse("the deferred scheduler runs {n:d} {unit} from now"))
+def scheduler_runs(n, unit, app, client):
+    app.state.deferred_scheduler.run_once(now=datetime.now(timezone.utc) + n * _UNITS[unit])
+
+
+@when(parsers.parse("deferred events received {ages} hours ago are indexed in that order"))
+def index_out_of_order(ages, app, context):
+    now = datetime.now(timezone.utc)
+    hours = [int(age) for age in ages.replace(" and ", ", ").split(",")]
+    for row_id, age in enumerate(hours, start=1):
+        app.state.deferred_index.add(row_id, "pay_001", "payment.captured", now - timedelta(hours=age))
+    context["indexed_at"] = now
+
+
+@when("I scrape the metrics counting queries on the events table")
+def scrape_counting(client, db_engine, context):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    try:
+        context["gauges"] = client.get("/metrics").json()["gauges"]
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+    context["statements"] = statements
+
+
+@then(parsers.parse("the deferred index should hold {n:d} events for {payments:d} payment"))
+@then(parsers.parse("the deferred index should hold {n:d} events for {payments:d} payments"))
+def index_holds(n, payments, app):
+    stats = app.state.deferred_index.stats()
+    assert (stats["events"], stats["payments"]) == (n, payments), stats
+
+
+@then(parsers.parse(
+    "the deferred index should find {n:d} events older than {hours:d} hours, oldest first"
+))
+def index_older_than(n, hours, app, context):
+    older = app.state.deferred_index.older_than(context["indexed_at"] - timedelta(hours=hours))
+    assert len(older) == n, older
+    assert [entry.received_at for entry in older] == sorted(entry.received_at for entry in older)
+
+
+@then(parsers.parse("the deferred index should report its oldest event as {hours:d} hours old"))
+def index_oldest(hours, app, context):
+    stats = app.state.deferred_index.stats(now=context["indexed_at"])
+    assert stats["oldest_age_seconds"] == hours * 3600, stats
+
+
+@then(parsers.parse('the deferred index should count {n:d} event waiting for "{state}"'))
+def index_waiting_for(n, state, app):
+    assert app.state.deferred_index.stats()["waiting_for"].get(state) == n
+
+
+@then(parsers.parse('{n:d} event should be "{status}"'))
+def events_with_status(n, status, db_session):
+    count = db_session.scalar(
+        select(func.count()).where(WebhookEvent.processing_status == status)
+    )
+    assert count == n
+
+
+@then(parsers.parse("the deferred metrics should report {n:d} stale event"))
+def stale_metric(n, client):
+    assert client.get("/metrics").json()["deferred"]["stale"] == n
+
+
+@then(parsers.parse("the deferred metrics should report {n:d} reconciled event"))
+def reconciled_metric(n, client):
+    assert client.get("/metrics").json()["deferred"]["reconciled_events"] == n
+
+
+@then(parsers.parse('the reconciler should have been asked about "{pid}" waiting for "{state}"'))
+def reconciler_asked(pid, state, context):
+    assert context["reconciler"].calls == [(pid, state)]
+
+
+@then(parsers.parse("the reconciler should have been called {n:d} time"))
+def reconciler_calls(n, context):
+    assert len(context["reconciler"].calls) == n
+
+
+@then("the response should be marked idempotent")
+def response_idempotent(context):
+    assert context["response"].json().get("idempotent") is True
+
+
+@then(parsers.parse("the deferred gauges should report {n:d} event"))
+def deferred_gauges(n, context):
+    assert context["gauges"]["deferred_events"] == n
+    assert context["gauges"]["deferred_oldest_age_seconds"] >= 0
+
+
+@then("no query should have read the events table")
+def no_events_query(context):
+    assert not [s for s in context["statements"] if "webhook_events" in s], context["statements"]
@@ -0,0 +1,264 @@
+import json
+import logging
+import threading
+import time
+
+import pytest
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event, select
+from sqlalchemy.exc import OperationalError
+
+from app import main
+from app.groupcommit import GroupCommitConfig, GroupCommitWriter
+from app.main import create_app
+from app.models import Payment
+from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.concurrency import send_timed_requests
+from tests.helpers.loadgen import group_commit_benchmark
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL, _post_webhook
+
+scenarios("groupcommit.feature")
+
+logger = logging.getLogger(__name__)
+
+
+@given(parsers.parse("the receiver group-commits webhooks within {ms:d} ms"))
+def receiver_group_commits(ms, app_options):
+    app_options["group_commit"] = GroupCommitConfig(window=ms / 1000)
+
+
+@given("group commits are held back")
+def held_group_commits(monkeypatch, context):
+    gate = threading.Event()
+    flush = main._process_batch_in_session
+
+    def held(app, events):
+        gate.wait(10)
+        return flush(app, events)
+
+    monkeypatch.setattr(main, "_process_batch_in_session", held)
+    context["gate"] = gate
+
+
+@given("the threads that flush groups are recorded")
+def recorded_flush_threads(monkeypatch, context):
+    flush = main._process_batch_in_session
+    context["flush_threads"] = []
+
+    def recorded(app, events):
+        context["flush_threads"].append(threading.current_thread().name)
+        return flush(app, events)
+
+    monkeypatch.setattr(main, "_process_batch_in_session", recorded)
+
+
+@given("a group-commit writer whose first flush is held back")
+def held_writer(request, context):
+    gate = threading.Event()
+    context["gate"] = gate
+
+    def flush(items):
+        gate.wait(10)
+        return list(items)
+
+    writer = GroupCommitWriter(GroupCommitConfig(window=0), flush=flush)
+    writer.start()
+    request.addfinalizer(gate.set)
+    context["writer"] = writer
+
+
+@given("transactions of more than one event fail")
+def multi_event_groups_fail(monkeypatch):
+    flush = main._process_batch_in_session
+
+    def fail_groups(app, events):
+        if len(events) > 1:
+            raise OperationalError("INSERT INTO webhook_events", {}, Exception("disk I/O error"))
+        return flush(app, events)
+
+    monkeypatch.setattr(main, "_process_batch_in_session", fail_groups)
+
+
+@when(parsers.parse("I send {n:d} concurrent authorization webhooks and count commits"))
+def send_concurrent(n, client, db_engine, context):
+    requests = []
+    for pid in context["bulk_payment_ids"][:n]:
+        payload = make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+        body = json.dumps(payload).encode()
+        requests.append((body, signed_headers(secret=WEBHOOK_SECRET, body=body)))
+    commits = []
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(db_engine, "commit", on_commit)
+    try:
+        context["responses"], _ = send_timed_requests(client, WEBHOOK_URL, requests, concurrency=n)
+    finally:
+        event.remove(db_engine, "commit", on_commit)
+    context["commits"] = len(commits)
+
+
+@when(parsers.parse(
+    'I send a "{event_type}" webhook for payment "{pid}" in the background'
+))
+def send_in_background(event_type, pid, client, context):
+    payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+
+    def send():
+        context["response"] = _post_webhook(client, payload)
+
+    context["sender"] = threading.Thread(target=send)
+    context["sender"].start()
+
+
+@when("the held group commits")
+def release_group(context):
+    context["gate"].set()
+    if "sender" in context:
+        context["sender"].join(10)
+
+
+@when(parsers.parse("{n:d} events are submitted to the writer"))
+def submit_to_writer(n, context):
+    writer = context["writer"]
+    context["futures"] = [writer.submit("first")]
+    while writer.stats()["pending"]:  # wait until the writer holds the first group
+        time.sleep(0.001)
+    context["futures"] += [writer.submit(f"event-{i}") for i in range(1, n)]
+
+
+@when(parsers.parse("the writer is stopped with a {ms:d} ms timeout"))
+def stop_writer(ms, context):
+    context["writer"].stop(timeout=ms / 1000)
+
+
+@when(parsers.parse('I send webhook "{wid}" of type "{event_type}" for payment "{pid}"'))
+def send_webhook_with_id(wid, event_type, pid, client, context):
+    payload = make_webhook_payload(event_type=event_type, payment_id=pid, webhook_id=wid)
+    context["response"] = _post_webhook(client, payload)
+
+
+@when(parsers.parse('I benchmark group-commit windows of "{windows}" with {n:d} payments'))
+def benchmark_windows(windows, n, tmp_path, context):
+    parsed = [None if w.strip() == "off" else float(w) for w in windows.split(",")]
+    context["window_reports"] = group_commit_benchmark(parsed, tmp_path, payments=n)
+    for report in context["window_reports"]:
+        logger.info(
+            "window %s: %.0f req/s, %.0f commits/s (%.1f events/commit), p50 %.4fs, p99 %.4fs",
+            report["window"], report["throughput"], report["commits_per_sec"],
+            report["events_per_commit"], report["latency"]["p50"], report["latency"]["p99"],
+        )
+
+
+@then(parsers.parse('every response should be {code:d} "{status}"'))
+def every_response(code, status, context):
+    for response in context["responses"]:
+        assert response.status_code == code, response.text
+        assert response.json()["status"] == status
+
+
+@then(parsers.parse('every bulk payment should be "{status}"'))
+def bulk_status(status, db_session, context):
+    db_session.expire_all()
+    statuses = db_session.scalars(
+        select(Payment.status).where(Payment.id.in_(context["bulk_payment_ids"]))
+    ).all()
+    assert set(statuses) == {status}
+
+
+@then("there should have been fewer commits than webhooks")
+def fewer_commits(context):
+    assert context["commits"] < len(context["responses"])
+
+
+@then(parsers.parse(
+    "the group commit metrics should report {n:d} events in fewer than {groups:d} groups"
+))
+def group_metrics(n, groups, client):
+    stats = client.get("/metrics").json()["group_commit"]
+    assert stats["events"] == n
+    assert stats["groups"] < groups
+    assert stats["max_group"] > 1
+
+
+@then("the group commit metrics should report a fallback")
+def group_fallback(client):
+    assert client.get("/metrics").json()["group_commit"]["fallbacks"] >= 1
+
+
+@then("every group should have been flushed on a database lane thread")
+def flushed_in_db_lane(context):
+    assert context["flush_threads"]
+    assert all(name.startswith("webhook-db") for name in context["flush_threads"]), context["flush_threads"]
+
+
+@then(parsers.parse("{n:d} submitted events should have failed"))
+def failed_submissions(n, context):
+    failed = [f for f in context["futures"] if f.done() and f.exception() is not None]
+    assert len(failed) == n
+    assert all(isinstance(f.exception(), RuntimeError) for f in failed)
+
+
+@then("the first submitted event should have been flushed")
+def first_flushed(context):
+    assert context["futures"][0].result(timeout=10) == "first"
+
+
+@then("the webhook should still be waiting")
+def still_waiting(context):
+    time.sleep(0.2)
+    assert context["sender"].is_alive()
+    assert "response" not in context
+
+
+@then(parsers.parse('the background webhook should get {code:d} "{status}"'))
+def background_response(code, status, context):
+    assert not context["sender"].is_alive()
+    assert context["response"].status_code == code
+    assert context["response"].json()["status"] == status
+
+
+@then(parsers.parse('the response should be {code:d} "{status}" for "{wid}"'))
+def response_for(code, status, wid, context):
+    response = context["response"]
+    assert response.status_code == code, response.text
+    assert response.json()["status"] == status
+    assert response.json()["webhook_id"] == wid
+
+
+@then("the response should be marked idempotent")
+def response_idempotent(context):
+    assert context["response"].json().get("idempotent") is True
+
+
+@then(parsers.parse('the metrics should count outcome "{outcome}" once'))
+def outcome_once(outcome, app):
+    assert app.state.metrics.outcome_count(outcome) == 1
+
+
+@then("creating a queued receiver with group commit should be rejected")
+def queued_rejected():
+    with pytest.raises(ValueError, match="group_commit"):
+        create_app(ingest_mode="queued", group_commit=GroupCommitConfig())
+
+
+@then(parsers.parse('every window run should leave all its payments "{status}"'))
+def window_statuses(status, context):
+    for report in context["window_reports"]:
+        assert list(report["final_statuses"]) == [status], report["final_statuses"]
+
+
+@then("every window run should have only 200 responses")
+def window_200s(context):
+    for report in context["window_reports"]:
+        assert list(report["statuses"]) == ["200"], report["statuses"]
+
+
+@then("every group-commit window should need fewer commits than one per event")
+def fewer_commits_per_window(context):
+    baseline, *grouped = context["window_reports"]
+    assert baseline["events_per_commit"] <= 1.0
+    for report in grouped:
+        assert report["commits"] < baseline["commits"], report
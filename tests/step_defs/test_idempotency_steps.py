@@ -1,6 +1,7 @@
 import json
 
 from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event
 
 from app.models import WebhookEvent
 from tests.fixtures.payloads import make_webhook_payload
@@ -115,3 +116,60 @@ def retry_send(wid, client, context):
 def check_idempotent_flag(context):
     body = context["response"].json()
     assert body.get("idempotent") is True, f"Expected idempotent=true in body: {body}"
+
+
+@given(parsers.parse("the idempotency cache holds at most {n:d} entry"))
+def small_idempotency_cache(n, app_options):
+    app_options["idempotency_cache_size"] = n
+
+
+@given("the idempotency cache uses a Bloom filter")
+def bloom_idempotency_cache(app_options):
+    app_options["idempotency_bloom"] = True
+
+
+@when(parsers.parse('I resend webhook "{wid}" while counting database statements'))
+def resend_counting(wid, client, context, db_engine):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        statements.append(statement)
+
+    payload = make_webhook_payload(
+        event_type="payment.authorized",
+        payment_id="pay_001",
+        webhook_id=wid,
+    )
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    try:
+        context["response"] = _post_webhook(client, payload)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+    context["statements"] = statements
+
+
+@then("no database statements should have been executed")
+def no_statements(context):
+    assert context["statements"] == [], context["statements"]
+
+
+def _cache_stats(client) -> dict:
+    return client.get("/metrics").json()["idempotency_cache"]
+
+
+@then(parsers.parse("the idempotency cache should report {n:d} hit"))
+def check_cache_hits(n, client):
+    stats = _cache_stats(client)
+    assert stats["hits"] == n, stats
+
+
+@then(parsers.parse("the idempotency cache should report at least {n:d} eviction"))
+def check_cache_evictions(n, client):
+    stats = _cache_stats(client)
+    assert stats["evictions"] >= n, stats
+
+
+@then(parsers.parse("the idempotency cache should report at least {n:d} Bloom filter negative"))
+def check_bloom_negatives(n, client):
+    stats = _cache_stats(client)
+    assert stats["bloom_negatives"] >= n, stats
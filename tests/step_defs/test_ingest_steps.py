@@ -0,0 +1,125 @@
+import json
+
+from pytest_bdd import given, parsers, scenarios, then, when
+
+import app.ingest as ingest
+import app.main as main
+from app.models import IngestOutbox, Payment
+from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.concurrency import send_timed_requests
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL, _post_webhook
+
+scenarios("ingest.feature")
+
+QUEUE_URL = "/webhooks/yuno/queue"
+
+
+@given(parsers.parse("the receiver runs in queued ingest mode with {n:d} workers"))
+def queued_ingest_mode(n, app_options):
+    app_options["ingest_mode"] = "queued"
+    app_options["ingest_workers"] = n
+
+
+@given(parsers.parse('processing always fails for payment "{pid}"'))
+def poisoned_payment(pid, monkeypatch):
+    process = main._process_in_session
+
+    def fail_for_pid(app, webhook_id, event_type, payment_id, body_str):
+        if payment_id == pid:
+            raise RuntimeError(f"cannot process {payment_id}")
+        return process(app, webhook_id, event_type, payment_id, body_str)
+
+    monkeypatch.setattr(main, "_process_in_session", fail_for_pid)
+    monkeypatch.setattr(ingest, "FAILURE_BACKOFF", 0)
+
+
+@given(parsers.parse('processing always fails for "{failing}" events of payment "{pid}"'))
+def poisoned_event(failing, pid, monkeypatch):
+    process = main._process_in_session
+
+    def fail_for_event(app, webhook_id, event_type, payment_id, body_str):
+        if payment_id == pid and event_type == failing:
+            raise RuntimeError(f"cannot process {event_type} for {payment_id}")
+        return process(app, webhook_id, event_type, payment_id, body_str)
+
+    monkeypatch.setattr(main, "_process_in_session", fail_for_event)
+    monkeypatch.setattr(ingest, "FAILURE_BACKOFF", 0)
+
+
+@then(parsers.parse('the response body status should be "{status}"'))
+def check_body_status(status, context):
+    body = context["response"].json()
+    assert body.get("status") == status, f"Expected status={status!r}: {body}"
+
+
+@when("the ingest queue has drained")
+def wait_for_drain(app, client):
+    assert app.state.ingest_queue.wait_until_drained(timeout=10.0), (
+        f"Queue did not drain: {client.get(QUEUE_URL).json()}"
+    )
+
+
+@when(parsers.parse('I send the lifecycle "{events}" for payment "{pid}"'))
+def send_lifecycle(events, pid, client, context):
+    for event_type in events.split(","):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+        response = _post_webhook(client, payload)
+        assert response.status_code == 202, response.text
+        context.setdefault("responses", []).append(response)
+
+
+@when(parsers.parse("I send {n:d} concurrent authorization webhooks for different payments"))
+def send_concurrent_authorizations(n, client, context):
+    requests = []
+    for pid in context["bulk_payment_ids"][:n]:
+        payload = make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+        body = json.dumps(payload).encode()
+        requests.append((body, signed_headers(secret=WEBHOOK_SECRET, body=body)))
+    responses, _ = send_timed_requests(client, WEBHOOK_URL, requests, concurrency=8)
+    context["responses"] = responses
+
+
+@then(parsers.parse('all {n:d} payments should be in "{status}" status'))
+def check_bulk_status(n, status, context, db_session):
+    db_session.expire_all()
+    for pid in context["bulk_payment_ids"][:n]:
+        payment = db_session.get(Payment, pid)
+        assert payment.status == status, f"Payment {pid} has status {payment.status!r}"
+
+
+@then(parsers.parse(
+    'the ingest queue should report {accepted:d} "accepted" and {deferred:d} "deferred" outcomes'
+))
+def check_outcomes(accepted, deferred, client):
+    outcomes = client.get(QUEUE_URL).json()["outcomes"]
+    assert outcomes.get("accepted", 0) == accepted, outcomes
+    assert outcomes.get("deferred", 0) == deferred, outcomes
+
+
+@then(parsers.parse("the ingest queue depth should be {n:d}"))
+def check_depth(n, client):
+    stats = client.get(QUEUE_URL).json()
+    assert stats["depth"] == n, stats
+
+
+@then("the ingest queue should report a non-negative oldest lag")
+def check_lag(client):
+    stats = client.get(QUEUE_URL).json()
+    assert stats["oldest_lag_seconds"] >= 0, stats
+
+
+@then(parsers.parse("the ingest queue should report {n:d} parked event after {k:d} attempts"))
+def check_parked(n, k, client, db_session):
+    stats = client.get(QUEUE_URL).json()
+    assert stats["parked"] == n, stats
+    assert stats["outcomes"]["parked"] == n, stats
+    assert [row.attempts for row in db_session.query(IngestOutbox)] == [k] * n
+
+
+@then(parsers.parse("the ingest queue should report {parked:d} parked and {held:d} held event"))
+def check_parked_and_held(parked, held, client, db_session):
+    stats = client.get(QUEUE_URL).json()
+    assert (stats["parked"], stats["held"]) == (parked, held), stats
+    assert stats["depth"] == 0, stats
+    assert db_session.query(IngestOutbox).count() == parked + held
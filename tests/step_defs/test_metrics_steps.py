@@ -0,0 +1,147 @@
+import json
+import re
+import time
+
+from pytest_bdd import given, parsers, scenarios, then, when
+
+from app.metrics import Metrics
+from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.signing import signed_headers
+from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL, _post_webhook
+
+scenarios("metrics.feature")
+
+BATCH_URL = "/webhooks/yuno/batch"
+
+# name{labels} value -- the sample line grammar of the Prometheus text format
+_SAMPLE = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"'
+    r'(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? (-?[0-9.e+-]+|[+-]Inf|NaN)$'
+)
+_TYPE = re.compile(r"^# TYPE [a-zA-Z_:][a-zA-Z0-9_:]* (counter|gauge|histogram|summary)$")
+
+
+@given("the receiver runs without instrumentation")
+def without_instrumentation(app_options):
+    app_options["instrumentation"] = False
+
+
+@when("I resend the last webhook")
+def resend_last(client, context):
+    body = context["response"].request.content
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    context["response"] = client.post(WEBHOOK_URL, content=body, headers=headers)
+
+
+@when("I send a webhook with an invalid signature")
+def send_badly_signed(client, context):
+    payload = make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")
+    context["response"] = _post_webhook(client, payload, headers={"X-Yuno-Signature": "0" * 64})
+
+
+def _post_batch_body(client, body: bytes):
+    headers = {**signed_headers(secret=WEBHOOK_SECRET, body=body), "Content-Type": "application/json"}
+    return client.post(BATCH_URL, content=body, headers=headers)
+
+
+@when(parsers.parse('I send a batch whose body is "{body}"'))
+def send_raw_batch(body, client, context):
+    context["response"] = _post_batch_body(client, body.encode())
+    assert context["response"].status_code == 400, context["response"].text
+
+
+@when(parsers.parse("I send a batch of {n:d} events"))
+def send_large_batch(n, client, context):
+    events = [make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")] * n
+    context["response"] = _post_batch_body(client, json.dumps({"events": events}).encode())
+    assert context["response"].json()["error"].startswith("Batch exceeds"), context["response"].text
+
+
+@when(parsers.parse('I scrape the metrics with "{query}"'))
+def scrape_with_query(query, client, context):
+    context["scrape"] = client.get(f"/metrics{query}")
+
+
+@when(parsers.parse('I scrape the metrics accepting "{accept}"'))
+def scrape_accepting(accept, client, context):
+    context["scrape"] = client.get("/metrics", headers={"Accept": accept})
+
+
+@when(parsers.parse(
+    "I time {n:d} events' worth of instrumentation calls with instrumentation off"
+))
+def time_disabled_calls(n, context):
+    metrics = Metrics(enabled=False)
+    started = time.perf_counter()
+    for _ in range(n):
+        # what one accepted webhook does: 3 clock reads, 9 stages, 1 outcome
+        lap = metrics.clock()
+        for stage in ("idempotency_claim", "payment_load", "transition", "replay",
+                      "transition", "commit", "parse", "total"):
+            lap = metrics.lap(stage, lap)
+        metrics.clock()
+        metrics.clock()
+        metrics.observe_histogram("db_attempts", 1)
+        metrics.outcome("accepted")
+    context["per_event_seconds"] = (time.perf_counter() - started) / n
+
+
+@then(parsers.parse('the metrics should have timed {n:d} "{stages}" stage'))
+def stages_timed(n, stages, client):
+    timed = client.get("/metrics").json()["stages"]
+    for stage in stages.split(", "):
+        assert timed.get(stage, {}).get("count") == n, (stage, timed.get(stage))
+        assert timed[stage]["buckets"]["+Inf"] == n
+
+
+@then(parsers.parse("the metrics should report {n:d} DB attempt histogram observation"))
+def attempts_histogram(n, client):
+    histogram = client.get("/metrics").json()["histograms"]["db_attempts"]
+    assert histogram["count"] == n
+
+
+@then(parsers.parse('the metrics should report outcomes "{expected}"'))
+def outcomes(expected, client):
+    wanted = {
+        name: float(count)
+        for name, count in (item.split("=") for item in expected.split(", "))
+    }
+    assert client.get("/metrics").json()["outcomes"] == wanted
+
+
+@then(parsers.parse("the metrics should report {n:d} deferred events"))
+def deferred_gauges(n, client):
+    gauges = client.get("/metrics").json()["gauges"]
+    assert gauges["deferred_events"] == n
+    assert gauges["deferred_oldest_age_seconds"] >= 0
+    if n == 0:
+        assert gauges["deferred_oldest_age_seconds"] == 0
+
+
+@then("the scrape should be valid Prometheus text")
+def valid_prometheus(context):
+    response = context["scrape"]
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for line in response.text.splitlines():
+        assert _TYPE.match(line) or _SAMPLE.match(line), line
+
+
+@then(parsers.parse("the scrape should contain '{line}'"))
+@then(parsers.parse('the scrape should contain "{line}"'))
+def scrape_contains(line, context):
+    assert line in context["scrape"].text.splitlines()
+
+
+@then("the metrics should have no stage timings or outcomes")
+def no_instrumentation(client):
+    snapshot = client.get("/metrics").json()
+    assert snapshot["stages"] == {}
+    assert snapshot["outcomes"] == {}
+    assert snapshot["gauges"] == {}
+    assert snapshot["summaries"]["db_attempts_per_event"]["count"] == 1
+
+
+@then(parsers.parse("each event should spend under {micros:d} microseconds in instrumentation"))
+def disabled_overhead(micros, context):
+    assert context["per_event_seconds"] < micros / 1e6, context["per_event_seconds"]
@@ -1,8 +1,15 @@
+import asyncio
+import hashlib
+import hmac
 import json
+import time
+import tracemalloc
 
 from pytest_bdd import parsers, scenarios, then, when
 
+from app.signature import SIGNATURE_HEADER, TIMESTAMP_HEADER
 from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.asgi import send_chunked_async
 from tests.helpers.signing import signed_headers
 from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL, _post_webhook
 
@@ -109,6 +116,17 @@ def send_deeply_nested(client, context):
     context["response"] = response
 
 
+@when(parsers.parse(
+    "I send an otherwise valid webhook carrying {depth:d} levels of nested JSON text"
+))
+def send_nested_text(depth, client, context):
+    # Built as text: json.dumps itself would hit the recursion limit
+    payload = json.dumps(make_webhook_payload(event_type="payment.authorized", payment_id="pay_001"))
+    body = (payload[:-1] + ', "nested": ' + '{"child": ' * depth + "1" + "}" * depth + "}").encode()
+    headers = signed_headers(secret=WEBHOOK_SECRET, body=body)
+    context["response"] = _post_raw(client, body, headers)
+
+
 @when(parsers.parse('I send a request with a "{body_description}" as the body'))
 def send_invalid_body(body_description, client, context):
     ts = __import__("time").time()
@@ -159,3 +177,60 @@ def send_nonexistent_payment(client, context):
     )
     response = _post_webhook(client, payload)
     context["response"] = response
+
+
+_UPLOAD_CHUNK = 64 * 1024
+
+
+def _upload_chunks(total: int):
+    # Generated lazily so the test itself never holds a whole upload
+    for _ in range(total // _UPLOAD_CHUNK):
+        yield b"x" * _UPLOAD_CHUNK
+
+
+def _signed_upload_headers(total: int) -> dict[str, str]:
+    timestamp = int(time.time())
+    mac = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.".encode(), hashlib.sha256)
+    for chunk in _upload_chunks(total):
+        mac.update(chunk)
+    return {SIGNATURE_HEADER: mac.hexdigest(), TIMESTAMP_HEADER: str(timestamp)}
+
+
+@when(parsers.parse(
+    "{n:d} clients concurrently upload signed {mb:d} megabyte bodies {declared}"
+))
+def concurrent_oversized_uploads(n, mb, declared, app, context):
+    total = mb * 1024 * 1024
+    headers = _signed_upload_headers(total)
+    if declared == "declaring their Content-Length":
+        headers["Content-Length"] = str(total)
+
+    async def upload_all():
+        return await asyncio.gather(*(
+            send_chunked_async(app, WEBHOOK_URL, headers, _upload_chunks(total))
+            for _ in range(n)
+        ))
+
+    tracemalloc.start()
+    try:
+        results = asyncio.run(upload_all())
+        context["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    context["uploads"] = results
+
+
+@then(parsers.parse("every upload should be rejected with {code:d}"))
+def check_uploads_rejected(code, context):
+    assert [status for status, _, _ in context["uploads"]] == [code] * len(context["uploads"])
+
+
+@then("no upload body chunk should have been read")
+def check_no_chunks_read(context):
+    assert [pulled for _, _, pulled in context["uploads"]] == [0] * len(context["uploads"])
+
+
+@then(parsers.parse("peak memory during the uploads should stay under {mb:d} MB"))
+def check_peak_memory(mb, context):
+    peak = context["peak_memory"]
+    assert peak < mb * 1024 * 1024, f"Peak traced memory {peak / 2**20:.1f} MB"
@@ -1,6 +1,8 @@
 from pytest_bdd import parsers, scenarios, then, when
+from sqlalchemy import event
 
-from app.models import WebhookEvent
+from app.models import Payment, WebhookEvent
+from app.state_machine import fold
 from tests.fixtures.payloads import make_webhook_payload
 from tests.step_defs.common_steps import _post_webhook
 
@@ -43,3 +45,60 @@ def send_reversed_lifecycle(client, context, db_session):
 def check_200_or_202(context):
     sc = context["response"].status_code
     assert sc in (200, 202), f"Expected 200 or 202, got {sc}: {context['response'].text}"
+
+
+@when(parsers.parse(
+    'I send "{events}" for payment "{pid}" while counting payment reads'
+))
+def send_counting_payment_reads(events, pid, client, context, db_engine):
+    reads = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM payments" in statement:
+            reads.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    try:
+        for event_type in events.split(","):
+            payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+            context["response"] = _post_webhook(client, payload)
+            assert context["response"].status_code == 200, context["response"].text
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+    context["payment_reads"] = reads
+
+
+@then(parsers.parse("the payments table should have been read {n:d} time"))
+def check_payment_reads(n, context):
+    assert len(context["payment_reads"]) == n, context["payment_reads"]
+
+
+@when(parsers.parse('the payment "{pid}" is moved to "{status}" outside the receiver'))
+def move_payment_externally(pid, status, db_session):
+    db_session.get(Payment, pid).status = status
+    db_session.commit()
+
+
+@then(parsers.parse(
+    "the metrics should report {n:d} payment compare-and-set conflict without DB retries"
+))
+def check_cas_conflicts(n, client):
+    counters = client.get("/metrics").json()["counters"]
+    assert counters.get("payment_cas_conflicts_total", 0) == n, counters
+    assert counters.get("db_retries_total", 0) == 0, counters
+
+
+@when(parsers.parse('I fold the events "{events}" starting from "{initial_status}"'))
+def fold_events(events, initial_status, context):
+    context["fold"] = fold(initial_status, events.split(","))
+
+
+@then(parsers.parse('the folded status should be "{expected}"'))
+def check_folded_status(expected, context):
+    assert context["fold"].status == expected, context["fold"]
+
+
+@then(parsers.parse('the folded results should be "{expected}"'))
+def check_folded_results(expected, context):
+    names = [r.name for r in context["fold"].results]
+    assert names == expected.split(","), names
@@ -1,11 +1,24 @@
 import json
+import logging
+import queue
+import random
 import time
 import threading
 
 import pytest
-from pytest_bdd import scenarios, then, when
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event, func
+from sqlalchemy.orm import sessionmaker
 
+from app.database import EngineConfig, create_db_engine
+from app.main import _parse_webhook, _process_event
+from app.metrics import Metrics
+from app.models import Base, Payment, WebhookEvent
+from app.payment_cache import PaymentStatusCache
+from app.schemas import WebhookPayload
+from app.state_machine import fold
 from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.concurrency import send_timed_requests
 from tests.helpers.signing import signed_headers
 from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL, _post_webhook
 
@@ -13,6 +26,18 @@ scenarios("performance.feature")
 
 pytestmark = pytest.mark.slow
 
+logger = logging.getLogger(__name__)
+
+
+def _p95(times: list[float]) -> float:
+    times = sorted(times)
+    return times[min(int(len(times) * 0.95), len(times) - 1)]
+
+
+@given(parsers.parse('the receiver runs in "{mode}" execution mode'))
+def receiver_execution_mode(mode, app_options):
+    app_options["execution_mode"] = mode
+
 
 @when("I send 100 concurrent authorization webhooks for different payments")
 def send_100_concurrent(client, context):
@@ -58,15 +83,15 @@ def check_no_5xx(context):
         assert resp.status_code < 500, f"Got 5xx: {resp.status_code}"
 
 
-@then('all 100 payments should be in "authorized" status')
-def check_100_authorized(context, db_session):
+@then(parsers.parse('all {n:d} payments should be in "{status}" status'))
+def check_100_authorized(n, status, context, db_session):
     db_session.expire_all()
-    from app.models import Payment
     payment_ids = context["bulk_payment_ids"]
+    assert len(payment_ids) == n
     for pid in payment_ids:
         p = db_session.get(Payment, pid)
         assert p is not None
-        assert p.status == "authorized", f"Payment {pid} has status {p.status!r}"
+        assert p.status == status, f"Payment {pid} has status {p.status!r}"
 
 
 @when("I send 20 sequential authorization webhooks and measure response times")
@@ -86,9 +111,347 @@ def send_20_sequential_timed(client, context):
     context["response"] = responses[-1]
 
 
+@when(parsers.parse(
+    "I send {n:d} authorization webhooks with {concurrency:d} concurrent clients "
+    "and measure response times"
+))
+def send_n_with_concurrency(n, concurrency, client, app, context):
+    requests = []
+    for pid in context["bulk_payment_ids"][:n]:
+        payload = make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+        body = json.dumps(payload).encode()
+        requests.append((body, signed_headers(secret=WEBHOOK_SECRET, body=body)))
+
+    responses, times = send_timed_requests(client, WEBHOOK_URL, requests, concurrency)
+    context["responses"] = responses
+    context["response_times"] = times
+    context["response"] = responses[-1]
+    logger.info(
+        "execution_mode=%s concurrency=%d p95=%.1fms",
+        app.state.execution_mode, concurrency, _p95(times) * 1000,
+    )
+
+
 @then("the P95 response time should be under 2 seconds")
 def check_p95(context):
-    times = sorted(context["response_times"])
-    p95_idx = int(len(times) * 0.95)
-    p95 = times[min(p95_idx, len(times) - 1)]
+    p95 = _p95(context["response_times"])
     assert p95 < 2.0, f"P95 response time {p95:.3f}s exceeds 2s"
+
+
+@given(parsers.parse("the receiver runs with {n:d} DB workers"))
+def receiver_db_workers(n, app_options):
+    app_options["db_workers"] = n
+
+
+@when(parsers.parse(
+    'I send {n:d} concurrent "{event_type}" webhooks with distinct ids for payment "{pid}"'
+))
+def send_hot_payment(n, event_type, pid, client, context):
+    requests = []
+    for _ in range(n):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+        body = json.dumps(payload).encode()
+        requests.append((body, signed_headers(secret=WEBHOOK_SECRET, body=body)))
+    responses, _ = send_timed_requests(client, WEBHOOK_URL, requests, concurrency=n)
+    context["responses"] = responses
+    context["response"] = responses[-1]
+
+
+@then("the metrics should report payment lock contention")
+def check_lock_contention(client):
+    snapshot = client.get("/metrics").json()
+    assert snapshot["counters"].get("payment_lock_contended_total", 0) > 0, snapshot
+    assert snapshot["summaries"]["payment_lock_wait_seconds"]["count"] > 0, snapshot
+
+
+@then(parsers.parse("the metrics should report {n:d} DB retries"))
+def check_db_retries(n, client):
+    snapshot = client.get("/metrics").json()
+    assert snapshot["counters"].get("db_retries_total", 0) == n, snapshot
+
+
+_LIFECYCLE = [
+    "payment.authorized",
+    "payment.captured",
+    "payment.settled",
+    "payment.chargeback",
+]
+
+
+@when("I send the 4-event lifecycle in reverse order for every payment and measure throughput")
+def send_reverse_lifecycles(client, context, db_engine):
+    deferred_loads = []
+
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def count_deferred_loads(conn, cursor, statement, parameters, ctx, executemany):
+        if "FROM webhook_events" in statement and "processing_status = " in statement:
+            deferred_loads.append(statement)
+
+    responses = []
+    start = time.monotonic()
+    try:
+        for pid in context["bulk_payment_ids"]:
+            for event_type in reversed(_LIFECYCLE):
+                payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+                responses.append(_post_webhook(client, payload))
+    finally:
+        event.remove(db_engine, "before_cursor_execute", count_deferred_loads)
+    elapsed = time.monotonic() - start
+
+    context["responses"] = responses
+    context["response"] = responses[-1]
+    context["deferred_loads"] = len(deferred_loads)
+    logger.info(
+        "reverse-order replay: %d events in %.2fs (%.0f events/s)",
+        len(responses), elapsed, len(responses) / elapsed,
+    )
+
+
+@then("the deferred events should have been loaded once per payment")
+def check_single_pass(context):
+    n = len(context["bulk_payment_ids"])
+    assert context["deferred_loads"] == n, (
+        f"Expected {n} deferred-set loads, got {context['deferred_loads']}"
+    )
+
+
+@given(parsers.parse("a backlog of {n:d} payment lifecycles in shuffled order"))
+def shuffled_backlog(n, context):
+    rng = random.Random(42)
+    backlog = {}
+    for i in range(n):
+        events = list(_LIFECYCLE)
+        rng.shuffle(events)
+        backlog[f"pay_{i}"] = events
+    context["backlog"] = backlog
+
+
+@when("I fold every payment's events with the compiled state machine")
+def fold_backlog(context):
+    start = time.monotonic()
+    context["folded"] = {
+        pid: fold("pending", events) for pid, events in context["backlog"].items()
+    }
+    context["fold_seconds"] = time.monotonic() - start
+    n_events = sum(len(events) for events in context["backlog"].values())
+    logger.info(
+        "folded %d events in %.3fs (%.0f events/s)",
+        n_events, context["fold_seconds"], n_events / context["fold_seconds"],
+    )
+
+
+@then(parsers.parse('every payment in the backlog should fold to "{status}"'))
+def check_backlog_status(status, context):
+    for pid, result in context["folded"].items():
+        assert result.status == status, f"{pid}: {result}"
+
+
+@then(parsers.parse("the backlog should have been folded in under {seconds:d} seconds"))
+def check_fold_time(seconds, context):
+    assert context["fold_seconds"] < seconds, f"Fold took {context['fold_seconds']:.2f}s"
+
+
+_REFUND_LIFECYCLE = [
+    "payment.authorized",
+    "payment.captured",
+    "payment.settled",
+    "payment.refunded",
+]
+
+
+_ENGINE_PROFILES = {
+    # SQLite defaults: rollback journal, synchronous=FULL, no mmap, 2 MB cache
+    "baseline": dict(journal_mode=None, synchronous=None, mmap_size=None, cache_size_kib=None),
+    "tuned": {},
+    "small-pool": dict(pool_size=2, max_overflow=0),
+}
+
+
+@given(parsers.parse(
+    'a file-backed database using the "{profile}" engine profile '
+    'with {n:d} payments in "{status}" status'
+))
+def file_backed_database_profile(profile, n, status, tmp_path, context):
+    # Real connections per thread (not one shared in-memory cache) so that
+    # concurrent workers contend on the database the way separate processes do.
+    engine = create_db_engine(EngineConfig(
+        url=f"sqlite:///{tmp_path / 'stress.db'}", **_ENGINE_PROFILES[profile],
+    ))
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    payment_ids = [f"pay_stress_{i}" for i in range(n)]
+    with SessionLocal() as db:
+        db.add_all(
+            Payment(id=pid, merchant_id="merchant_test", amount=10000,
+                    currency="USD", status=status)
+            for pid in payment_ids
+        )
+        db.commit()
+    context["stress_profile"] = profile
+    context["stress_engine"] = engine
+    context["stress_sessions"] = SessionLocal
+    context["bulk_payment_ids"] = payment_ids
+    yield
+    engine.dispose()
+
+
+@when(parsers.parse(
+    "{workers:d} workers with independent payment caches process every payment's "
+    "refund lifecycle in shuffled order"
+))
+def hammer_same_payments(workers, context):
+    SessionLocal = context["stress_sessions"]
+    rng = random.Random(7)
+    events = [
+        (f"wh_{pid}_{event_type}", event_type, pid)
+        for pid in context["bulk_payment_ids"]
+        for event_type in _REFUND_LIFECYCLE
+    ]
+    rng.shuffle(events)
+    pending = queue.SimpleQueue()
+    for item in events:
+        pending.put(item)
+    metrics = Metrics()
+    statuses = []
+
+    def worker():
+        # Each worker stands in for a separate process: its cache goes stale
+        # whenever another worker writes one of its payments.
+        cache = PaymentStatusCache()
+        while True:
+            try:
+                webhook_id, event_type, pid = pending.get_nowait()
+            except queue.Empty:
+                return
+            while True:
+                with SessionLocal() as db:
+                    try:
+                        response = _process_event(
+                            db, webhook_id, event_type, pid, "{}",
+                            payment_cache=cache, metrics=metrics,
+                        )
+                        break
+                    except Exception:  # noqa: BLE001
+                        db.rollback()
+                        metrics.inc("db_retries_total")
+            statuses.append(response.status_code)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+    context["stress_seconds"] = time.monotonic() - start
+    context["stress_metrics"] = metrics
+    context["stress_statuses"] = statuses
+    pool = context["stress_engine"].pool_stats.stats()
+    logger.info(
+        "stress [%s]: %d events, %d workers in %.2fs (%.0f events/s), %d CAS conflicts, "
+        "outcomes %s, max checkout wait %.1fms, max connections %d",
+        context["stress_profile"], len(events), workers, context["stress_seconds"],
+        len(events) / context["stress_seconds"],
+        metrics.counter("payment_cas_conflicts_total"),
+        {code: statuses.count(code) for code in sorted(set(statuses))},
+        pool["checkout_wait_seconds"]["max"] * 1000, pool["max_checked_out"],
+    )
+    assert len(statuses) == len(events)
+
+
+@then(parsers.parse('every payment in the file-backed database should be "{status}"'))
+def check_stress_status(status, context):
+    with context["stress_sessions"]() as db:
+        for pid in context["bulk_payment_ids"]:
+            assert db.get(Payment, pid).status == status, pid
+
+
+@then("every stress event should be processed, deferred behind the refund, or rejected")
+def check_stress_events(context):
+    statuses = context["stress_statuses"]
+    assert all(code in (200, 202, 422) for code in statuses), statuses
+    with context["stress_sessions"]() as db:
+        rows = dict(
+            db.query(WebhookEvent.processing_status, func.count(WebhookEvent.id))
+            .group_by(WebhookEvent.processing_status)
+            .all()
+        )
+        # A settlement that loses the race to the refund can never apply
+        stranded = {
+            event_type for (event_type,) in db.query(WebhookEvent.event_type)
+            .filter(WebhookEvent.processing_status == "deferred")
+        }
+    assert set(rows) <= {"processed", "deferred"}, rows
+    assert stranded <= {"payment.settled"}, stranded
+    assert sum(rows.values()) + statuses.count(422) == len(statuses), rows
+
+
+@then(parsers.parse("the workers should have needed {n:d} DB retries"))
+def check_stress_retries(n, context):
+    assert context["stress_metrics"].counter("db_retries_total") == n
+
+
+@then(parsers.parse("the stress run should have finished in under {seconds:d} seconds"))
+def check_stress_time(seconds, context):
+    assert context["stress_seconds"] < seconds, f"Took {context['stress_seconds']:.2f}s"
+
+
+@then(parsers.parse("at most {n:d} connections should have been checked out at once"))
+def check_pool_bound(n, context):
+    pool = context["stress_engine"].pool_stats.stats()
+    assert pool["checkouts"] >= len(context["stress_statuses"]), pool
+    assert pool["checkout_wait_seconds"]["count"] == pool["checkouts"], pool
+    assert 0 < pool["max_checked_out"] <= n, pool
+    assert pool["timeouts"] == 0, pool
+
+
+def _two_step_parse(body: bytes) -> WebhookPayload:
+    """The receiver's former pipeline: json.loads, dict check, model(**raw), re-decode."""
+    raw = json.loads(body)
+    assert isinstance(raw, dict)
+    payload = WebhookPayload(**raw)
+    body.decode("utf-8", errors="replace")
+    return payload
+
+
+def _single_pass_parse(body: bytes) -> WebhookPayload:
+    return _parse_webhook(body.decode("utf-8"))
+
+
+@given(parsers.parse("{n:d} distinct webhook bodies"))
+def distinct_bodies(n, context):
+    context["bodies"] = [
+        json.dumps(make_webhook_payload(
+            event_type=_LIFECYCLE[i % len(_LIFECYCLE)], payment_id=f"pay_{i}",
+        )).encode()
+        for i in range(n)
+    ]
+
+
+@when("I time the two-step and the single-pass parse of every body")
+def time_parsers(context):
+    bodies = context["bodies"]
+    timings = {}
+    for parse in (_two_step_parse, _single_pass_parse):
+        best = float("inf")
+        for _ in range(3):  # best of 3 to damp scheduler noise
+            start = time.perf_counter()
+            parsed = [parse(body) for body in bodies]
+            best = min(best, time.perf_counter() - start)
+        timings[parse.__name__] = best / len(bodies)
+        context[parse.__name__] = parsed
+    context["parse_seconds"] = timings
+    logger.info(
+        "parse+validate per request: two-step %.1fus, single-pass %.1fus",
+        timings["_two_step_parse"] * 1e6, timings["_single_pass_parse"] * 1e6,
+    )
+
+
+@then("every body should parse to the same payload both ways")
+def check_same_payloads(context):
+    assert context["_two_step_parse"] == context["_single_pass_parse"]
+
+
+@then("the single-pass parse should be faster per request than the two-step parse")
+def check_parse_speedup(context):
+    timings = context["parse_seconds"]
+    assert timings["_single_pass_parse"] < timings["_two_step_parse"], timings
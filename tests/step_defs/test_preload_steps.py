@@ -0,0 +1,158 @@
+import csv
+import json
+
+import pytest
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event
+
+from app import preload
+from app.models import Payment
+from app.preload import PaymentImportError, read_payments, upsert_payments
+from tests.fixtures.payloads import make_payment_record, make_webhook_payload
+from tests.step_defs.common_steps import _post_webhook
+
+scenarios("preload.feature")
+
+
+def _records(n, amount=10000):
+    return [make_payment_record(payment_id=f"pay_csv_{i:04d}", amount=amount) for i in range(n)]
+
+
+def _write_csv(path, records):
+    with open(path, "w", newline="", encoding="utf-8") as stream:
+        writer = csv.DictWriter(stream, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def _preload(path, fmt, db_session, chunk_size=None):
+    options = {"chunk_size": chunk_size} if chunk_size else {}
+    with open(path, newline="", encoding="utf-8") as stream:
+        return upsert_payments(db_session, read_payments(stream, fmt), **options)
+
+
+@given("the database does not support upserts")
+def no_upserts(monkeypatch):
+    monkeypatch.setattr(preload, "_INSERTS", {})
+
+
+@given(parsers.parse("a CSV file with {n:d} payments"))
+def csv_file(n, tmp_path, context):
+    context["file"] = (tmp_path / "payments.csv", "csv")
+    _write_csv(context["file"][0], _records(n))
+
+
+@given(parsers.parse('a CSV file with {n:d} payments where line {line:d} has amount "{amount}"'))
+def csv_file_with_bad_row(n, line, amount, tmp_path, context):
+    records = _records(n)
+    records[line - 2]["amount"] = amount  # line 1 is the header
+    context["file"] = (tmp_path / "payments.csv", "csv")
+    _write_csv(context["file"][0], records)
+
+
+@given(parsers.parse("a JSONL file with {n:d} payments"))
+def jsonl_file(n, tmp_path, context):
+    context["file"] = (tmp_path / "payments.jsonl", "jsonl")
+    context["file"][0].write_text("".join(json.dumps(r) + "\n" for r in _records(n)))
+
+
+@given(parsers.parse("a JSONL file with {n:d} payments where line {line:d} has amount {amount}"))
+def jsonl_file_with_bad_row(n, line, amount, tmp_path, context):
+    records = _records(n)
+    records[line - 1]["amount"] = json.loads(amount)
+    context["file"] = (tmp_path / "payments.jsonl", "jsonl")
+    context["file"][0].write_text("".join(json.dumps(r) + "\n" for r in records))
+
+
+@when("I preload the file")
+def preload_file(db_session, context):
+    context["preload"] = _preload(*context["file"], db_session)
+
+
+@when(parsers.parse("I preload the file in chunks of {size:d}"))
+def preload_file_in_chunks(size, db_session, context):
+    context["preload"] = _preload(*context["file"], db_session, chunk_size=size)
+
+
+@when(parsers.parse("I preload a CSV file with {n:d} payments of amount {amount:d}"))
+def preload_csv_with_amount(n, amount, tmp_path, db_session, context):
+    _write_csv(tmp_path / "payments.csv", _records(n, amount=amount))
+    context["preload"] = _preload(tmp_path / "payments.csv", "csv", db_session)
+
+
+@when("I note when every payment was last updated")
+def note_updated_at(db_session, context):
+    db_session.expire_all()
+    context["updated_at"] = {p.id: p.updated_at for p in db_session.query(Payment)}
+
+
+@when("I try to preload the file")
+def try_preload(db_session, context):
+    with pytest.raises(PaymentImportError) as excinfo:
+        _preload(*context["file"], db_session)
+    context["error"] = str(excinfo.value)
+
+
+@when(parsers.parse(
+    'I send a "{event_type}" webhook for payment "{pid}" while counting database statements'
+))
+def send_counting(event_type, pid, client, context, db_engine):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    try:
+        context["response"] = _post_webhook(
+            client, make_webhook_payload(event_type=event_type, payment_id=pid),
+        )
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+    context["statements"] = statements
+
+
+@then(parsers.parse("{n:d} payments should have been written in {chunks:d} chunk"))
+@then(parsers.parse("{n:d} payments should have been written in {chunks:d} chunks"))
+def written(n, chunks, db_session, context):
+    assert context["preload"]["rows"] == n
+    assert context["preload"]["chunks"] == chunks
+    assert db_session.query(Payment).count() == n
+
+
+@then("the preload should report its rate in rows per second")
+def preload_rate(context):
+    assert context["preload"]["rows_per_sec"] > 0, context["preload"]
+
+
+@then(parsers.parse('the payment "{pid}" amount should be {amount:d}'))
+def payment_amount(pid, amount, db_session):
+    db_session.expire_all()
+    assert db_session.get(Payment, pid).amount == amount
+
+
+@then(parsers.parse('the preload should fail mentioning "{text}"'))
+def preload_failed(text, context):
+    assert text in context["error"], context["error"]
+
+
+@then("no statement should have written to the database")
+def nothing_written(context):
+    writes = [
+        s for s in context["statements"]
+        if s.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE"))
+    ]
+    assert writes == [], writes
+
+
+@then("no payment should have been updated since")
+def none_updated(db_session, context):
+    db_session.expire_all()
+    assert {p.id: p.updated_at for p in db_session.query(Payment)} == context["updated_at"]
+
+
+@then("every payment should have been updated since")
+def all_updated(db_session, context):
+    db_session.expire_all()
+    for payment in db_session.query(Payment):
+        assert payment.updated_at != context["updated_at"][payment.id], payment.id
@@ -0,0 +1,218 @@
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.orm import sessionmaker
+
+from app import projection
+from app.archive import Archiver, RetentionConfig
+from app.database import EngineConfig, create_db_engine
+from app.models import Base, Payment, PaymentSnapshot, WebhookEvent
+from app.projection import (
+    SnapshotConfig, ensure_initial_status_column, rebuild, take_snapshots, verify,
+)
+from tests.fixtures.payloads import PAYMENT_LIFECYCLE, make_payment_record, make_webhook_payload
+from tests.step_defs.common_steps import _post_webhook
+
+scenarios("projection.feature")
+
+logger = logging.getLogger(__name__)
+
+
+def _session(db_engine):
+    return sessionmaker(bind=db_engine, autocommit=False, autoflush=False)()
+
+
+@given("the receiver snapshots payments")
+def receiver_snapshots(app_options):
+    app_options["snapshots"] = SnapshotConfig(interval=3600)  # scenarios run it themselves
+
+
+@given(parsers.parse('the log of "{pid}" holds "{entries}"'))
+def stored_log(pid, entries, db_session):
+    now = datetime.now(timezone.utc)
+    for entry in entries.split(","):
+        event_type, status = entry.strip().split(":")
+        db_session.add(WebhookEvent(
+            webhook_id=make_webhook_payload(event_type=event_type, payment_id=pid)["webhook_id"],
+            payment_id=pid, event_type=event_type, processing_status=status, received_at=now,
+        ))
+    db_session.commit()
+
+
+@given(parsers.parse(
+    "{n:d} payments with a full lifecycle of {k:d} events each are stored"
+))
+def stored_lifecycles(n, k, db_engine):
+    # Statuses are left "pending" so that the rebuild has to write every payment
+    now = datetime.now(timezone.utc)
+    payment_ids = [f"pay_log_{i:06d}" for i in range(n)]
+    with db_engine.begin() as conn:
+        conn.execute(insert(Payment), [make_payment_record(payment_id=pid) for pid in payment_ids])
+        conn.execute(insert(WebhookEvent), [
+            {
+                "webhook_id": f"evt_{pid}_{index}", "payment_id": pid, "event_type": event_type,
+                "processing_status": "processed", "received_at": now,
+            }
+            for pid in payment_ids
+            for index, event_type in enumerate(PAYMENT_LIFECYCLE[:k])
+        ])
+
+
+@given("the database does not support upserts")
+def no_upserts(monkeypatch):
+    monkeypatch.setattr(projection, "_INSERTS", {})
+
+
+@given(parsers.parse(
+    'a database without the initial status column where "{quiet}" is "{status}" and "{busy}" has events'
+))
+def legacy_payments(quiet, status, busy, tmp_path, context):
+    engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp_path / 'legacy.db'}"))
+    Base.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE payments DROP COLUMN initial_status"))
+        for pid, stored in ((quiet, status), (busy, "authorized")):
+            conn.execute(text(
+                "INSERT INTO payments (id, merchant_id, amount, currency, status, version) "
+                "VALUES (:id, 'merchant_test', 10000, 'USD', :status, 1)"
+            ), {"id": pid, "status": stored})
+        conn.execute(insert(WebhookEvent), [{
+            "webhook_id": "evt_legacy", "payment_id": busy, "event_type": "payment.authorized",
+            "processing_status": "processed", "received_at": now,
+        }])
+    context["legacy_engine"] = engine
+
+
+@when("I send every bulk payment's lifecycle in a shuffled order")
+def send_shuffled(client, context):
+    rng = random.Random(7)
+    sends = [
+        (pid, event_type)
+        for pid in context["bulk_payment_ids"] for event_type in PAYMENT_LIFECYCLE
+    ]
+    rng.shuffle(sends)
+    for pid, event_type in sends:
+        response = _post_webhook(client, make_webhook_payload(event_type=event_type, payment_id=pid))
+        assert response.status_code in (200, 202), response.text
+
+
+@when(parsers.parse('I send "{event_type}" for every bulk payment'))
+def send_to_every_bulk_payment(event_type, client, context):
+    for pid in context["bulk_payment_ids"]:
+        _post_webhook(client, make_webhook_payload(event_type=event_type, payment_id=pid))
+
+
+@when(parsers.parse('I send "{event_type}" for the first bulk payment'))
+def send_to_first_bulk_payment(event_type, client, context):
+    pid = context["bulk_payment_ids"][0]
+    _post_webhook(client, make_webhook_payload(event_type=event_type, payment_id=pid))
+
+
+@when(parsers.parse('the stored status of "{pid}" is overwritten with "{status}"'))
+def overwrite_status(pid, status, db_session):
+    db_session.execute(update(Payment).where(Payment.id == pid).values(status=status))
+    db_session.commit()
+
+
+@when("I rebuild the projection")
+def rebuild_projection(db_engine, context):
+    with _session(db_engine) as db:
+        context["rebuild"] = rebuild(db)
+    logger.info("rebuild: %s", context["rebuild"])
+
+
+@when("the processed events are archived")
+def events_archived(tmp_path, db_engine):
+    archiver = Archiver(
+        RetentionConfig(archive_dir=str(tmp_path / "archive"), horizon=timedelta(0), pause=0),
+        session_scope=sessionmaker(bind=db_engine),
+    )
+    assert archiver.run_once(now=datetime.now(timezone.utc) + timedelta(seconds=1)) > 0
+
+
+@when("I ensure the initial status column exists")
+def ensure_column(context):
+    assert ensure_initial_status_column(context["legacy_engine"]) is True
+
+
+@when("I take snapshots")
+def snapshots_taken(db_engine, context):
+    with _session(db_engine) as db:
+        context["snapshots"] = take_snapshots(db)
+
+
+@when("the snapshotter runs")
+def snapshotter_runs(app, client):
+    app.state.snapshotter.run_once()
+
+
+@then(parsers.parse("verifying the projection should find {n:d} difference"))
+@then(parsers.parse("verifying the projection should find {n:d} differences"))
+def verified(n, db_engine):
+    with _session(db_engine) as db:
+        drift = verify(db)
+    assert len(drift) == n, drift
+
+
+@then(parsers.parse("the rebuild should have changed {n:d} payment"))
+@then(parsers.parse("the rebuild should have changed {n:d} payments"))
+def rebuild_changed(n, context):
+    assert context["rebuild"]["changed"] == n, context["rebuild"]
+
+
+@then(parsers.parse("the rebuild should have skipped {n:d} payment"))
+@then(parsers.parse("the rebuild should have skipped {n:d} payments"))
+def rebuild_skipped(n, context):
+    assert context["rebuild"]["skipped"] == n, context["rebuild"]
+
+
+@then(parsers.parse('the initial status of "{pid}" should be "{status}"'))
+def initial_status(pid, status, context):
+    with _session(context["legacy_engine"]) as db:
+        assert db.get(Payment, pid).initial_status == status
+
+
+@then(parsers.parse('the initial status of "{pid}" should be unknown'))
+def initial_status_unknown(pid, context):
+    with _session(context["legacy_engine"]) as db:
+        assert db.get(Payment, pid).initial_status is None
+
+
+@then(parsers.parse("a rebuild of that database should skip {n:d} payment"))
+def legacy_rebuild(n, context):
+    with _session(context["legacy_engine"]) as db:
+        assert rebuild(db)["skipped"] == n
+
+
+@then(parsers.parse("the rebuild should have folded {n:d} event"))
+@then(parsers.parse("the rebuild should have folded {n:d} events"))
+def rebuild_folded(n, context):
+    assert context["rebuild"]["events"] == n, context["rebuild"]
+
+
+@then(parsers.parse("the rebuild should have processed at least {n:d} events per second"))
+def rebuild_rate(n, context):
+    assert context["rebuild"]["events_per_sec"] >= n, context["rebuild"]
+
+
+@then(parsers.parse("{n:d} snapshot should have been written"))
+@then(parsers.parse("{n:d} snapshots should have been written"))
+def snapshots_written(n, context):
+    assert context["snapshots"] == n
+
+
+@then(parsers.parse("the first bulk payment's snapshot should be \"{status}\""))
+def first_snapshot(status, db_session, context):
+    snapshot = db_session.scalar(
+        select(PaymentSnapshot).where(PaymentSnapshot.payment_id == context["bulk_payment_ids"][0])
+    )
+    assert snapshot.status == status
+
+
+@then(parsers.parse("the snapshot metrics should report {n:d} snapshot"))
+def snapshot_metrics(n, client):
+    assert client.get("/metrics").json()["snapshots"]["snapshots"] == n
@@ -0,0 +1,231 @@
+import dataclasses
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.archive import ArchiveProbe, Archiver, RetentionConfig, drop_redundant_indexes, read_archive
+from app.batch import BatchEvent, process_events
+from app.models import ArchivedWebhook, WebhookEvent
+from app.payloads import payload_columns
+from tests.fixtures.payloads import make_webhook_payload
+from tests.step_defs.common_steps import _post_webhook
+
+scenarios("retention.feature")
+
+
+@given(parsers.parse(
+    "the receiver archives processed events older than {days:d} days in batches of {size:d}"
+))
+def receiver_retention(days, size, tmp_path, app_options, context):
+    context["archive_dir"] = tmp_path / "archive"
+    app_options["retention"] = RetentionConfig(
+        archive_dir=str(context["archive_dir"]),
+        horizon=timedelta(days=days),
+        batch_size=size,
+        pause=0,
+        interval=3600,  # scenarios run the archiver themselves
+    )
+
+
+def _store_events(db_session, context, n, status, pid, days, mode="text"):
+    received_at = datetime.now(timezone.utc) - timedelta(days=days)
+    event_type = "payment.captured" if status == "deferred" else "payment.authorized"
+    for _ in range(n):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+        body = json.dumps(payload)
+        db_session.add(WebhookEvent(
+            webhook_id=payload["webhook_id"], payment_id=pid,
+            event_type=payload["event_type"], processing_status=status,
+            received_at=received_at,
+            processed_at=received_at if status == "processed" else None,
+            **payload_columns(body, mode),
+        ))
+        if status == "processed" and days > 7:
+            context.setdefault("archivable", []).append((payload["webhook_id"], body))
+    db_session.commit()
+
+
+@given(parsers.parse(
+    '{n:d} "{status}" events for payment "{pid}" received {days:d} days ago'
+))
+def stored_events(n, status, pid, days, db_session, context):
+    _store_events(db_session, context, n, status, pid, days)
+
+
+@given(parsers.parse(
+    '{n:d} "{status}" events stored as "{mode}" for payment "{pid}" received {days:d} days ago'
+))
+def stored_events_in_mode(n, status, mode, pid, days, db_session, context):
+    _store_events(db_session, context, n, status, pid, days, mode)
+
+
+@given("the receiver itself does not archive")
+def receiver_does_not_archive(app_options, context):
+    context["retention"] = app_options.pop("retention")
+
+
+@given(parsers.parse("the receiver re-checks for archived events every {ms:d} ms"))
+def probe_recheck(ms, app):
+    app.state.archive_probe = ArchiveProbe(archiving=False, recheck=ms / 1000)
+
+
+@given(parsers.parse('the legacy index "{name}" exists on "{column}"'))
+def legacy_index(name, column, db_engine):
+    with db_engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX {name} ON webhook_events ({column})"))
+
+
+@when("the archiver runs")
+def archiver_runs(app, context):
+    context["archived"] = app.state.archiver.run_once()
+
+
+@when(parsers.parse("the archiver runs {days:d} days from now"))
+def archiver_runs_later(days, app):
+    app.state.archiver.run_once(now=datetime.now(timezone.utc) + timedelta(days=days))
+
+
+@when("another process archives the events")
+def archived_elsewhere(db_engine, context):
+    archiver = Archiver(
+        context["retention"], session_scope=sessionmaker(bind=db_engine),
+        run_db=lambda fn, *args: fn(*args),
+    )
+    context["archived"] = archiver.run_once()
+
+
+@when(parsers.parse("{ms:d} ms pass"))
+def time_passes(ms):
+    time.sleep(ms / 1000)
+
+
+@when(parsers.parse(
+    'I send a "{event_type}" webhook for payment "{pid}" while counting archive lookups'
+))
+def send_counting_archive_lookups(event_type, pid, client, context, db_engine):
+    lookups = []
+
+    def on_execute(conn, cursor, statement, parameters, ctx, executemany):
+        if "archived_webhooks" in statement:
+            lookups.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", on_execute)
+    try:
+        context["response"] = _post_webhook(
+            client, make_webhook_payload(event_type=event_type, payment_id=pid),
+        )
+    finally:
+        event.remove(db_engine, "before_cursor_execute", on_execute)
+    context["archive_lookups"] = lookups
+
+
+@when(parsers.parse(
+    'I resend archived event {index:d} as "{event_type}" for payment "{pid}"'
+))
+def resend_archived(index, event_type, pid, client, context):
+    webhook_id = context["archivable"][index][0]
+    payload = make_webhook_payload(event_type=event_type, payment_id=pid, webhook_id=webhook_id)
+    context["response"] = _post_webhook(client, payload)
+
+
+@when(parsers.parse(
+    'I process archived event {index:d} and a new event as "{event_type}" '
+    'for payment "{pid}" in one batch'
+))
+def batch_with_archived(index, event_type, pid, db_session, context):
+    events = []
+    for webhook_id in (context["archivable"][index][0], None):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid, webhook_id=webhook_id)
+        events.append(BatchEvent(payload["webhook_id"], event_type, pid, json.dumps(payload)))
+    context["batch_results"] = process_events(db_session, events)
+
+
+@when("every archive segment is written a second time")
+def duplicate_segments(context):
+    for path in context["archive_dir"].glob("*.jsonl.gz"):
+        data = path.read_bytes()
+        path.write_bytes(data + data)
+
+
+@when("the receiver starts")
+def receiver_starts(app_options, request, context):
+    app_options["retention"] = dataclasses.replace(app_options["retention"], interval=0.05)
+    context["client"] = request.getfixturevalue("client")
+
+
+@when("I drop redundant indexes")
+def drop_indexes(db_engine):
+    drop_redundant_indexes(db_engine)
+
+
+@then(parsers.parse("{n:d} events should have been archived in {batches:d} batches"))
+def archived_count(n, batches, app, context):
+    assert context["archived"] == n
+    assert app.state.archiver.stats()["batches"] == batches
+
+
+@then(parsers.parse("{n:d} events should remain in the events table"))
+def remaining_events(n, db_session):
+    assert db_session.scalar(select(func.count()).select_from(WebhookEvent)) == n
+
+
+@then(parsers.parse("the archive should hold the {n:d} old processed events with their payloads"))
+def archive_contents(n, context):
+    records = list(read_archive(context["archive_dir"]))
+    assert len(records) == n
+    assert {(r["webhook_id"], r["payload"]) for r in records} == set(context["archivable"])
+    assert {r["processing_status"] for r in records} == {"processed"}
+
+
+@then("the response should be marked idempotent")
+def response_idempotent(context):
+    assert context["response"].json().get("idempotent") is True
+
+
+@then(parsers.parse('the batch results should be "{expected}"'))
+def batch_results(expected, context):
+    outcomes = [
+        "idempotent" if r.get("idempotent") else r["status"] for r in context["batch_results"]
+    ]
+    assert outcomes == expected.split(",")
+
+
+@then("no archived fingerprints should remain")
+def no_fingerprints(db_session):
+    assert db_session.scalar(select(func.count()).select_from(ArchivedWebhook)) == 0
+
+
+@then(parsers.parse("the retention metrics should report {n:d} archived events"))
+def retention_metrics(n, context):
+    deadline = time.monotonic() + 5
+    while True:
+        stats = context["client"].get("/metrics").json()["retention"]
+        if stats["archived"] >= n or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert stats["archived"] == n, stats
+
+
+@then(parsers.parse('the events table should have exactly one index covering "{column}"'))
+def single_index(column, db_engine):
+    with db_engine.connect() as conn:
+        covering = [
+            name for _, name, *_ in conn.execute(text("PRAGMA index_list(webhook_events)"))
+            if [info[2] for info in conn.execute(text(f"PRAGMA index_info('{name}')"))] == [column]
+        ]
+    assert len(covering) == 1, covering
+
+
+@then(parsers.parse("no archive batch should have taken longer than {seconds:f} seconds"))
+def batch_duration(seconds, app):
+    stats = app.state.archiver.stats()
+    assert stats["max_batch_seconds"] < seconds, stats
+
+
+@then("no archive lookup should have been made")
+def no_archive_lookup(context):
+    assert context["archive_lookups"] == [], context["archive_lookups"]
@@ -1,11 +1,18 @@
 import inspect
 import json
+import time
 
-from pytest_bdd import parsers, scenarios, then, when
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy.exc import OperationalError
+from starlette.testclient import TestClient
 
+from app import main
 from app import signature as sig_module
-from app.signature import SIGNATURE_HEADER, TIMESTAMP_HEADER
+from app.main import create_app
+from app.replay import MemoryReplayStore
+from app.signature import KEY_ID_HEADER, SIGNATURE_HEADER, TIMESTAMP_HEADER, SigningKey
 from tests.fixtures.payloads import make_webhook_payload
+from tests.helpers.asgi import send_chunked
 from tests.helpers.signing import signed_headers, tampered_headers
 from tests.step_defs.common_steps import WEBHOOK_SECRET, WEBHOOK_URL
 
@@ -91,3 +98,212 @@ def check_uses_compare_digest():
     assert "hmac.compare_digest" in source, (
         "verify_signature does not use hmac.compare_digest"
     )
+
+
+def _chunked(body: bytes, size: int) -> list[bytes]:
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def _padded_body(megabytes: int) -> bytes:
+    payload = make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")
+    payload["padding"] = "x" * (megabytes * 1024 * 1024)
+    return json.dumps(payload).encode()
+
+
+@when(parsers.parse(
+    'I stream a valid "{event_type}" webhook for payment "{pid}" in {size:d}-byte chunks'
+))
+def stream_valid(event_type, pid, size, client, app, context):
+    body = json.dumps(make_webhook_payload(event_type=event_type, payment_id=pid)).encode()
+    headers = signed_headers(secret=WEBHOOK_SECRET, body=body)
+    context["streamed"] = send_chunked(app, WEBHOOK_URL, headers, _chunked(body, size))
+
+
+@when(parsers.parse(
+    "I stream a {mb:d} megabyte webhook with a signature that is {age:d} seconds old "
+    "in {kb:d} KB chunks"
+))
+def stream_expired(mb, age, kb, app, context):
+    body = _padded_body(mb)
+    headers = signed_headers(secret=WEBHOOK_SECRET, body=body, age_seconds=age)
+    context["streamed"] = send_chunked(app, WEBHOOK_URL, headers, _chunked(body, kb * 1024))
+
+
+@when(parsers.parse("I stream a validly signed {mb:d} megabyte webhook in {chunk_mb:d} MB chunks"))
+def stream_oversized(mb, chunk_mb, app, context):
+    body = _padded_body(mb)
+    headers = signed_headers(secret=WEBHOOK_SECRET, body=body)
+    context["streamed"] = send_chunked(
+        app, WEBHOOK_URL, headers, _chunked(body, chunk_mb * 1024 * 1024),
+    )
+
+
+@then(parsers.parse("the streamed response status should be {code:d}"))
+def check_streamed_status(code, context):
+    status, body, _ = context["streamed"]
+    assert status == code, f"Expected {code}, got {status}: {body}"
+
+
+@then(parsers.parse("{n:d} body chunks should have been read"))
+def check_chunks_read(n, context):
+    assert context["streamed"][2] == n, context["streamed"]
+
+
+@then(parsers.parse("at most {n:d} body chunks should have been read"))
+def check_chunks_read_at_most(n, context):
+    assert context["streamed"][2] <= n, context["streamed"]
+
+
+def _signing_key(spec: str, **window) -> SigningKey:
+    key_id, secret = spec.split(":")
+    return SigningKey(key_id, secret, **window)
+
+
+@given(parsers.parse('the receiver accepts signing keys "{first}" and "{second}"'))
+def rotation_keys(first, second, app_options):
+    app_options["signing_keys"] = [_signing_key(first), _signing_key(second)]
+
+
+@given(parsers.parse(
+    'the receiver accepts key "{old}" until {seconds:d} seconds ago and key "{new}"'
+))
+def retired_key(old, seconds, new, app_options):
+    app_options["signing_keys"] = [
+        _signing_key(old, not_after=time.time() - seconds), _signing_key(new),
+    ]
+
+
+def _send_signed(client, context, n, secret, extra_headers=None):
+    responses = context.setdefault("responses", [])
+    for _ in range(n):
+        body = json.dumps(
+            make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")
+        ).encode()
+        headers = {**signed_headers(secret=secret, body=body), **(extra_headers or {})}
+        responses.append(_post_raw(client, body, headers))
+    context["response"] = responses[-1]
+
+
+@when(parsers.parse('I send {n:d} webhook signed with "{secret}"'))
+@when(parsers.parse('I send {n:d} webhooks signed with "{secret}"'))
+def send_signed_with(n, secret, client, context):
+    _send_signed(client, context, n, secret)
+
+
+@when(parsers.parse('I send {n:d} webhooks signed with "{secret}" and key id "{key_id}"'))
+def send_signed_with_hint(n, secret, key_id, client, context):
+    _send_signed(client, context, n, secret, {KEY_ID_HEADER: key_id})
+
+
+@then(parsers.parse(
+    'the keyring should have verified {n_first:d} request with key "{first}" '
+    'and {n_second:d} with key "{second}"'
+))
+def check_key_usage(n_first, first, n_second, second, client):
+    keys = client.get("/metrics").json()["signature_keys"]["keys"]
+    assert keys[first]["verified"] == n_first, keys
+    assert keys[second]["verified"] == n_second, keys
+
+
+@then(parsers.parse("the keyring should have computed {n:d} fallback HMAC"))
+def check_fallbacks(n, client):
+    stats = client.get("/metrics").json()["signature_keys"]
+    assert stats["fallback_hmacs"] == n, stats
+
+
+@given(parsers.parse('replay protection uses the "{backend}" store'))
+def replay_backend(backend, app_options):
+    app_options["replay_protection"] = backend
+
+
+def _signed_request(secret=WEBHOOK_SECRET, age_seconds=0):
+    body = json.dumps(
+        make_webhook_payload(event_type="payment.authorized", payment_id="pay_001")
+    ).encode()
+    return body, signed_headers(secret=secret, body=body, age_seconds=age_seconds)
+
+
+@when('I send the same signed "payment.authorized" webhook for payment "pay_001" twice')
+def send_replayed(client, context):
+    body, headers = _signed_request()
+    context["responses"] = [_post_raw(client, body, headers) for _ in range(2)]
+
+
+@when(
+    'I send a signed "payment.authorized" webhook for payment "pay_001" '
+    "while the database is down, then again once it is back"
+)
+def send_during_outage(client, monkeypatch, context):
+    def fail(*args):
+        raise OperationalError("UPDATE payments", {}, Exception("database is locked"))
+
+    body, headers = _signed_request()
+    with monkeypatch.context() as outage:
+        outage.setattr(main, "_process_in_session", fail)
+        outage.setattr(main, "DB_RETRY_DELAY", 0)
+        first = _post_raw(client, body, headers)
+    context["responses"] = [first, _post_raw(client, body, headers)]
+
+
+@when(
+    'I send the same "payment.authorized" webhook for payment "pay_001" signed 5 seconds apart'
+)
+def send_resigned(client, context):
+    body, _ = _signed_request()
+    context["responses"] = [
+        _post_raw(client, body, signed_headers(secret=WEBHOOK_SECRET, body=body, age_seconds=age))
+        for age in (5, 0)
+    ]
+
+
+@when(
+    'I send a signed "payment.authorized" webhook for payment "pay_001" '
+    "to one worker and replay it to another"
+)
+def send_replayed_across_workers(client, app, context):
+    other = create_app(webhook_secret=WEBHOOK_SECRET, replay_protection="database")
+    other.dependency_overrides.update(app.dependency_overrides)
+    body, headers = _signed_request()
+    first = _post_raw(client, body, headers)
+    with TestClient(other, raise_server_exceptions=False) as other_client:
+        second = _post_raw(other_client, body, headers)
+    context["responses"] = [first, second]
+
+
+@then(parsers.parse("the responses should have statuses {first:d} and {second:d}"))
+def check_two_statuses(first, second, context):
+    codes = [r.status_code for r in context["responses"]]
+    assert codes == [first, second], [r.text for r in context["responses"]]
+
+
+@then(parsers.parse("the replay cache should report {n:d} replay"))
+def check_replays(n, client):
+    stats = client.get("/metrics").json()["replay_cache"]
+    assert stats["replays"] == n, stats
+
+
+@given(parsers.parse("an in-memory replay store with {seconds:d} second buckets"))
+def memory_replay_store(seconds, context):
+    context["replay_store"] = MemoryReplayStore(bucket_seconds=seconds)
+    context["now"] = time.time()
+
+
+@when(parsers.parse("{n:d} signatures are recorded over the last {window:d} seconds"))
+def record_signatures(n, window, context):
+    store, now = context["replay_store"], context["now"]
+    for i in range(n):
+        timestamp = int(now - window + i * window / n)
+        assert store.check_and_add(f"sig-{i}", timestamp, now=now)
+    assert store.stats()["size"] == n
+
+
+@when(parsers.parse("the clock moves forward {seconds:d} seconds"))
+def advance_clock(seconds, context):
+    context["now"] += seconds
+    context["replay_store"].check_and_add("sig-new", int(context["now"]), now=context["now"])
+
+
+@then("only the signature recorded after the move should be left, in 1 bucket")
+def check_replay_store(context):
+    stats = context["replay_store"].stats()
+    assert (stats["size"], stats["buckets"]) == (1, 1), stats
@@ -0,0 +1,177 @@
+import json
+import logging
+import time
+
+from pytest_bdd import given, parsers, scenarios, then, when
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.batch import BatchEvent, process_events
+from app.database import EngineConfig, create_db_engine
+from app.models import Base, Payment, WebhookEvent
+from app.payloads import PAYLOAD_STORAGE_MODES, ensure_payload_column, migrate_payloads
+from tests.fixtures.payloads import make_payment_record, make_webhook_payload
+
+scenarios("storage.feature")
+
+logger = logging.getLogger(__name__)
+
+
+@given(parsers.parse('the receiver stores payloads as "{mode}"'))
+def receiver_payload_storage(mode, app_options, context):
+    app_options["payload_storage"] = mode
+    context["payload_storage"] = mode
+
+
+@given(parsers.parse('{n:d} events stored with text payloads for payment "{pid}"'))
+def text_events(n, pid, db_session, context):
+    bodies = {}
+    for _ in range(n):
+        payload = make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+        body = json.dumps(payload)
+        db_session.add(WebhookEvent(
+            webhook_id=payload["webhook_id"], payment_id=pid,
+            event_type=payload["event_type"], payload=body,
+            processing_status="processed",
+        ))
+        bodies[payload["webhook_id"]] = body
+    db_session.commit()
+    context["bodies"] = bodies
+
+
+@given("a file-backed events table without the compressed payload column")
+def legacy_events_table(tmp_path, context):
+    engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp_path / 'legacy.db'}"))
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE webhook_events DROP COLUMN payload_zlib"))
+    context["legacy_engine"] = engine
+
+
+@when(parsers.parse('I process a batch of {n:d} "{event_type}" events for payment "{pid}"'))
+def process_batch(n, event_type, pid, db_session, context):
+    events = []
+    for _ in range(n):
+        payload = make_webhook_payload(event_type=event_type, payment_id=pid)
+        events.append(BatchEvent(
+            payload["webhook_id"], event_type, pid, json.dumps(payload),
+        ))
+    process_events(db_session, events, payload_storage=context["payload_storage"])
+    context["bodies"] = {e.webhook_id: e.payload for e in events}
+
+
+@when(parsers.parse('I migrate stored payloads to "{mode}" in batches of {size:d}'))
+def migrate(mode, size, db_session, context):
+    context["migrated"] = migrate_payloads(db_session, mode, batch_size=size)
+
+
+@when("I ensure the compressed payload column exists")
+def ensure_column(context):
+    context["column_added"] = ensure_payload_column(context["legacy_engine"])
+
+
+@when(parsers.parse(
+    "I insert {n:d} events in each payload storage mode into a file-backed database"
+))
+def insert_in_each_mode(n, tmp_path, context):
+    report = {}
+    for mode in PAYLOAD_STORAGE_MODES:
+        engine = create_db_engine(EngineConfig(url=f"sqlite:///{tmp_path / f'{mode}.db'}"))
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+        pids = [f"pay_{i:04d}" for i in range(n)]
+        with Session() as db:
+            db.add_all(Payment(**make_payment_record(payment_id=pid)) for pid in pids)
+            db.commit()
+            events = []
+            for pid in pids:
+                payload = make_webhook_payload(event_type="payment.authorized", payment_id=pid)
+                events.append(BatchEvent(
+                    payload["webhook_id"], "payment.authorized", pid, json.dumps(payload),
+                ))
+            started = time.perf_counter()
+            for start in range(0, n, 100):
+                process_events(db, events[start:start + 100], payload_storage=mode)
+            elapsed = time.perf_counter() - started
+            stored = db.scalar(select(func.sum(
+                func.coalesce(func.length(WebhookEvent.payload_text), 0)
+                + func.coalesce(func.length(WebhookEvent.payload_zlib), 0)
+            )))
+        engine.dispose()
+        report[mode] = {"bytes_per_event": stored / n, "events_per_sec": n / elapsed}
+        logger.info(
+            "payload storage %-9s: %6.1f bytes/event, %8.0f inserts/s",
+            mode, stored / n, n / elapsed,
+        )
+    context["storage_report"] = report
+
+
+@then("the stored payload should equal the request body")
+def stored_payload_matches(db_session, context):
+    body = context["response"].request.content.decode()
+    webhook_id = json.loads(body)["webhook_id"]
+    event = db_session.scalars(
+        select(WebhookEvent).where(WebhookEvent.webhook_id == webhook_id)
+    ).one()
+    assert event.payload == body
+
+
+@then(parsers.parse('the stored payload should be kept in the "{column}" column'))
+def stored_in_column(column, db_session):
+    row = db_session.execute(text("SELECT payload, payload_zlib FROM webhook_events")).one()
+    assert row._mapping[column] is not None
+    other = "payload_zlib" if column == "payload" else "payload"
+    assert row._mapping[other] is None
+
+
+@then("every stored payload should equal its event body")
+def every_payload_matches(db_session, context):
+    db_session.expire_all()
+    stored = {e.webhook_id: e.payload for e in db_session.scalars(select(WebhookEvent))}
+    assert stored == context["bodies"]
+
+
+@then(parsers.parse('no stored payload should be kept in the "{column}" column'))
+def column_empty(column, db_session):
+    assert db_session.scalar(
+        text(f"SELECT COUNT(*) FROM webhook_events WHERE {column} IS NOT NULL")
+    ) == 0
+
+
+@then(parsers.parse("{n:d} payloads should have been migrated"))
+def migrated_count(n, context):
+    assert context["migrated"] == n
+
+
+@then(parsers.parse('the events table should have a "{column}" column'))
+def events_table_has_column(column, context):
+    columns = {c["name"] for c in inspect(context["legacy_engine"]).get_columns("webhook_events")}
+    assert context["column_added"] is True
+    assert column in columns
+
+
+@then("ensuring the column again should change nothing")
+def ensure_is_idempotent(context):
+    assert ensure_payload_column(context["legacy_engine"]) is False
+    context["legacy_engine"].dispose()
+
+
+@then(parsers.parse(
+    '"{mode}" payloads should use at most {percent:d}% of the "{baseline}" bytes per event'
+))
+def bytes_ratio(mode, percent, baseline, context):
+    report = context["storage_report"]
+    ratio = report[mode]["bytes_per_event"] / report[baseline]["bytes_per_event"]
+    assert ratio <= percent / 100, f"{mode} uses {ratio:.0%} of {baseline}"
+
+
+@then(parsers.parse('"{mode}" payloads should use fewer bytes per event than "{other}"'))
+def fewer_bytes(mode, other, context):
+    report = context["storage_report"]
+    assert report[mode]["bytes_per_event"] < report[other]["bytes_per_event"]
+
+
+@then(parsers.parse('"{mode}" inserts should run at least half as fast as "{baseline}" inserts'))
+def insert_throughput(mode, baseline, context):
+    report = context["storage_report"]
+    assert report[mode]["events_per_sec"] >= report[baseline]["events_per_sec"] / 2